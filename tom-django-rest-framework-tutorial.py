@@ -1550,4 +1550,6727 @@
 
 		# Usar views pode ser uma abstração realmente útil. Isso ajuda a garantir que as convenções de URL sejam consistentes em sua API, minimiza a quantidade de código que você precisa escrever e permite que você se concentre nas interações e representações que sua API fornece, em vez das especificidades do URL conf.
 
-		# Isso não significa que é sempre a abordagem correta a ser adotada. Há um conjunto semelhante de trade-offs a serem considerados como ao usar views baseadas em classe em vez de views baseadas em função. O uso de conjuntos de views é menos explícito do que criar suas views individualmente. 
\ No newline at end of file
+		# Isso não significa que é sempre a abordagem correta a ser adotada. Há um conjunto semelhante de trade-offs a serem considerados como ao usar views baseadas em classe em vez de views baseadas em função. O uso de conjuntos de views é menos explícito do que criar suas views individualmente. 
+
+
+
+# ##############################################################################
+# ##############################################################################
+# ##############################################################################
+# ##############################################################################
+18-10-2026 09:10
+
+	# 7 - Desempenho (performance) - notas do tom
+	# Continuação do tutorial: o que mudar no projeto snippets quando a API começa a receber tráfego de verdade.
+
+
+	# Tutorial 7: Desempenho
+
+		# Até aqui o Snippet.save() roda o pygments a cada POST/PUT. Com um paste de 200 KB o worker fica preso centenas de milissegundos só destacando o código. Nas próximas seções vamos tirar esse custo do caminho da requisição e atacar os outros gargalos (consultas, paginação, serialização, cache).
+
+
+
+	# Destaque (highlight) em segundo plano
+
+		# A ideia: o save() grava a linha imediatamente e coloca o snippet numa fila. Um pool de workers (threads ou processos) renderiza o highlighted depois. A ação highlight responde "pending" enquanto o HTML não está pronto.
+
+		# Cada save incrementa highlight_version. O worker só grava o HTML se a versão ainda for a mesma, com um único UPDATE, então uma leitura nunca vê HTML pela metade e renderizações velhas são descartadas. Se o mesmo snippet for salvo várias vezes antes do worker pegar o job, só a última versão é renderizada (deduplicação).
+
+		# Crie o arquivo snippets/highlighting.py:
+
+			import queue
+			import threading
+			from concurrent.futures import ProcessPoolExecutor
+
+			from django.conf import settings
+			from django.db import close_old_connections
+			from django.utils.module_loading import import_string
+			from pygments import highlight
+			from pygments.formatters.html import HtmlFormatter
+			from pygments.lexers import get_lexer_by_name
+
+
+			def render_highlight(code, language, style, linenos, title):
+			    """
+			    Use the `pygments` library to create a highlighted HTML
+			    representation of the code snippet.
+			    """
+			    lexer = get_lexer_by_name(language)
+			    linenos = 'table' if linenos else False
+			    options = {'title': title} if title else {}
+			    formatter = HtmlFormatter(style=style, linenos=linenos,
+			                              full=True, **options)
+			    return highlight(code, lexer, formatter)
+
+
+			def render_snippet(pk, version, executor=None):
+			    """
+			    Render one snippet version and store it, unless a newer save
+			    has superseded it in the meantime.
+			    """
+			    from snippets.models import Snippet
+
+			    row = (Snippet.objects.filter(pk=pk, highlight_version=version)
+			           .values('code', 'language', 'style', 'linenos', 'title')
+			           .first())
+			    if row is None:
+			        return
+			    if executor is None:
+			        html = render_highlight(**row)
+			    else:
+			        html = executor.submit(render_highlight, **row).result()
+			    Snippet.objects.filter(pk=pk, highlight_version=version).update(
+			        highlighted=html, highlight_state=Snippet.HIGHLIGHT_READY)
+
+
+			class ImmediateBackend:
+			    """
+			    Render inside the calling thread. Handy for tests and for the shell.
+			    """
+			    def submit(self, pk, version):
+			        render_snippet(pk, version)
+
+
+			class LocalQueueBackend:
+			    """
+			    In-process queue drained by a pool of daemon threads.
+
+			    Jobs for the same snippet are coalesced, so only the latest
+			    version gets rendered. With executor='process' the pygments
+			    work runs in a process pool and uses every core.
+			    """
+			    def __init__(self, workers=2, executor='thread'):
+			        self.queue = queue.Queue()
+			        self.latest = {}
+			        self.lock = threading.Lock()
+			        self.executor = None
+			        if executor == 'process':
+			            self.executor = ProcessPoolExecutor(max_workers=workers)
+			        for _ in range(workers):
+			            threading.Thread(target=self.work, daemon=True).start()
+
+			    def submit(self, pk, version):
+			        with self.lock:
+			            queued = pk in self.latest
+			            self.latest[pk] = version
+			        if not queued:
+			            self.queue.put(pk)
+
+			    def work(self):
+			        while True:
+			            pk = self.queue.get()
+			            with self.lock:
+			                version = self.latest.pop(pk)
+			            try:
+			                render_snippet(pk, version, self.executor)
+			            finally:
+			                close_old_connections()
+			                self.queue.task_done()
+
+
+			_backend = None
+			_backend_lock = threading.Lock()
+
+
+			def get_backend():
+			    global _backend
+			    with _backend_lock:
+			        if _backend is None:
+			            config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			            backend_class = import_string(config.get(
+			                'BACKEND', 'snippets.highlighting.LocalQueueBackend'))
+			            _backend = backend_class(**config.get('OPTIONS', {}))
+			    return _backend
+
+
+
+		# Agora o modelo. Em snippets/models.py adicione os campos de estado e troque o método save():
+
+			from django.db import transaction
+			from snippets.highlighting import get_backend
+
+
+			class Snippet(models.Model):
+			    HIGHLIGHT_PENDING = 'pending'
+			    HIGHLIGHT_READY = 'ready'
+			    HIGHLIGHT_STATES = [(HIGHLIGHT_PENDING, 'pending'),
+			                        (HIGHLIGHT_READY, 'ready')]
+
+			    created = models.DateTimeField(auto_now_add=True)
+			    title = models.CharField(max_length=100, blank=True, default='')
+			    code = models.TextField()
+			    linenos = models.BooleanField(default=False)
+			    language = models.CharField(choices=LANGUAGE_CHOICES, default='python', max_length=100)
+			    style = models.CharField(choices=STYLE_CHOICES, default='friendly', max_length=100)
+			    owner = models.ForeignKey('auth.User', related_name='snippets', on_delete=models.CASCADE)
+			    highlighted = models.TextField(blank=True, default='')
+			    highlight_state = models.CharField(choices=HIGHLIGHT_STATES, default=HIGHLIGHT_PENDING, max_length=10)
+			    highlight_version = models.PositiveIntegerField(default=0)
+
+			    class Meta:
+			        ordering = ['created']
+
+			    def save(self, *args, **kwargs):
+			        """
+			        Store the row right away and queue the highlighted HTML
+			        representation on the background pipeline.
+			        """
+			        self.highlight_state = self.HIGHLIGHT_PENDING
+			        self.highlight_version += 1
+			        super(Snippet, self).save(*args, **kwargs)
+			        pk, version = self.pk, self.highlight_version
+			        transaction.on_commit(lambda: get_backend().submit(pk, version))
+
+
+		# O on_commit garante que o worker só procura a linha depois que a transação foi confirmada.
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+
+		# A ação highlight do SnippetViewSet passa a responder 202 enquanto o HTML está sendo gerado (o mesmo vale para SnippetHighlight.get):
+
+			from rest_framework import status
+
+
+			    @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
+			    def highlight(self, request, *args, **kwargs):
+			        snippet = self.get_object()
+			        if snippet.highlight_state == Snippet.HIGHLIGHT_PENDING:
+			            return Response('pending', status=status.HTTP_202_ACCEPTED,
+			                            headers={'Retry-After': '1'})
+			        return Response(snippet.highlighted)
+
+
+
+		# Em tutorial/settings.py escolhemos o backend. O padrão é a fila local com threads; para usar todos os núcleos troque executor para 'process'.
+
+			SNIPPETS_HIGHLIGHT = {
+			    'BACKEND': 'snippets.highlighting.LocalQueueBackend',
+			    'OPTIONS': {'workers': 2, 'executor': 'thread'},
+			}
+
+
+		# Nos testes é melhor renderizar na hora, senão o teste termina antes do worker:
+
+			SNIPPETS_HIGHLIGHT = {'BACKEND': 'snippets.highlighting.ImmediateBackend'}
+
+
+		# tom
+			http -a admin:adminadmin POST http://127.0.0.1:8000/snippets/ code="print(789)"
+			http http://127.0.0.1:8000/snippets/1/highlight/
+				# HTTP/1.1 202 Accepted   (logo depois do POST)
+				# HTTP/1.1 200 OK         (quando o worker termina)
+
+
+	# Cache do HTML renderizado, endereçado pelo conteúdo
+
+		# Muitos snippets são cópias exatas: o mesmo boilerplate colado milhares de vezes, ou um PUT que não muda nada passando pelo SnippetSerializer.update(). Mesmo assim cada save renderiza tudo de novo.
+
+		# A saída do pygments depende só de (code, language, style, linenos, title). Um hash dessas entradas serve de chave para um cache LRU limitado por quantidade de entradas e por bytes, com uma camada opcional em disco. O mesmo hash fica gravado no snippet (render_key), e um save que não mexe em nenhuma dessas entradas não toca no highlighted.
+
+		# Em snippets/highlighting.py adicione:
+
+			import hashlib
+			import os
+			import tempfile
+			from collections import OrderedDict
+
+
+			def render_key(code, language, style, linenos, title):
+			    """
+			    Content address of a render: a hash of every input pygments sees.
+			    """
+			    digest = hashlib.sha256()
+			    for part in (code, language, style, 'table' if linenos else '', title):
+			        data = part.encode('utf-8')
+			        digest.update(b'%d:' % len(data))
+			        digest.update(data)
+			    return digest.hexdigest()
+
+
+			class RenderCache:
+			    """
+			    LRU cache of rendered HTML, bounded by entry count and by total
+			    bytes, with an optional on-disk tier below it.
+			    """
+			    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, directory=None):
+			        self.entries = OrderedDict()
+			        self.size = 0
+			        self.max_entries = max_entries
+			        self.max_bytes = max_bytes
+			        self.directory = directory
+			        self.lock = threading.Lock()
+
+			    def get(self, key):
+			        with self.lock:
+			            entry = self.entries.get(key)
+			            if entry is not None:
+			                self.entries.move_to_end(key)
+			                return entry[0]
+			        html = self.read_disk(key)
+			        if html is not None:
+			            self.store(key, html)
+			        return html
+
+			    def set(self, key, html):
+			        self.store(key, html)
+			        self.write_disk(key, html)
+
+			    def store(self, key, html):
+			        size = len(html.encode('utf-8'))
+			        if size > self.max_bytes:
+			            return
+			        with self.lock:
+			            old = self.entries.pop(key, None)
+			            if old is not None:
+			                self.size -= old[1]
+			            self.entries[key] = (html, size)
+			            self.size += size
+			            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+			                _, (_, evicted) = self.entries.popitem(last=False)
+			                self.size -= evicted
+
+			    def path(self, key):
+			        return os.path.join(self.directory, key[:2], key + '.html')
+
+			    def read_disk(self, key):
+			        if not self.directory:
+			            return None
+			        try:
+			            with open(self.path(key), encoding='utf-8') as f:
+			                return f.read()
+			        except FileNotFoundError:
+			            return None
+
+			    def write_disk(self, key, html):
+			        if not self.directory:
+			            return
+			        path = self.path(key)
+			        os.makedirs(os.path.dirname(path), exist_ok=True)
+			        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+			        try:
+			            with open(fd, 'w', encoding='utf-8') as f:
+			                f.write(html)
+			            os.replace(tmp, path)
+			        except BaseException:
+			            os.unlink(tmp)
+			            raise
+
+
+			_render_cache = None
+
+
+			def get_render_cache():
+			    global _render_cache
+			    with _backend_lock:
+			        if _render_cache is None:
+			            config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			            _render_cache = RenderCache(**config.get('CACHE', {}))
+			    return _render_cache
+
+
+		# O os.replace() troca o arquivo de uma vez, então outro processo nunca lê um arquivo do cache pela metade. O arquivo temporário vem do mkstemp() na mesma pasta (o os.replace() só é atômico dentro do mesmo sistema de arquivos), com um nome único: dois workers gunicorn com o mesmo thread ident não escrevem no mesmo .tmp.
+
+		# O render_snippet() consulta o cache antes de chamar o pygments e guarda o resultado depois:
+
+			def render_snippet(pk, version, executor=None):
+			    """
+			    Render one snippet version and store it, unless a newer save
+			    has superseded it in the meantime.
+			    """
+			    from snippets.models import Snippet
+
+			    row = (Snippet.objects.filter(pk=pk, highlight_version=version)
+			           .values('code', 'language', 'style', 'linenos', 'title')
+			           .first())
+			    if row is None:
+			        return
+			    cache = get_render_cache()
+			    key = render_key(**row)
+			    html = cache.get(key)
+			    if html is None:
+			        if executor is None:
+			            html = render_highlight(**row)
+			        else:
+			            html = executor.submit(render_highlight, **row).result()
+			        cache.set(key, html)
+			    Snippet.objects.filter(pk=pk, highlight_version=version).update(
+			        highlighted=html, highlight_state=Snippet.HIGHLIGHT_READY)
+
+
+
+		# No modelo, um campo novo com a chave da última renderização:
+
+			    render_key = models.CharField(max_length=64, blank=True, default='')
+
+
+		# E o save() fica assim. Se a chave não mudou não há nada para renderizar; se o HTML já está no cache ele é gravado junto com a linha e nem passa pela fila.
+
+			from snippets.highlighting import get_backend, get_render_cache, render_key
+
+			RENDER_INPUTS = {'code', 'language', 'style', 'linenos', 'title'}
+			RENDER_FIELDS = {'render_key', 'highlight_version', 'highlight_state', 'highlighted'}
+
+
+			    def save(self, *args, **kwargs):
+			        """
+			        Store the row right away. The highlighted HTML comes from the
+			        render cache when possible, otherwise it is queued on the
+			        background pipeline.
+			        """
+			        update_fields = kwargs.get('update_fields')
+			        if update_fields is not None and RENDER_INPUTS.intersection(update_fields):
+			            kwargs['update_fields'] = RENDER_FIELDS.union(update_fields)
+			        key = render_key(self.code, self.language, self.style,
+			                         self.linenos, self.title)
+			        if key == self.render_key:
+			            super(Snippet, self).save(*args, **kwargs)
+			            return
+			        self.render_key = key
+			        self.highlight_version += 1
+			        html = get_render_cache().get(key)
+			        if html is not None:
+			            self.highlighted = html
+			            self.highlight_state = self.HIGHLIGHT_READY
+			            super(Snippet, self).save(*args, **kwargs)
+			            return
+			        self.highlight_state = self.HIGHLIGHT_PENDING
+			        super(Snippet, self).save(*args, **kwargs)
+			        pk, version = self.pk, self.highlight_version
+			        transaction.on_commit(lambda: get_backend().submit(pk, version))
+
+
+		# Atenção ao save(update_fields=[...]). Se a lista tem algum campo que entra na render_key (code, language, style, linenos, title), o save() acrescenta os campos do highlight nela: sem isso a versão nova iria para a fila mas não para o banco, o worker acharia que ela foi superada e a linha ficaria com o HTML antigo. Uma lista sem nenhum desses campos passa como veio, porque a chave não muda.
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+		# Os limites do cache vão junto com o resto da configuração em tutorial/settings.py:
+
+			SNIPPETS_HIGHLIGHT = {
+			    'BACKEND': 'snippets.highlighting.LocalQueueBackend',
+			    'OPTIONS': {'workers': 2, 'executor': 'thread'},
+			    'CACHE': {
+			        'max_entries': 1024,
+			        'max_bytes': 64 * 1024 * 1024,
+			        'directory': os.path.join(BASE_DIR, 'highlight-cache'),
+			    },
+			}
+
+
+		# tom
+			# o segundo PUT igual não gera job nenhum, e o highlight já volta 200 direto
+			http -a admin:adminadmin PUT http://127.0.0.1:8000/snippets/1/ code="print(789)"
+			http -a admin:adminadmin PUT http://127.0.0.1:8000/snippets/1/ code="print(789)"
+			http http://127.0.0.1:8000/snippets/1/highlight/
+
+
+	# LANGUAGE_CHOICES e STYLE_CHOICES pré-calculados
+
+		# O snippets/models.py monta LEXERS, LANGUAGE_CHOICES e STYLE_CHOICES na importação. Isso percorre todos os lexers e estilos do pygments (inclusive plugins) em todo processo que sobe: runserver, cada manage.py, cada rodada de testes.
+
+		# Vamos gerar essas tabelas uma vez num módulo congelado, snippets/_choices.py, com um comando de management para regenerar. Se o módulo não existir, ou foi gerado com outra versão do pygments, as tabelas são montadas como antes.
+
+		# Crie o arquivo snippets/choices.py:
+
+			import os
+
+			import pygments
+
+
+			def build_choices():
+			    """
+			    Walk every pygments lexer and style and return the sorted
+			    (LANGUAGE_CHOICES, STYLE_CHOICES) tables.
+			    """
+			    from pygments.lexers import get_all_lexers
+			    from pygments.styles import get_all_styles
+
+			    lexers = [item for item in get_all_lexers() if item[1]]
+			    language_choices = sorted([(item[1][0], item[0]) for item in lexers])
+			    style_choices = sorted([(item, item) for item in get_all_styles()])
+			    return tuple(language_choices), tuple(style_choices)
+
+
+			def load_choices():
+			    if not os.environ.get('SNIPPETS_BUILD_CHOICES'):
+			        try:
+			            from snippets import _choices
+			        except ImportError:
+			            pass
+			        else:
+			            if _choices.PYGMENTS_VERSION == pygments.__version__:
+			                return _choices.LANGUAGE_CHOICES, _choices.STYLE_CHOICES
+			    return build_choices()
+
+
+			LANGUAGE_CHOICES, STYLE_CHOICES = load_choices()
+
+
+		# Importar só o pacote pygments é barato, ele não carrega lexer nenhum. A variável de ambiente SNIPPETS_BUILD_CHOICES força o caminho antigo; ela existe para o benchmark abaixo.
+
+		# Em snippets/models.py, troque as três linhas do começo por:
+
+			from snippets.choices import LANGUAGE_CHOICES, STYLE_CHOICES
+
+
+		# O serializers.py continua importando LANGUAGE_CHOICES e STYLE_CHOICES de snippets.models, nada muda lá.
+
+
+
+		# O comando que gera o módulo. Crie snippets/management/__init__.py e snippets/management/commands/__init__.py vazios, e depois snippets/management/commands/freeze_choices.py:
+
+			import os
+			import pprint
+
+			import pygments
+			from django.core.management.base import BaseCommand
+
+			from snippets.choices import build_choices
+
+
+			class Command(BaseCommand):
+			    help = 'Regenerate snippets/_choices.py from the installed pygments.'
+
+			    def handle(self, *args, **options):
+			        language_choices, style_choices = build_choices()
+			        app_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+			        path = os.path.join(app_dir, '_choices.py')
+			        with open(path, 'w', encoding='utf-8') as f:
+			            f.write('# Generated by "python manage.py freeze_choices". Do not edit.\n\n')
+			            f.write('PYGMENTS_VERSION = %r\n\n' % pygments.__version__)
+			            f.write('LANGUAGE_CHOICES = %s\n\n' % pprint.pformat(language_choices))
+			            f.write('STYLE_CHOICES = %s\n' % pprint.pformat(style_choices))
+			        self.stdout.write(self.style.SUCCESS(
+			            'Wrote %d languages and %d styles to %s'
+			            % (len(language_choices), len(style_choices), path)))
+
+
+			python manage.py freeze_choices
+
+
+		# O snippets/_choices.py gerado vai para o repositório. Sempre que atualizar o pygments (pip install -U pygments), rode o comando de novo; até lá o load_choices() cai no caminho lento, mas continua correto.
+
+
+
+		# Benchmark de inicialização. Crie bench_startup.py ao lado do manage.py. Ele sobe um interpretador novo a cada rodada, porque o que interessa é o custo de importação a frio:
+
+			import os
+			import statistics
+			import subprocess
+			import sys
+
+			SNIPPET = (
+			    'import time; t = time.perf_counter(); '
+			    'import django; django.setup(); '
+			    'import snippets.models, snippets.serializers; '
+			    'print(time.perf_counter() - t)'
+			)
+
+
+			def measure(runs, **env):
+			    env = dict(os.environ, DJANGO_SETTINGS_MODULE='tutorial.settings', **env)
+			    times = []
+			    for _ in range(runs):
+			        output = subprocess.check_output([sys.executable, '-c', SNIPPET], env=env)
+			        times.append(float(output))
+			    return statistics.median(times)
+
+
+			if __name__ == '__main__':
+			    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+			    before = measure(runs, SNIPPETS_BUILD_CHOICES='1')
+			    after = measure(runs)
+			    print('built at import: %.1f ms' % (before * 1000))
+			    print('frozen module:   %.1f ms' % (after * 1000))
+
+
+			python bench_startup.py 20
+
+
+		# tom
+			# para ver onde vai o tempo, módulo por módulo:
+			DJANGO_SETTINGS_MODULE=tutorial.settings python -X importtime -c "import django; django.setup()" 2>&1 | sort -t'|' -k2 -n | tail
+
+
+	# Validação de choices com índice pré-calculado
+
+		# Os campos language e style do SnippetSerializer têm centenas de opções. O ChoiceField do DRF monta três estruturas (choices agrupadas, achatadas e o mapa string -> valor) no __init__, e o serializer faz deepcopy dos campos declarados a cada instância. Ou seja: toda instância de SnippetSerializer copia e reindexa as duas listas inteiras, e o repr(serializer) despeja tudo.
+
+		# A solução é um índice montado uma vez por processo e compartilhado por todas as instâncias do campo. A validação é uma consulta num dict, e a lista agrupada, que só o formulário HTML da API navegável usa, só é montada quando alguém pede.
+
+		# Crie o arquivo snippets/fields.py:
+
+			from functools import cached_property
+
+			from rest_framework import serializers
+			from rest_framework.fields import flatten_choices_dict, to_choices_dict
+
+
+			class ChoiceIndex:
+			    """
+			    Prebuilt, immutable lookup structures for a list of choices.
+			    Shared by every field instance; deepcopy returns the same object.
+			    """
+			    def __init__(self, choices):
+			        self.source = tuple(choices)
+			        self.strings_to_values = {}
+			        for choice in self.source:
+			            if not isinstance(choice, (list, tuple)):
+			                choice = (choice, choice)
+			            key, value = choice
+			            if isinstance(value, (list, tuple)):
+			                # An option group: index its members.
+			                for item in value:
+			                    item = item[0] if isinstance(item, (list, tuple)) else item
+			                    self.strings_to_values[str(item)] = item
+			            else:
+			                self.strings_to_values[str(key)] = key
+
+			    @cached_property
+			    def grouped(self):
+			        return to_choices_dict(self.source)
+
+			    @cached_property
+			    def flat(self):
+			        return flatten_choices_dict(self.grouped)
+
+			    def __contains__(self, value):
+			        return str(value) in self.strings_to_values
+
+			    def __len__(self):
+			        return len(self.strings_to_values)
+
+			    def __deepcopy__(self, memo):
+			        return self
+
+			    def __repr__(self):
+			        return '<ChoiceIndex: %d choices>' % len(self)
+
+
+			def choices_key(choices):
+			    """
+			    A hashable copy of `choices`, with option groups turned into tuples.
+			    """
+			    return tuple(
+			        choices_key(choice) if isinstance(choice, (list, tuple)) else choice
+			        for choice in choices
+			    )
+
+
+			class IndexedChoiceField(serializers.ChoiceField):
+			    """
+			    A ChoiceField that validates against a shared `ChoiceIndex`
+			    instead of rebuilding its choice structures per instance.
+			    """
+			    _indexes = {}
+
+			    def _get_choices(self):
+			        return self.index.flat
+
+			    def _set_choices(self, choices):
+			        if not isinstance(choices, ChoiceIndex):
+			            key = choices_key(choices)
+			            index = self._indexes.get(key)
+			            if index is None:
+			                index = self._indexes.setdefault(key, ChoiceIndex(key))
+			            choices = index
+			        self.index = choices
+
+			    choices = property(_get_choices, _set_choices)
+
+			    @property
+			    def grouped_choices(self):
+			        return self.index.grouped
+
+			    @property
+			    def choice_strings_to_values(self):
+			        return self.index.strings_to_values
+
+			    def to_internal_value(self, data):
+			        if data == '' and self.allow_blank:
+			            return ''
+			        try:
+			            return self.index.strings_to_values[str(data)]
+			        except KeyError:
+			            self.fail('invalid_choice', input=data)
+
+
+		# Quem passa uma lista comum cai no _indexes, que é indexado pelo conteúdo das opções (choices_key() troca as listas por tuplas para poder virar chave). Não dá para usar o id() da lista: o DRF faz deepcopy dos kwargs de cada campo ao instanciar o serializer, então cada instância chega com uma lista nova, e um cache por id() ganharia uma entrada por requisição. Pelo conteúdo, o _indexes tem uma entrada por lista de opções diferente. O caminho recomendado continua sendo passar um ChoiceIndex direto, que o deepcopy não copia.
+
+		# Em snippets/choices.py, depois das tabelas:
+
+			from snippets.fields import ChoiceIndex
+
+			LANGUAGE_INDEX = ChoiceIndex(LANGUAGE_CHOICES)
+			STYLE_INDEX = ChoiceIndex(STYLE_CHOICES)
+
+
+		# E no snippets/serializers.py os dois campos passam a ser declarados explicitamente:
+
+			from snippets.choices import LANGUAGE_INDEX, STYLE_INDEX
+			from snippets.fields import IndexedChoiceField
+
+
+			class SnippetSerializer(serializers.HyperlinkedModelSerializer):
+			    owner = serializers.ReadOnlyField(source='owner.username')
+			    highlight = serializers.HyperlinkedIdentityField(view_name='snippet-highlight', format='html')
+			    language = IndexedChoiceField(choices=LANGUAGE_INDEX, default='python')
+			    style = IndexedChoiceField(choices=STYLE_INDEX, default='friendly')
+
+			    class Meta:
+			        model = Snippet
+			        fields = ['url', 'id', 'highlight', 'owner',
+			                  'title', 'code', 'linenos', 'language', 'style']
+
+
+		# Agora o repr fica curto:
+
+			from snippets.serializers import SnippetSerializer
+			serializer = SnippetSerializer()
+			print(repr(serializer))
+			# SnippetSerializer():
+			#    ...
+			#    language = IndexedChoiceField(choices=<ChoiceIndex: ... choices>, default='python')
+			#    style = IndexedChoiceField(choices=<ChoiceIndex: ... choices>, default='friendly')
+
+
+		# Num ModelSerializer sem declarar os campos, dá para usar serializer_choice_field = IndexedChoiceField na classe. Nesse caso a lista vem do campo do modelo e cai no cache pelo conteúdo.
+
+
+
+		# Micro-benchmark de validação. Crie bench_validation.py ao lado do manage.py; ele compara o serializer atual com uma cópia que usa o ChoiceField do DRF:
+
+			import os
+			import sys
+			import timeit
+
+			import django
+
+			os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tutorial.settings')
+			django.setup()
+
+			from rest_framework import serializers  # noqa: E402
+
+			from snippets.models import LANGUAGE_CHOICES, STYLE_CHOICES  # noqa: E402
+			from snippets.serializers import SnippetSerializer  # noqa: E402
+
+
+			class PlainSnippetSerializer(SnippetSerializer):
+			    language = serializers.ChoiceField(choices=LANGUAGE_CHOICES, default='python')
+			    style = serializers.ChoiceField(choices=STYLE_CHOICES, default='friendly')
+
+
+			PAYLOAD = {'title': 'bench', 'code': 'print("hello, world")\n',
+			           'linenos': True, 'language': 'python', 'style': 'monokai'}
+
+
+			def validate(serializer_class):
+			    serializer = serializer_class(data=PAYLOAD)
+			    assert serializer.is_valid(), serializer.errors
+
+
+			if __name__ == '__main__':
+			    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+			    for serializer_class in (PlainSnippetSerializer, SnippetSerializer):
+			        seconds = min(timeit.repeat(lambda: validate(serializer_class),
+			                                    number=number, repeat=5))
+			        print('%-24s %8.0f validations/s'
+			              % (serializer_class.__name__, number / seconds))
+
+
+			python bench_validation.py 5000
+
+
+	# Acabando com o N+1 em UserSerializer.snippets e SnippetSerializer.owner
+
+		# O SnippetSerializer usa ReadOnlyField(source='owner.username') e o UserSerializer usa HyperlinkedRelatedField(many=True) para snippets. Na listagem isso vira uma consulta por linha: uma para buscar o owner de cada snippet, outra para buscar os snippets de cada usuário. Com PAGE_SIZE = 10 são 10 consultas extras por página, e crescendo com o tamanho da página.
+
+		# Em vez de escrever select_related/prefetch_related na mão em cada view (e esquecer de atualizar quando o serializer muda), vamos derivar isso dos campos declarados no serializer:
+
+			# source com ponto que atravessa uma FK ('owner.username')     -> select_related('owner')
+			# campo many=True sobre uma relação reversa ou m2m ('snippets') -> prefetch_related('snippets')
+			# e, se o campo só precisa da pk (PrimaryKeyRelatedField, ou HyperlinkedRelatedField com lookup_field='pk'),
+			# o prefetch carrega só a pk (mais a FK que liga ao pai), nada de code/highlighted.
+
+
+		# Crie o arquivo snippets/queries.py:
+
+			from functools import lru_cache
+
+			from django.core.exceptions import FieldDoesNotExist
+			from django.db.models import Prefetch
+			from rest_framework import relations, serializers
+
+
+			def relation_path(model, attrs):
+			    """
+			    Return the model fields for the relational prefix of `attrs`,
+			    e.g. ['owner', 'username'] on Snippet -> [Snippet.owner].
+			    """
+			    path = []
+			    for attr in attrs:
+			        try:
+			            model_field = model._meta.get_field(attr)
+			        except FieldDoesNotExist:
+			            break
+			        if not model_field.is_relation:
+			            break
+			        path.append(model_field)
+			        model = model_field.related_model
+			    return path
+
+
+			def pk_only_columns(model_field):
+			    """
+			    Columns a pk-only prefetch across `model_field` needs: the pk, plus
+			    the foreign key Django uses to attach the rows to their parent.
+			    """
+			    if model_field.one_to_many:
+			        return ('pk', model_field.field.attname)
+			    return ('pk',)
+
+
+			@lru_cache(maxsize=None)
+			def serializer_lookups(serializer_class, model):
+			    """
+			    Walk the declared fields of `serializer_class` and return the
+			    (select_related, prefetch_related) lookups it needs on `model`.
+			    """
+			    return collect_lookups(serializer_class(), model, prefix='')
+
+
+			def collect_lookups(serializer, model, prefix):
+			    select, prefetch = [], []
+			    for field in serializer.fields.values():
+			        if field.write_only or field.source == '*':
+			            continue
+			        path = relation_path(model, field.source_attrs)
+			        if not path:
+			            continue
+			        lookup = prefix + '__'.join(model_field.name for model_field in path)
+
+			        if any(model_field.many_to_many or model_field.one_to_many for model_field in path):
+			            child = getattr(field, 'child_relation', None)
+			            columns = None
+			            if len(path) == 1 and child is not None and child.use_pk_only_optimization():
+			                columns = pk_only_columns(path[0])
+			            prefetch.append((lookup, path[-1].related_model, columns))
+			            continue
+
+			        pk_only = (isinstance(field, relations.RelatedField)
+			                   and field.use_pk_only_optimization()
+			                   and len(path) == len(field.source_attrs))
+			        if not pk_only:
+			            select.append(lookup)
+
+			        if isinstance(field, serializers.Serializer):
+			            nested_select, nested_prefetch = collect_lookups(
+			                field, path[-1].related_model, prefix=lookup + '__')
+			            select.extend(nested_select)
+			            prefetch.extend(nested_prefetch)
+			    return tuple(select), tuple(prefetch)
+
+
+			def optimize_queryset(queryset, serializer_class):
+			    select, prefetch = serializer_lookups(serializer_class, queryset.model)
+			    if select:
+			        queryset = queryset.select_related(*select)
+			    for lookup, related_model, columns in prefetch:
+			        if columns is None:
+			            queryset = queryset.prefetch_related(lookup)
+			        else:
+			            related = related_model._default_manager.only(*columns)
+			            queryset = queryset.prefetch_related(Prefetch(lookup, queryset=related))
+			    return queryset
+
+
+			class RelatedQuerysetMixin:
+			    """
+			    Apply the select_related/prefetch_related lookups the serializer
+			    needs, so a list page costs a constant number of queries.
+			    """
+			    def get_queryset(self):
+			        queryset = super().get_queryset()
+			        return optimize_queryset(queryset, self.get_serializer_class())
+
+
+		# O lru_cache faz a análise uma vez por classe de serializer. Os objetos Prefetch são criados a cada chamada de propósito: eles guardam um queryset, e não é bom compartilhar isso entre requisições.
+
+		# A ordenação padrão (Meta.ordering = ['created']) continua valendo no prefetch, então a lista de snippets de cada usuário sai na mesma ordem de antes.
+
+		# Agora é só colocar o mixin nos viewsets em snippets/views.py:
+
+			from snippets.queries import RelatedQuerysetMixin
+
+
+			class UserViewSet(RelatedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
+			    """
+			    This viewset automatically provides `list` and `detail` actions.
+			    """
+			    queryset = User.objects.all()
+			    serializer_class = UserSerializer
+
+
+			class SnippetViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet):
+			    ...
+
+
+		# O mesmo mixin funciona nas views genéricas (SnippetList, UserList etc.), já que todas passam por get_queryset().
+
+
+
+		# E um teste que garante que a página custa o mesmo número de consultas com 2 ou com 10 linhas. Em snippets/tests.py:
+
+			from django.contrib.auth.models import User
+			from django.db import connection
+			from django.test import TestCase
+			from django.test.utils import CaptureQueriesContext
+
+			from snippets.models import Snippet
+
+
+			class ListQueryCountTests(TestCase):
+			    def create_rows(self, count):
+			        for i in range(count):
+			            user = User.objects.create(username='user-%d' % User.objects.count())
+			            Snippet.objects.create(owner=user, code='print(%d)\n' % i)
+			            Snippet.objects.create(owner=user, code='print(-%d)\n' % i)
+
+			    def count_queries(self, url):
+			        with CaptureQueriesContext(connection) as context:
+			            response = self.client.get(url)
+			        self.assertEqual(response.status_code, 200)
+			        return len(context)
+
+			    def test_snippet_list_query_count_is_constant(self):
+			        self.create_rows(1)
+			        small = self.count_queries('/snippets/')
+			        self.create_rows(4)
+			        self.assertEqual(self.count_queries('/snippets/'), small)
+
+			    def test_user_list_query_count_is_constant(self):
+			        self.create_rows(2)
+			        small = self.count_queries('/users/')
+			        self.create_rows(8)
+			        self.assertEqual(self.count_queries('/users/'), small)
+
+
+			python manage.py test snippets
+
+
+	# Paginação por chave (keyset / cursor) ordenada por created
+
+		# Com PageNumberPagination e Meta.ordering = ['created'], a página n vira ORDER BY created LIMIT 10 OFFSET 10*(n-1), mais um COUNT(*) na tabela inteira. O banco precisa ler e descartar todas as linhas antes do OFFSET, então as páginas do fundo ficam linearmente mais lentas.
+
+		# A paginação por chave guarda no cursor a posição da última linha vista, (created, id), e a próxima página é um "WHERE (created, id) > (c, i) ORDER BY created, id LIMIT 11". Com um índice composto em (created, id) isso é uma varredura de intervalo no índice, do mesmo custo na página 1 ou na página 10.000. O id entra como desempate: dois snippets criados no mesmo instante não somem nem aparecem duas vezes entre páginas. Não existe contagem nem número de página, só links next/previous.
+
+		# O CursorPagination do DRF usa só o primeiro campo da ordenação e resolve empates com offset; aqui queremos a comparação pela tupla inteira, então escrevemos a nossa. Crie o arquivo snippets/pagination.py:
+
+			import json
+			from base64 import urlsafe_b64decode, urlsafe_b64encode
+			from collections import OrderedDict
+
+			from django.core.exceptions import ValidationError
+			from django.db.models import Q
+			from django.utils.translation import gettext_lazy as _
+			from rest_framework.exceptions import NotFound
+			from rest_framework.pagination import BasePagination
+			from rest_framework.response import Response
+			from rest_framework.settings import api_settings
+			from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+			class KeysetPagination(BasePagination):
+			    """
+			    Seek pagination on a unique, indexed ordering such as (created, id).
+			    No OFFSET and no COUNT(*): every page is an index range scan,
+			    however deep it is.
+			    """
+			    page_size = api_settings.PAGE_SIZE
+			    ordering = ('created', 'id')
+			    cursor_query_param = 'cursor'
+			    invalid_cursor_message = _('Invalid cursor')
+
+			    def paginate_queryset(self, queryset, request, view=None):
+			        self.model = queryset.model
+			        self.base_url = request.build_absolute_uri()
+			        position, reverse = self.decode_cursor(request)
+
+			        order = [('-' if reverse else '') + name for name in self.ordering]
+			        queryset = queryset.order_by(*order)
+			        if position is not None:
+			            queryset = queryset.filter(self.seek_filter(position, reverse))
+
+			        rows = list(queryset[:self.page_size + 1])
+			        has_more = len(rows) > self.page_size
+			        rows = rows[:self.page_size]
+			        if reverse:
+			            rows.reverse()
+			            self.has_next, self.has_previous = position is not None, has_more
+			        else:
+			            self.has_next, self.has_previous = has_more, position is not None
+			        self.page = rows
+			        return rows
+
+			    def seek_filter(self, position, reverse):
+			        """
+			        (f1, f2, ...) > (v1, v2, ...) written out for the ORM. The
+			        redundant bound on the leading column lets the database start
+			        an index range scan instead of evaluating the OR row by row.
+			        """
+			        op = 'lt' if reverse else 'gt'
+			        condition = Q()
+			        for i, name in enumerate(self.ordering):
+			            term = Q(**{'%s__%s' % (name, op): position[i]})
+			            for previous, value in zip(self.ordering[:i], position[:i]):
+			                term &= Q(**{previous: value})
+			            condition |= term
+			        bound = Q(**{'%s__%se' % (self.ordering[0], op): position[0]})
+			        return bound & condition
+
+			    def decode_cursor(self, request):
+			        encoded = request.query_params.get(self.cursor_query_param)
+			        if encoded is None:
+			            return None, False
+			        try:
+			            token = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+			            values = token['p']
+			            if len(values) != len(self.ordering):
+			                raise ValueError
+			            position = [self.model._meta.get_field(name).to_python(value)
+			                        for name, value in zip(self.ordering, values)]
+			            return position, bool(token['r'])
+			        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+			            raise NotFound(self.invalid_cursor_message)
+
+			    def encode_cursor(self, instance, reverse):
+			        values = [self.model._meta.get_field(name).value_to_string(instance)
+			                  for name in self.ordering]
+			        token = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+			        encoded = urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+			        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+			    def get_next_link(self):
+			        if not self.has_next or not self.page:
+			            return None
+			        return self.encode_cursor(self.page[-1], reverse=False)
+
+			    def get_previous_link(self):
+			        if not self.has_previous:
+			            return None
+			        if not self.page:
+			            return remove_query_param(self.base_url, self.cursor_query_param)
+			        return self.encode_cursor(self.page[0], reverse=True)
+
+			    def get_paginated_response(self, data):
+			        return Response(OrderedDict([
+			            ('next', self.get_next_link()),
+			            ('previous', self.get_previous_link()),
+			            ('results', data)
+			        ]))
+
+
+			class UserKeysetPagination(KeysetPagination):
+			    ordering = ('id',)
+
+
+		# A ordenação precisa ser única: o último campo tem que ser a pk. Para usuários basta o id, que já é indexado; para snippets precisamos do índice composto.
+
+		# Em snippets/models.py, na classe Meta do Snippet:
+
+			    class Meta:
+			        ordering = ['created']
+			        indexes = [
+			            models.Index(fields=['created', 'id'], name='snippet_created_id_idx'),
+			        ]
+
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+		# O mesmo índice também atende o ORDER BY created da ordenação padrão.
+
+		# Para ligar o modo keyset, é só trocar a pagination_class nos viewsets:
+
+			from snippets.pagination import KeysetPagination, UserKeysetPagination
+
+
+			class UserViewSet(RelatedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
+			    ...
+			    pagination_class = UserKeysetPagination
+
+
+			class SnippetViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet):
+			    ...
+			    pagination_class = KeysetPagination
+
+
+		# Quem não colocar nada continua com o DEFAULT_PAGINATION_CLASS do settings (PageNumberPagination).
+
+			http http://127.0.0.1:8000/snippets/
+
+			HTTP/1.1 200 OK
+			...
+			{
+			    "next": "http://127.0.0.1:8000/snippets/?cursor=eyJwIjpbIjIwMTkt...",
+			    "previous": null,
+			    "results": [...]
+			}
+
+
+
+		# Benchmark: página 1 e página 10.000 nos dois modos. Como os próximos benchmarks também precisam de um banco descartável, vamos deixar isso num módulo comum. Crie benchutils.py ao lado do manage.py:
+
+			import os
+			import statistics
+			import time
+			from contextlib import contextmanager
+
+			import django
+
+			os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tutorial.settings')
+			django.setup()
+
+			from django.db import connection  # noqa: E402
+
+
+			@contextmanager
+			def test_database():
+			    """
+			    Run the benchmark against a throwaway database, like the test
+			    runner does, so the development data is never touched.
+			    """
+			    old_name = connection.settings_dict['NAME']
+			    connection.creation.create_test_db(verbosity=0)
+			    try:
+			        yield
+			    finally:
+			        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+			def timed(function, repeat=20):
+			    """
+			    Median wall time of `function()` in milliseconds.
+			    """
+			    times = []
+			    for _ in range(repeat):
+			        start = time.perf_counter()
+			        function()
+			        times.append(time.perf_counter() - start)
+			    return statistics.median(times) * 1000
+
+
+		# E bench_pagination.py:
+
+			import sys
+			from datetime import timedelta
+
+			from benchutils import test_database, timed
+
+			from django.contrib.auth.models import User  # noqa: E402
+			from django.utils import timezone  # noqa: E402
+			from rest_framework.pagination import PageNumberPagination  # noqa: E402
+			from rest_framework.test import APIRequestFactory  # noqa: E402
+
+			from snippets.models import Snippet  # noqa: E402
+			from snippets.pagination import KeysetPagination  # noqa: E402
+			from snippets.views import SnippetViewSet  # noqa: E402
+
+
+			def populate(count):
+			    owner = User.objects.create(username='bench')
+			    start = timezone.now()
+			    rows = (Snippet(owner=owner, code='print(%d)\n' % i) for i in range(count))
+			    Snippet.objects.bulk_create(rows, batch_size=5000)
+			    # auto_now_add gives every row of a batch almost the same timestamp;
+			    # spread them out so the ordering looks like real traffic.
+			    for i, pk in enumerate(Snippet.objects.order_by('id').values_list('id', flat=True)):
+			        Snippet.objects.filter(pk=pk).update(created=start + timedelta(seconds=i))
+
+
+			def list_view(pagination_class):
+			    return SnippetViewSet.as_view({'get': 'list'}, pagination_class=pagination_class)
+
+
+			def keyset_cursor(page):
+			    """
+			    Cursor that points at the start of page number `page`.
+			    """
+			    if page == 1:
+			        return {}
+			    paginator = KeysetPagination()
+			    paginator.model = Snippet
+			    paginator.base_url = '/snippets/'
+			    last = Snippet.objects.order_by('created', 'id')[(page - 1) * paginator.page_size - 1]
+			    url = paginator.encode_cursor(last, reverse=False)
+			    return {'cursor': url.split('cursor=')[1]}
+
+
+			def main(count):
+			    populate(count)
+			    factory = APIRequestFactory()
+			    deep = count // KeysetPagination.page_size
+			    for label, pagination_class in (('page number', PageNumberPagination),
+			                                    ('keyset', KeysetPagination)):
+			        view = list_view(pagination_class)
+			        for page in (1, deep):
+			            if pagination_class is KeysetPagination:
+			                params = keyset_cursor(page)
+			            else:
+			                params = {'page': page}
+			            request = factory.get('/snippets/', params)
+			            ms = timed(lambda: view(request).render())
+			            print('%-12s page %6d: %8.2f ms' % (label, page, ms))
+
+
+			if __name__ == '__main__':
+			    with test_database():
+			        main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+
+
+			python bench_pagination.py 100000
+
+
+		# tom
+			# o update linha a linha do populate() demora alguns minutos com 100 mil linhas; só precisa rodar uma vez por execução
+
+
+	# COUNT aproximado ou em cache na PageNumberPagination
+
+		# Mesmo ficando com a paginação por número de página, cada requisição a /snippets/ faz um SELECT COUNT(*) na tabela inteira. Com alguns milhões de linhas esse COUNT passa a ser a maior parte do tempo da resposta.
+
+		# Vamos deixar a estratégia de contagem configurável por view:
+
+			# 'exact'     COUNT(*) a cada requisição, como hoje
+			# 'cached'    COUNT(*) exato guardado no cache por um TTL, invalidado no Snippet.save()/delete()
+			# 'estimate'  estimativa das estatísticas do banco (pg_class / EXPLAIN no PostgreSQL, information_schema no MySQL)
+
+		# A resposta ganha um campo count_type dizendo qual contagem o cliente recebeu. A estimativa só é usada quando o número é grande; abaixo de EXACT_BELOW linhas o COUNT(*) é barato e as estatísticas costumam ser ruins, então contamos de verdade. Se o banco não tem estatísticas (SQLite, por exemplo) também caímos no exato, e o count_type diz isso.
+
+		# Crie o arquivo snippets/counts.py:
+
+			import hashlib
+			import json
+			import time
+
+			from django.conf import settings
+			from django.core.cache import cache
+			from django.core.exceptions import EmptyResultSet
+			from django.db import connections
+
+
+			def count_settings():
+			    config = getattr(settings, 'SNIPPETS_COUNT', {})
+			    return config.get('TTL', 60), config.get('EXACT_BELOW', 10000)
+
+
+			def generation_key(model):
+			    return 'snippets:count-generation:%s' % model._meta.label_lower
+
+
+			def invalidate_counts(model):
+			    """
+			    Start a new generation, so every cached count for `model` is
+			    ignored from now on.
+			    """
+			    cache.set(generation_key(model), time.time_ns(), None)
+
+
+			def count_cache_key(queryset):
+			    generation = cache.get_or_set(generation_key(queryset.model), time.time_ns(), None)
+			    sql, params = queryset.query.sql_with_params()
+			    digest = hashlib.md5(repr((sql, params)).encode('utf-8')).hexdigest()
+			    return 'snippets:count:%s:%s:%s' % (queryset.model._meta.label_lower, generation, digest)
+
+
+			def exact_count(queryset):
+			    return queryset.count(), 'exact'
+
+
+			def cached_count(queryset):
+			    try:
+			        key = count_cache_key(queryset)
+			    except EmptyResultSet:
+			        return 0, 'exact'
+			    value = cache.get(key)
+			    if value is None:
+			        value = queryset.count()
+			        ttl, _ = count_settings()
+			        cache.set(key, value, ttl)
+			    return value, 'cached'
+
+
+			def estimate_rows(queryset):
+			    """
+			    Row estimate from the planner or the table statistics, or None
+			    when the database can't give one.
+			    """
+			    connection = connections[queryset.db]
+			    table = queryset.model._meta.db_table
+			    filtered = bool(queryset.query.where)
+			    with connection.cursor() as cursor:
+			        if connection.vendor == 'postgresql':
+			            if not filtered:
+			                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+			                row = cursor.fetchone()
+			                return row[0] if row and row[0] >= 0 else None
+			            plan = json.loads(queryset.order_by().explain(format='json'))
+			            return int(plan[0]['Plan']['Plan Rows'])
+			        if connection.vendor == 'mysql' and not filtered:
+			            cursor.execute(
+			                'SELECT table_rows FROM information_schema.tables '
+			                'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+			            row = cursor.fetchone()
+			            return row[0] if row else None
+			    return None
+
+
+			def estimated_count(queryset):
+			    _, exact_below = count_settings()
+			    value = estimate_rows(queryset)
+			    if value is None or value < exact_below:
+			        return exact_count(queryset)
+			    return value, 'estimate'
+
+
+			COUNT_STRATEGIES = {
+			    'exact': exact_count,
+			    'cached': cached_count,
+			    'estimate': estimated_count,
+			}
+
+
+		# A "geração" é um número guardado no cache que entra na chave de todas as contagens do modelo. Invalidar é só trocar esse número: as chaves antigas deixam de ser consultadas e expiram sozinhas pelo TTL. Usamos time.time_ns() em vez de incr() para que, se a própria geração for despejada do cache, a nova nunca coincida com uma antiga.
+
+		# A chave leva o SQL da consulta, então /snippets/ filtrado e sem filtro têm contagens separadas.
+
+
+
+		# Agora a paginação. Em snippets/pagination.py:
+
+			from django.core.paginator import EmptyPage, PageNotAnInteger
+			from django.core.paginator import Paginator as DjangoPaginator
+			from django.utils.functional import cached_property
+			from rest_framework.pagination import PageNumberPagination
+
+			from snippets.counts import COUNT_STRATEGIES
+
+
+			class CountingPaginator(DjangoPaginator):
+			    """
+			    Django paginator whose count comes from a pluggable strategy.
+			    """
+			    def __init__(self, object_list, per_page, count_strategy='exact', **kwargs):
+			        super().__init__(object_list, per_page, **kwargs)
+			        self.count_strategy = count_strategy
+			        self.count_type = 'exact'
+
+			    @cached_property
+			    def count(self):
+			        value, self.count_type = COUNT_STRATEGIES[self.count_strategy](self.object_list)
+			        return value
+
+			    def validate_number(self, number):
+			        if self.count is not None and self.count_type == 'exact':
+			            return super().validate_number(number)
+			        # An approximate count can be short of the real one: accept
+			        # any positive page and let a page past the end come back empty.
+			        try:
+			            number = int(number)
+			        except (TypeError, ValueError):
+			            raise PageNotAnInteger(_('That page number is not an integer'))
+			        if number < 1:
+			            raise EmptyPage(_('That page number is less than 1'))
+			        return number
+
+			    def page(self, number):
+			        number = self.validate_number(number)
+			        if self.count_type == 'exact':
+			            return super().page(number)
+			        bottom = (number - 1) * self.per_page
+			        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+			class CountedPageNumberPagination(PageNumberPagination):
+			    """
+			    PageNumberPagination whose COUNT(*) strategy is chosen per view
+			    with `count_strategy`: 'exact', 'cached' or 'estimate'.
+			    """
+			    count_strategy = 'exact'
+
+			    def paginate_queryset(self, queryset, request, view=None):
+			        self.count_strategy = getattr(view, 'count_strategy', self.count_strategy)
+			        return super().paginate_queryset(queryset, request, view)
+
+			    def django_paginator_class(self, queryset, page_size):
+			        return CountingPaginator(queryset, page_size, count_strategy=self.count_strategy)
+
+			    def get_paginated_response(self, data):
+			        return Response(OrderedDict([
+			            ('count', self.page.paginator.count),
+			            ('count_type', self.page.paginator.count_type),
+			            ('next', self.get_next_link()),
+			            ('previous', self.get_previous_link()),
+			            ('results', data)
+			        ]))
+
+
+		# O django_paginator_class do DRF é chamado como self.django_paginator_class(queryset, page_size), então um método serve no lugar da classe e passa a estratégia adiante.
+
+		# Em tutorial/settings.py, a paginação padrão passa a ser essa:
+
+			REST_FRAMEWORK = {
+			    'DEFAULT_PAGINATION_CLASS': 'snippets.pagination.CountedPageNumberPagination',
+			    'PAGE_SIZE': 10
+			}
+
+			SNIPPETS_COUNT = {
+			    'TTL': 60,
+			    'EXACT_BELOW': 10000,
+			}
+
+
+		# E cada view escolhe a estratégia:
+
+			class SnippetViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet):
+			    ...
+			    count_strategy = 'estimate'
+
+
+		# Nesse caso o SnippetViewSet volta para a paginação por número de página; o KeysetPagination da seção anterior continua disponível para quem trocar a pagination_class.
+
+
+
+		# Falta a invalidação. O save() do Snippet já tinha três saídas; aproveitamos para deixar um único super().save() no fim. Em snippets/models.py:
+
+			from snippets.counts import invalidate_counts
+
+
+			    def save(self, *args, **kwargs):
+			        """
+			        Store the row right away. The highlighted HTML comes from the
+			        render cache when possible, otherwise it is queued on the
+			        background pipeline.
+			        """
+			        update_fields = kwargs.get('update_fields')
+			        if update_fields is not None and RENDER_INPUTS.intersection(update_fields):
+			            kwargs['update_fields'] = RENDER_FIELDS.union(update_fields)
+			        key = render_key(self.code, self.language, self.style,
+			                         self.linenos, self.title)
+			        queue = False
+			        if key != self.render_key:
+			            self.render_key = key
+			            self.highlight_version += 1
+			            html = get_render_cache().get(key)
+			            if html is None:
+			                self.highlight_state = self.HIGHLIGHT_PENDING
+			                queue = True
+			            else:
+			                self.highlighted = html
+			                self.highlight_state = self.HIGHLIGHT_READY
+			        super(Snippet, self).save(*args, **kwargs)
+			        transaction.on_commit(lambda: invalidate_counts(Snippet))
+			        if queue:
+			            pk, version = self.pk, self.highlight_version
+			            transaction.on_commit(lambda: get_backend().submit(pk, version))
+
+			    def delete(self, *args, **kwargs):
+			        result = super(Snippet, self).delete(*args, **kwargs)
+			        transaction.on_commit(lambda: invalidate_counts(Snippet))
+			        return result
+
+
+		# A invalidação também fica no on_commit: se fosse antes do commit, outra requisição poderia contar as linhas antigas e guardar no cache de novo.
+
+		# Atenção: o cache padrão do Django é LocMemCache, um por processo. Com vários workers, a invalidação de um não chega nos outros e vale só o TTL. Em produção use um cache compartilhado (Redis, Memcached) em CACHES.
+
+
+		# tom
+			http http://127.0.0.1:8000/snippets/
+
+			HTTP/1.1 200 OK
+			...
+			{
+			    "count": 4,
+			    "count_type": "exact",
+			    "next": null,
+			    "previous": null,
+			    "results": [...]
+			}
+
+			# com poucas linhas a estimativa cai no exato, por isso "exact" aqui
+
+
+	# Listas em streaming para SnippetViewSet.list e snippet_list
+
+		# Sem paginação, tanto o snippet_list (JsonResponse(serializer.data, safe=False)) quanto o SnippetViewSet.list montam a lista inteira de OrderedDicts na memória e depois renderizam tudo num único bloco de bytes. Com campos code grandes isso dá picos de centenas de MB por requisição.
+
+		# O modo streaming percorre o queryset com .iterator(chunk_size=...) (no PostgreSQL isso usa um cursor do lado do servidor), serializa uma linha de cada vez e vai escrevendo o JSON numa StreamingHttpResponse. A memória fica limitada a um bloco de linhas, qualquer que seja o tamanho do resultado.
+
+		# Crie o arquivo snippets/streaming.py:
+
+			from django.http import StreamingHttpResponse
+			from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+			from rest_framework.settings import api_settings
+			from rest_framework.utils.encoders import JSONEncoder
+
+
+			def get_encoder():
+			    """
+			    An encoder with the same settings JSONRenderer uses by default.
+			    """
+			    return JSONEncoder(
+			        ensure_ascii=not api_settings.UNICODE_JSON,
+			        allow_nan=not api_settings.STRICT_JSON,
+			        separators=SHORT_SEPARATORS if api_settings.COMPACT_JSON else LONG_SEPARATORS,
+			    )
+
+
+			def encode_row(data, encoder):
+			    # U+2028 and U+2029 are valid JSON but not valid JavaScript;
+			    # JSONRenderer escapes them too.
+			    return encoder.encode(data).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+			def stream_json_list(queryset, serializer, chunk_size=2000, buffer_size=64 * 1024):
+			    """
+			    Yield `queryset` as a JSON array, serializing one row at a time
+			    and flushing roughly every `buffer_size` bytes.
+			    """
+			    encoder = get_encoder()
+			    buffer = ['[']
+			    size = 1
+			    separator = ''
+			    for instance in queryset.iterator(chunk_size=chunk_size):
+			        item = separator + encode_row(serializer.to_representation(instance), encoder)
+			        separator = encoder.item_separator
+			        buffer.append(item)
+			        size += len(item)
+			        if size >= buffer_size:
+			            yield ''.join(buffer).encode('utf-8')
+			            buffer, size = [], 0
+			    buffer.append(']')
+			    yield ''.join(buffer).encode('utf-8')
+
+
+			def streaming_json_response(queryset, serializer, **kwargs):
+			    return StreamingHttpResponse(stream_json_list(queryset, serializer, **kwargs),
+			                                 content_type='application/json')
+
+
+			class StreamingListMixin:
+			    """
+			    Stream `list` as JSON when the view is not paginated, instead of
+			    building the whole response in memory.
+			    """
+			    stream_list = True
+			    stream_chunk_size = 2000
+
+			    def list(self, request, *args, **kwargs):
+			        if (not self.stream_list or self.paginator is not None
+			                or request.accepted_renderer.format != 'json'):
+			            return super().list(request, *args, **kwargs)
+			        queryset = self.filter_queryset(self.get_queryset())
+			        serializer = self.get_serializer()
+			        return streaming_json_response(queryset, serializer, chunk_size=self.stream_chunk_size)
+
+
+		# O JSONEncoder do DRF é o mesmo que o JSONRenderer usa (datetime, Decimal, lazy strings...), e o get_encoder() lê as mesmas configurações que ele: UNICODE_JSON, COMPACT_JSON e STRICT_JSON (com ele ligado, o padrão, um float NaN ou Infinity dá ValueError em vez de sair como NaN, que não é JSON válido). O encode_row() repete o escape de \u2028 e \u2029 que o JSONRenderer faz, e a vírgula entre os itens é o item_separator do mesmo encoder (',' ou ', ', conforme o COMPACT_JSON). Assim a lista sai igual ao que a resposta normal escreveria.
+
+		# Um serializer só é criado e reaproveitado para todas as linhas: to_representation() não guarda estado entre chamadas. Para o HyperlinkedModelSerializer, o get_serializer() já coloca o request no contexto, então as urls saem iguais.
+
+		# Para a API navegável (Accept: text/html) continua o caminho normal, porque o template precisa dos dados inteiros.
+
+		# Atenção: .iterator() ignora prefetch_related em Django < 4.1. O select_related('owner') do RelatedQuerysetMixin funciona normalmente; o prefetch de snippets do UserViewSet só funciona com iterator a partir do Django 4.1.
+
+		# Nos viewsets, em snippets/views.py:
+
+			from snippets.streaming import StreamingListMixin
+
+
+			class UserViewSet(RelatedQuerysetMixin, StreamingListMixin, viewsets.ReadOnlyModelViewSet):
+			    ...
+
+
+			class SnippetViewSet(RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+
+
+		# Como a paginação está ligada no settings, o streaming só entra numa rota sem paginação. Por exemplo, uma exportação em snippets/urls.py, antes do include(router.urls):
+
+			snippet_export = views.SnippetViewSet.as_view({'get': 'list'}, pagination_class=None)
+
+			urlpatterns = [
+			    path('snippets/export/', snippet_export, name='snippet-export'),
+			    path('', include(router.urls)),
+			]
+
+
+		# E a view de função snippet_list da parte 1 fica assim:
+
+			from snippets.streaming import streaming_json_response
+
+
+			@csrf_exempt
+			def snippet_list(request):
+			    """
+			    List all code snippets, or create a new snippet.
+			    """
+			    if request.method == 'GET':
+			        snippets = Snippet.objects.all()
+			        return streaming_json_response(snippets, SnippetSerializer())
+			    ...
+
+
+
+		# Benchmark de memória. Crie bench_streaming.py ao lado do manage.py; ele mede o pico de memória alocada (tracemalloc) nos dois modos, com 1.000 e com 10.000 linhas:
+
+			import sys
+			import tracemalloc
+
+			from benchutils import test_database
+
+			from django.contrib.auth.models import User  # noqa: E402
+			from rest_framework.test import APIRequestFactory  # noqa: E402
+
+			from snippets.models import Snippet  # noqa: E402
+			from snippets.views import SnippetViewSet  # noqa: E402
+
+			CODE = 'x = "%s"\n' % ('y' * 20000)
+
+
+			def peak_memory(view, request):
+			    tracemalloc.start()
+			    response = view(request)
+			    if response.streaming:
+			        for _ in response.streaming_content:
+			            pass
+			    else:
+			        response.render()
+			    _, peak = tracemalloc.get_traced_memory()
+			    tracemalloc.stop()
+			    return peak / (1024 * 1024)
+
+
+			def main(sizes):
+			    owner = User.objects.create(username='bench')
+			    factory = APIRequestFactory()
+			    buffered = SnippetViewSet.as_view({'get': 'list'}, pagination_class=None,
+			                                      stream_list=False)
+			    streamed = SnippetViewSet.as_view({'get': 'list'}, pagination_class=None)
+			    created = 0
+			    for size in sizes:
+			        Snippet.objects.bulk_create(
+			            Snippet(owner=owner, code=CODE) for _ in range(size - created))
+			        created = size
+			        for label, view in (('buffered', buffered), ('streamed', streamed)):
+			            request = factory.get('/snippets/', HTTP_ACCEPT='application/json')
+			            print('%-9s %6d rows: peak %8.1f MB' % (label, size, peak_memory(view, request)))
+
+
+			if __name__ == '__main__':
+			    with test_database():
+			        main([int(size) for size in sys.argv[1:]] or [1000, 10000])
+
+
+
+			python bench_streaming.py 1000 10000
+
+
+		# O stream_list=False desliga o streaming numa view específica; no benchmark ele serve para medir o caminho antigo com a mesma view.
+
+
+	# Serializer "compilado": to_representation gerado para o SnippetSerializer
+
+		# No profile do SnippetViewSet.list o que mais gasta CPU é o to_representation genérico do DRF: para cada linha ele cria um OrderedDict e, para cada campo, chama field.get_attribute() (que percorre source_attrs e testa Mapping, callables, ObjectDoesNotExist...), testa PKOnlyObject e chama field.to_representation().
+
+		# O modo compilado gera, uma vez por classe, uma função plana com os getters já resolvidos. Para o SnippetSerializer hyperlinked ela fica mais ou menos assim:
+
+			def to_representation(instance):
+			    if instance.__class__ is not model:
+			        return fallback(instance)
+			    try:
+			        v0 = instance
+			        v1 = instance.id
+			        v3 = instance.owner.username
+			        ...
+			        return {'url': c0(v0), 'id': None if v1 is None else int(v1),
+			                'highlight': c2(v2), 'owner': v3, ...}
+			    except Exception:
+			        return fallback(instance)
+
+
+		# Regras para ser idêntico ao caminho normal:
+
+			# - só compilamos caminhos de atributo que são campos concretos do modelo ou FKs para frente; nada de métodos, propriedades ou relações reversas (o DRF chamaria callables, o acesso direto não)
+			# - source='*' (url, highlight) chama o to_representation do próprio campo com a instância
+			# - CharField, IntegerField e ReadOnlyField viram str(), int() e o próprio valor; os outros campos usam o to_representation do campo, já ligado
+			# - None continua virando None sem passar pelo campo
+			# - qualquer exceção (FK nula no meio do caminho, DoesNotExist...) cai no to_representation original, que se comporta (ou falha) exatamente como antes
+			# - se algum campo não dá para compilar, a classe inteira usa o caminho original
+
+		# A saída é um dict simples em vez de OrderedDict. A ordem das chaves é a mesma, então o JSON sai byte a byte igual; serializer.data continua sendo ReturnDict/ReturnList.
+
+		# Crie o arquivo snippets/compiled.py:
+
+			from django.core.exceptions import FieldDoesNotExist
+			from rest_framework import serializers
+
+			_factories = {}
+
+
+			def attribute_path(model, attrs):
+			    """
+			    Return `attrs` if it only walks concrete fields and forward
+			    relations of `model`, otherwise None.
+			    """
+			    for attr in attrs:
+			        if model is None:
+			            return None
+			        try:
+			            model_field = model._meta.get_field(attr)
+			        except FieldDoesNotExist:
+			            return None
+			        if not model_field.concrete or model_field.many_to_many:
+			            return None
+			        model = model_field.related_model
+			    return attrs
+
+
+			def conversion(field):
+			    """
+			    How the generated code turns an attribute into output: a builtin
+			    name, '' for the value itself, or None to call the field.
+			    """
+			    method = type(field).to_representation
+			    if method is serializers.ReadOnlyField.to_representation:
+			        return ''
+			    if method is serializers.CharField.to_representation:
+			        return 'str'
+			    if method is serializers.IntegerField.to_representation:
+			        return 'int'
+			    return None
+
+
+			def build_factory(fields, model):
+			    """
+			    Generate the source of a flat to_representation for `fields`
+			    and return a factory that binds it to field instances.
+			    """
+			    getters, values = [], []
+			    for i, field in enumerate(fields):
+			        if field.source == '*':
+			            getters.append('v%d = instance' % i)
+			            values.append('%r: c%d(v%d)' % (field.field_name, i, i))
+			            continue
+			        path = attribute_path(model, field.source_attrs)
+			        if path is None:
+			            return None
+			        getters.append('v%d = instance.%s' % (i, '.'.join(path)))
+			        convert = conversion(field)
+			        if convert == '':
+			            values.append('%r: v%d' % (field.field_name, i))
+			        else:
+			            call = '%s(v%d)' % (convert or 'c%d' % i, i)
+			            values.append('%r: None if v%d is None else %s' % (field.field_name, i, call))
+
+			    names = ', '.join('c%d' % i for i in range(len(fields)))
+			    lines = [
+			        'def factory(model, fallback, %s):' % names,
+			        '    def to_representation(instance):',
+			        '        if instance.__class__ is not model:',
+			        '            return fallback(instance)',
+			        '        try:',
+			    ]
+			    lines.extend('            ' + getter for getter in getters)
+			    lines.append('            return {%s}' % ', '.join(values))
+			    lines.extend([
+			        '        except Exception:',
+			        '            return fallback(instance)',
+			        '    return to_representation',
+			    ])
+			    namespace = {}
+			    exec(compile('\n'.join(lines), '<compiled %s>' % model.__name__, 'exec'), namespace)
+			    return namespace['factory']
+
+
+			def compile_representation(serializer, model, fallback):
+			    """
+			    Return a flat to_representation for `serializer` bound to its
+			    fields, or None when one of its fields can't be compiled.
+			    """
+			    fields = list(serializer._readable_fields)
+			    key = (type(serializer), model)
+			    if key not in _factories:
+			        _factories[key] = build_factory(fields, model)
+			    factory = _factories[key]
+			    if factory is None:
+			        return None
+			    return factory(model, fallback, *[field.to_representation for field in fields])
+
+
+			class CompiledSerializerMixin:
+			    """
+			    Opt-in fast path: serialize with a flat to_representation generated
+			    once per serializer class, falling back to the regular one for
+			    anything it doesn't handle.
+			    """
+			    def to_representation(self, instance):
+			        compiled = self.__dict__.get('_compiled_representation')
+			        if compiled is None:
+			            fallback = super().to_representation
+			            compiled = compile_representation(self, type(instance), fallback) or fallback
+			            self._compiled_representation = compiled
+			        return compiled(instance)
+
+
+		# O código gerado (o texto) sai uma vez por classe; o que é feito por instância do serializer é só ligar os to_representation dos campos, que dependem do contexto (o request das urls). No many=True o ListSerializer usa um único child para todas as linhas, então isso acontece uma vez por resposta.
+
+		# O modelo vem do tipo da primeira instância serializada, por isso o mesmo mixin serve para as três versões do tutorial: Serializer, ModelSerializer e HyperlinkedModelSerializer. Em snippets/serializers.py:
+
+			from snippets.compiled import CompiledSerializerMixin
+
+
+			class SnippetSerializer(CompiledSerializerMixin, serializers.HyperlinkedModelSerializer):
+			    owner = serializers.ReadOnlyField(source='owner.username')
+			    highlight = serializers.HyperlinkedIdentityField(view_name='snippet-highlight', format='html')
+			    language = IndexedChoiceField(choices=LANGUAGE_INDEX, default='python')
+			    style = IndexedChoiceField(choices=STYLE_INDEX, default='friendly')
+
+			    class Meta:
+			        model = Snippet
+			        fields = ['url', 'id', 'highlight', 'owner',
+			                  'title', 'code', 'linenos', 'language', 'style']
+
+
+		# No UserSerializer não adianta: o campo snippets é uma relação reversa, e a classe cai inteira no caminho original.
+
+		# O streaming da seção anterior usa serializer.to_representation(), então também ganha o caminho compilado.
+
+
+
+		# Teste de saída idêntica, em snippets/tests.py:
+
+			from rest_framework import serializers
+			from rest_framework.renderers import JSONRenderer
+			from rest_framework.request import Request
+			from rest_framework.test import APIRequestFactory
+
+			from snippets.serializers import SnippetSerializer
+
+
+			class PlainSnippetSerializer(SnippetSerializer):
+			    to_representation = serializers.HyperlinkedModelSerializer.to_representation
+
+
+			class CompiledSerializerTests(TestCase):
+			    def test_compiled_output_is_identical(self):
+			        user = User.objects.create(username='tomaz')
+			        snippets = [
+			            Snippet.objects.create(owner=user, code='print("olá")\n', title='ção', linenos=True),
+			            Snippet.objects.create(owner=user, code='ls -la', language='bash', style='monokai'),
+			        ]
+			        context = {'request': Request(APIRequestFactory().get('/snippets/'))}
+			        compiled = SnippetSerializer(snippets, many=True, context=context).data
+			        plain = PlainSnippetSerializer(snippets, many=True, context=context).data
+			        self.assertEqual(JSONRenderer().render(compiled), JSONRenderer().render(plain))
+
+
+
+		# Benchmark de linhas por segundo com many=True. Não precisa de banco: as instâncias são montadas na memória. Crie bench_serializer.py ao lado do manage.py:
+
+			import sys
+			import time
+
+			import benchutils  # noqa: F401 (django.setup)
+
+			from django.contrib.auth.models import User  # noqa: E402
+			from django.utils import timezone  # noqa: E402
+			from rest_framework import serializers  # noqa: E402
+			from rest_framework.renderers import JSONRenderer  # noqa: E402
+			from rest_framework.request import Request  # noqa: E402
+			from rest_framework.test import APIRequestFactory  # noqa: E402
+
+			from snippets.models import Snippet  # noqa: E402
+			from snippets.serializers import SnippetSerializer  # noqa: E402
+
+
+			class PlainSnippetSerializer(SnippetSerializer):
+			    to_representation = serializers.HyperlinkedModelSerializer.to_representation
+
+
+			def make_rows(count):
+			    owner = User(id=1, username='bench')
+			    now = timezone.now()
+			    return [Snippet(id=i, owner=owner, created=now, title='snippet %d' % i,
+			                    code='print(%d)\n' % i, linenos=bool(i % 2))
+			            for i in range(1, count + 1)]
+
+
+			def rows_per_second(serializer_class, rows, context, repeat=5):
+			    best = None
+			    for _ in range(repeat):
+			        start = time.perf_counter()
+			        serializer_class(rows, many=True, context=context).data
+			        elapsed = time.perf_counter() - start
+			        best = elapsed if best is None else min(best, elapsed)
+			    return len(rows) / best
+
+
+			if __name__ == '__main__':
+			    rows = make_rows(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+			    context = {'request': Request(APIRequestFactory().get('/snippets/'))}
+			    renderer = JSONRenderer()
+			    assert (renderer.render(SnippetSerializer(rows, many=True, context=context).data)
+			            == renderer.render(PlainSnippetSerializer(rows, many=True, context=context).data))
+			    for serializer_class in (PlainSnippetSerializer, SnippetSerializer):
+			        print('%-24s %10.0f rows/s'
+			              % (serializer_class.__name__, rows_per_second(serializer_class, rows, context)))
+
+
+			python bench_serializer.py 10000
+
+
+		# A url e o highlight continuam passando pelo reverse() do Django em cada linha, e isso acaba sendo boa parte do tempo que sobra.
+
+
+	# Criação em lote de snippets
+
+		# Os importadores mandam um POST por snippet para /snippets/. Cada um passa por perform_create -> serializer.save(owner=...) -> Snippet.save(): uma renderização do pygments, um INSERT e uma transação por snippet.
+
+		# O caminho em lote recebe um array JSON em POST /snippets/bulk/, valida cada item com o child do SnippetSerializer(many=True), renderiza os highlights de uma vez (os que não estão no cache, cada conteúdo único uma vez só, espalhados num pool de processos) e insere com bulk_create em blocos. Os itens válidos são gravados; os inválidos voltam com os erros na mesma posição do array.
+
+		# Em snippets/highlighting.py, o pool de processos do lote e a renderização em massa:
+
+			_render_pool = None
+
+
+			def get_render_pool():
+			    global _render_pool
+			    with _backend_lock:
+			        if _render_pool is None:
+			            config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			            _render_pool = ProcessPoolExecutor(max_workers=config.get('BULK_WORKERS'))
+			    return _render_pool
+
+
+			def render_row(row):
+			    return render_highlight(**row)
+
+
+			def render_many(rows):
+			    """
+			    Render a batch of inputs, each distinct one once, spreading the
+			    cache misses across the process pool. Returns [(key, html)] in
+			    the order of `rows`.
+			    """
+			    cache = get_render_cache()
+			    keys = [render_key(**row) for row in rows]
+			    rendered, missing = {}, {}
+			    for key, row in zip(keys, rows):
+			        if key in rendered or key in missing:
+			            continue
+			        html = cache.get(key)
+			        if html is None:
+			            missing[key] = row
+			        else:
+			            rendered[key] = html
+			    if missing:
+			        chunksize = max(1, len(missing) // ((os.cpu_count() or 1) * 4))
+			        results = get_render_pool().map(render_row, missing.values(), chunksize=chunksize)
+			        for key, html in zip(missing, results):
+			            cache.set(key, html)
+			            rendered[key] = html
+			    return [(key, rendered[key]) for key in keys]
+
+
+		# Com BULK_WORKERS = None o ProcessPoolExecutor usa um processo por núcleo. O chunksize manda vários snippets por vez para cada processo, para não pagar o pickle de ida e volta um a um.
+
+		# Em snippets/models.py, um manager com a inserção em lote, e um método que junta as entradas da renderização (o save() passa a usar o mesmo método):
+
+			from snippets.highlighting import get_backend, get_render_cache, render_key, render_many
+
+
+			class SnippetManager(models.Manager):
+			    def create_many(self, items, batch_size=500, **extra):
+			        """
+			        Insert many snippets at once: highlight them as a batch and
+			        write them with bulk_create.
+			        """
+			        snippets = [self.model(**item, **extra) for item in items]
+			        rendered = render_many([snippet.render_inputs() for snippet in snippets])
+			        for snippet, (key, html) in zip(snippets, rendered):
+			            snippet.render_key = key
+			            snippet.highlighted = html
+			            snippet.highlight_state = self.model.HIGHLIGHT_READY
+			            snippet.highlight_version = 1
+			        with transaction.atomic(using=self.db):
+			            created = self.bulk_create(snippets, batch_size=batch_size)
+			            transaction.on_commit(lambda: invalidate_counts(self.model))
+			        return created
+
+
+			class Snippet(models.Model):
+			    ...
+
+			    objects = SnippetManager()
+
+			    def render_inputs(self):
+			        return {'code': self.code, 'language': self.language, 'style': self.style,
+			                'linenos': self.linenos, 'title': self.title}
+
+			    def save(self, *args, **kwargs):
+			        ...
+			        key = render_key(**self.render_inputs())
+			        ...
+
+
+		# O bulk_create não chama save(), então tudo que o save() faz (render_key, estado do highlight, invalidar as contagens) precisa estar no create_many. Daqui para frente, o que for acrescentado no save() também tem que entrar aqui.
+
+		# O bulk_create só devolve as pks no PostgreSQL e no SQLite (3.35+ com Django 4.0+). No MySQL as instâncias voltam sem pk e as urls não podem ser montadas.
+
+
+
+		# A ação no SnippetViewSet, em snippets/views.py:
+
+			from rest_framework.exceptions import ValidationError
+
+
+			class SnippetViewSet(RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+			    bulk_max_items = 1000
+			    bulk_batch_size = 500
+
+			    @action(detail=False, methods=['post'])
+			    def bulk(self, request, *args, **kwargs):
+			        """
+			        Create many snippets from a JSON array. Valid items are
+			        inserted, invalid ones are reported at their position.
+			        """
+			        items = request.data
+			        if not isinstance(items, list):
+			            return Response({'detail': 'Expected a list of snippets.'},
+			                            status=status.HTTP_400_BAD_REQUEST)
+			        if len(items) > self.bulk_max_items:
+			            return Response({'detail': 'At most %d snippets per request.' % self.bulk_max_items},
+			                            status=status.HTTP_400_BAD_REQUEST)
+
+			        child = self.get_serializer(many=True).child
+			        valid, results = [], [None] * len(items)
+			        for index, item in enumerate(items):
+			            try:
+			                valid.append((index, child.run_validation(item)))
+			            except ValidationError as exc:
+			                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': exc.detail}
+
+			        created = Snippet.objects.create_many(
+			            [data for _, data in valid], batch_size=self.bulk_batch_size, owner=request.user)
+			        for (index, _), snippet in zip(valid, created):
+			            snippet.owner = request.user
+			            results[index] = {'status': status.HTTP_201_CREATED,
+			                              'data': child.to_representation(snippet)}
+
+			        code = status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+			        return Response(results, status=code)
+
+
+		# Um único child valida todos os itens; run_validation() não guarda estado entre chamadas. O limite de itens por requisição segura a memória; para importar mais, mande vários lotes.
+
+		# O router cria a rota sozinho: POST /snippets/bulk/.
+
+		# tom
+			http -a admin:adminadmin POST http://127.0.0.1:8000/snippets/bulk/ < lote.json
+
+			# lote.json
+			[
+			    {"code": "print(1)"},
+			    {"code": "ls -la", "language": "bash"},
+			    {"code": "x", "language": "nao-existe"}
+			]
+
+			HTTP/1.1 201 Created
+			...
+			[
+			    {"status": 201, "data": {"url": "...", "id": 7, ...}},
+			    {"status": 201, "data": {"url": "...", "id": 8, ...}},
+			    {"status": 400, "errors": {"language": ["\"nao-existe\" is not a valid choice."]}}
+			]
+
+
+	# GET condicional (ETag / Last-Modified) no detalhe, no highlight e na lista
+
+		# O retrieve e a ação highlight sempre serializam e mandam a resposta inteira, e o HTML do highlight (página completa, com o CSS) costuma ter dez vezes o tamanho do código. Um cliente que já tem a versão atual deveria receber um 304 sem corpo.
+
+		# Para isso o Snippet ganha um campo updated (auto_now). Antes de rodar a ação, a view faz uma única consulta pequena, só com pk, updated e a versão do highlight (nada de code nem highlighted), monta o ETag e o Last-Modified e deixa o get_conditional_response() do Django decidir se responde 304. Se não for 304, a resposta normal sai com os dois cabeçalhos.
+
+			# detalhe:    ETag de (pk, updated, formato)     Last-Modified = updated
+			# highlight:  ETag de (pk, highlight_version)    Last-Modified = updated   (só quando o HTML está pronto)
+			# lista:      ETag de (geração do modelo, url, formato)   Last-Modified = instante da geração
+
+		# O formato aceito (json, api, html) entra no ETag porque o mesmo recurso tem representações diferentes.
+
+		# A lista não tem uma linha para consultar. Mas já temos a "geração" do snippets/counts.py, trocada a cada save()/delete() confirmado; ela é um time.time_ns(), então serve também de Last-Modified. Em snippets/counts.py, separe a leitura da geração:
+
+			def current_generation(model):
+			    return cache.get_or_set(generation_key(model), time.time_ns(), None)
+
+
+			def count_cache_key(queryset):
+			    generation = current_generation(queryset.model)
+			    ...
+
+
+		# No modelo, em snippets/models.py:
+
+			    updated = models.DateTimeField(auto_now=True)
+
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+		# O create_many() (bulk_create) também preenche o updated: o auto_now é aplicado no pre_save de cada campo, que o bulk_create chama.
+
+		# Crie o arquivo snippets/conditional.py:
+
+			import hashlib
+			from calendar import timegm
+			from datetime import datetime, timezone
+
+			from django.utils.cache import get_conditional_response
+			from django.utils.http import http_date
+
+			from snippets.counts import current_generation
+
+
+			def make_etag(*parts):
+			    digest = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8'))
+			    return '"%s"' % digest.hexdigest()
+
+
+			class ConditionalGetMixin:
+			    """
+			    Answer If-None-Match / If-Modified-Since with 304 after a single
+			    cheap version lookup, and tag full responses with ETag and
+			    Last-Modified.
+			    """
+			    conditional_list = True
+
+			    def conditional(self, validators, handler, request, *args, **kwargs):
+			        if request.method not in ('GET', 'HEAD'):
+			            return handler(request, *args, **kwargs)
+			        found = validators()
+			        if found is None:
+			            return handler(request, *args, **kwargs)
+			        etag, last_modified = found
+			        timestamp = timegm(last_modified.utctimetuple())
+			        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+			        if response is not None:
+			            return response
+			        response = handler(request, *args, **kwargs)
+			        if response.status_code == 200:
+			            response['ETag'] = etag
+			            response['Last-Modified'] = http_date(timestamp)
+			        return response
+
+			    def version_row(self, *fields):
+			        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+			        lookup = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+			        queryset = self.filter_queryset(self.get_queryset())
+			        return queryset.filter(**lookup).order_by().values_list(*fields).first()
+
+			    def detail_validators(self):
+			        row = self.version_row('pk', 'updated')
+			        if row is None:
+			            return None
+			        pk, updated = row
+			        return make_etag('detail', pk, updated.isoformat(), self.request.accepted_renderer.format), updated
+
+			    def list_validators(self):
+			        if not self.conditional_list:
+			            return None
+			        generation = current_generation(self.get_queryset().model)
+			        etag = make_etag('list', generation, self.request.get_full_path(),
+			                         self.request.accepted_renderer.format)
+			        return etag, datetime.fromtimestamp(generation / 1e9, tz=timezone.utc)
+
+			    def retrieve(self, request, *args, **kwargs):
+			        return self.conditional(self.detail_validators, super().retrieve, request, *args, **kwargs)
+
+			    def list(self, request, *args, **kwargs):
+			        return self.conditional(self.list_validators, super().list, request, *args, **kwargs)
+
+
+		# Pular o get_object() no 304 não fura as permissões: para GET o IsAuthenticatedOrReadOnly e o IsOwnerOrReadOnly sempre liberam, e o check_permissions() da view já rodou no initial(). Se a linha não existe, a ação normal roda e devolve o 404 de sempre.
+
+		# No SnippetViewSet, o mixin entra e o highlight usa o mesmo caminho (em snippets/views.py):
+
+			from snippets.conditional import ConditionalGetMixin, make_etag
+
+
+			class SnippetViewSet(ConditionalGetMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+
+			    def highlight_validators(self):
+			        row = self.version_row('pk', 'updated', 'highlight_version', 'highlight_state')
+			        if row is None or row[3] != Snippet.HIGHLIGHT_READY:
+			            return None
+			        pk, updated, version, _ = row
+			        return make_etag('highlight', pk, version), updated
+
+			    @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
+			    def highlight(self, request, *args, **kwargs):
+			        return self.conditional(self.highlight_validators, self.render_highlight, request, *args, **kwargs)
+
+			    def render_highlight(self, request, *args, **kwargs):
+			        snippet = self.get_object()
+			        if snippet.highlight_state == Snippet.HIGHLIGHT_PENDING:
+			            return Response('pending', status=status.HTTP_202_ACCEPTED,
+			                            headers={'Retry-After': '1'})
+			        return Response(snippet.highlighted)
+
+
+		# O ConditionalGetMixin vem antes do StreamingListMixin, então a lista em streaming também ganha ETag: o conditional() só coloca os cabeçalhos na resposta, não mexe no corpo.
+
+		# O highlight só muda quando muda a highlight_version, e o worker grava o HTML com update() sem mexer no updated. Enquanto está "pending" não há ETag e o 202 continua.
+
+		# Limites:
+
+			# - o detalhe e a lista mostram owner.username; renomear um usuário não troca o updated dos snippets dele, então o ETag antigo continua valendo até o próximo save
+			# - queryset.update() e queryset.delete() não passam pelo save()/delete() e não trocam a geração da lista
+			# - com vários processos, a geração precisa estar num cache compartilhado (a mesma observação das contagens); com LocMemCache e mais de um processo, desligue com conditional_list = False
+
+
+		# tom
+			http http://127.0.0.1:8000/snippets/1/highlight/
+				# HTTP/1.1 200 OK
+				# ETag: "3f1c..."
+				# Last-Modified: ...
+
+			http http://127.0.0.1:8000/snippets/1/highlight/ If-None-Match:'"3f1c..."'
+				# HTTP/1.1 304 Not Modified
+
+
+	# Carregamento adiado das colunas grandes (code, highlighted) nas listas
+
+		# O Snippet guarda o code e o HTML completo do highlighted na mesma linha, e o Snippet.objects.all() das listas traz os dois para cada linha. O highlighted nunca aparece na lista. São megabytes de HTML saindo do banco por página só para serem jogados fora.
+
+		# Duas partes:
+
+			# 1. nas listas, adiar (defer) automaticamente toda coluna que o serializer da view não lê
+			# 2. opcionalmente, tirar o highlighted da tabela de snippets e guardar numa tabela separada (SnippetHighlight)
+
+
+		# Parte 1. Seguindo a mesma ideia do RelatedQuerysetMixin, o serializer diz o que ele lê: o primeiro atributo de cada source. Os campos com source='*' são o problema, porque recebem a instância inteira; o HyperlinkedIdentityField só usa o lookup_field, então esse dá para entender. Qualquer outro campo com '*', ou um source que não é campo do modelo (uma property, um método), e desistimos: nada é adiado.
+
+		# Os campos da ordenação nunca são adiados, porque a paginação por chave lê created e id de cada linha.
+
+		# Em snippets/queries.py adicione:
+
+			@lru_cache(maxsize=None)
+			def unused_columns(serializer_class, model, keep=()):
+			    """
+			    Names of the concrete fields of `model` that `serializer_class`
+			    never reads, or () when a field reads the instance in a way we
+			    can't see through.
+			    """
+			    used = set(keep)
+			    for field in serializer_class().fields.values():
+			        if field.write_only:
+			            continue
+			        if field.source == '*':
+			            if not isinstance(field, relations.HyperlinkedIdentityField):
+			                return ()
+			            used.add(field.lookup_field)
+			            continue
+			        try:
+			            used.add(model._meta.get_field(field.source_attrs[0]).name)
+			        except FieldDoesNotExist:
+			            return ()
+			    used.add('pk')
+			    return tuple(model_field.name for model_field in model._meta.concrete_fields
+			                 if model_field.name not in used and not model_field.primary_key)
+
+
+			def ordering_fields(queryset, paginator):
+			    names = list(queryset.query.order_by or queryset.model._meta.ordering)
+			    names.extend(getattr(paginator, 'ordering', ()))
+			    return tuple(sorted({name.lstrip('-') for name in names if isinstance(name, str)}))
+
+
+		# E o mixin passa a adiar as colunas na ação list:
+
+			class RelatedQuerysetMixin:
+			    """
+			    Apply the select_related/prefetch_related lookups the serializer
+			    needs, so a list page costs a constant number of queries. On
+			    `list`, columns the serializer never reads are deferred.
+			    """
+			    def get_queryset(self):
+			        queryset = super().get_queryset()
+			        serializer_class = self.get_serializer_class()
+			        queryset = optimize_queryset(queryset, serializer_class)
+			        if getattr(self, 'action', None) == 'list':
+			            keep = ordering_fields(queryset, self.paginator)
+			            unused = unused_columns(serializer_class, queryset.model, keep)
+			            if unused:
+			                queryset = queryset.defer(*unused)
+			        return queryset
+
+
+		# Para o SnippetSerializer, a lista deixa de trazer highlighted, highlight_state, highlight_version, render_key e updated. O created fica por causa da ordenação.
+
+		# Só o list adia colunas. O retrieve também não mostra o highlighted, mas a mesma instância passa pelas permissões de objeto, e o highlight precisa do HTML; nesses casos é uma linha só.
+
+		# As instâncias com campos adiados continuam sendo da classe Snippet (o Django não cria mais subclasses para isso), então o serializer compilado continua valendo.
+
+
+
+		# Parte 2. Com STORAGE = 'table' o HTML vai para uma tabela própria, ligada 1:1 ao snippet, e a coluna highlighted fica vazia. A tabela de snippets fica pequena, o que ajuda qualquer consulta que varre a tabela, não só a lista.
+
+		# Em snippets/models.py:
+
+			from django.conf import settings
+
+
+			def highlight_storage():
+			    return getattr(settings, 'SNIPPETS_HIGHLIGHT', {}).get('STORAGE', 'column')
+
+
+			class Snippet(models.Model):
+			    ...
+
+			    def highlight_html(self):
+			        """
+			        The rendered HTML, wherever the current storage mode keeps it.
+			        """
+			        if highlight_storage() == 'table':
+			            html = (SnippetHighlight.objects.filter(snippet_id=self.pk)
+			                    .values_list('html', flat=True).first())
+			            return html or ''
+			        return self.highlighted
+
+			    @classmethod
+			    def store_highlight(cls, pk, version, html):
+			        """
+			        Store the HTML rendered for `version`, unless a newer save has
+			        superseded it. State and HTML change in one transaction.
+			        """
+			        with transaction.atomic():
+			            if highlight_storage() == 'table':
+			                current = cls.objects.filter(pk=pk, highlight_version=version).update(
+			                    highlight_state=cls.HIGHLIGHT_READY)
+			                if current:
+			                    SnippetHighlight.objects.update_or_create(snippet_id=pk, defaults={'html': html})
+			            else:
+			                cls.objects.filter(pk=pk, highlight_version=version).update(
+			                    highlighted=html, highlight_state=cls.HIGHLIGHT_READY)
+
+			    def save(self, *args, **kwargs):
+			        """
+			        Store the row right away. The highlighted HTML comes from the
+			        render cache when possible, otherwise it is queued on the
+			        background pipeline.
+			        """
+			        update_fields = kwargs.get('update_fields')
+			        if update_fields is not None and RENDER_INPUTS.intersection(update_fields):
+			            kwargs['update_fields'] = RENDER_FIELDS.union(update_fields)
+			        key = render_key(**self.render_inputs())
+			        queue = False
+			        html = None
+			        if key != self.render_key:
+			            self.render_key = key
+			            self.highlight_version += 1
+			            html = get_render_cache().get(key)
+			            if html is None:
+			                self.highlight_state = self.HIGHLIGHT_PENDING
+			                queue = True
+			            else:
+			                self.highlight_state = self.HIGHLIGHT_READY
+			                if highlight_storage() == 'column':
+			                    self.highlighted = html
+			        with transaction.atomic():
+			            super(Snippet, self).save(*args, **kwargs)
+			            if html is not None and highlight_storage() == 'table':
+			                SnippetHighlight.objects.update_or_create(snippet_id=self.pk, defaults={'html': html})
+			        transaction.on_commit(lambda: invalidate_counts(Snippet))
+			        if queue:
+			            pk, version = self.pk, self.highlight_version
+			            transaction.on_commit(lambda: get_backend().submit(pk, version))
+
+
+			class SnippetHighlight(models.Model):
+			    """
+			    Rendered HTML kept out of the snippets table (STORAGE = 'table').
+			    """
+			    snippet = models.OneToOneField(Snippet, primary_key=True, related_name='highlight_row',
+			                                   on_delete=models.CASCADE)
+			    html = models.TextField()
+
+
+		# O create_many() grava as linhas da tabela lateral logo depois do bulk_create, na mesma transação:
+
+			        with transaction.atomic(using=self.db):
+			            created = self.bulk_create(snippets, batch_size=batch_size)
+			            if highlight_storage() == 'table':
+			                SnippetHighlight.objects.bulk_create(
+			                    [SnippetHighlight(snippet_id=snippet.pk, html=html)
+			                     for snippet, (_, html) in zip(created, rendered)],
+			                    batch_size=batch_size)
+			            transaction.on_commit(lambda: invalidate_counts(self.model))
+
+		# (e, no modo 'table', ele não copia o html para snippet.highlighted: "if highlight_storage() == 'column': snippet.highlighted = html")
+
+		# Em snippets/highlighting.py o worker passa a gravar pelo modelo:
+
+			def render_snippet(pk, version, executor=None):
+			    ...
+			    Snippet.store_highlight(pk, version, html)
+
+
+		# E as ações highlight (SnippetViewSet.render_highlight e SnippetHighlight.get) trocam snippet.highlighted por snippet.highlight_html():
+
+			        return Response(snippet.highlight_html())
+
+
+		# Atenção ao nome: a view da parte 5 do tutorial também se chama SnippetHighlight. Se você ainda tem essa view em views.py, importe o modelo com outro nome (from snippets.models import SnippetHighlight as HighlightRow).
+
+		# Migração. Primeiro as tabelas:
+
+			python manage.py makemigrations snippets
+
+
+		# Depois uma migração de dados vazia, para mover o HTML que já existe:
+
+			python manage.py makemigrations snippets --empty --name move_highlighted
+
+
+			from django.db import migrations
+
+
+			def move_highlighted(apps, schema_editor):
+			    Snippet = apps.get_model('snippets', 'Snippet')
+			    SnippetHighlight = apps.get_model('snippets', 'SnippetHighlight')
+			    rows = Snippet.objects.exclude(highlighted='').values_list('pk', 'highlighted')
+			    batch = []
+			    for pk, html in rows.iterator(chunk_size=500):
+			        batch.append(SnippetHighlight(snippet_id=pk, html=html))
+			        if len(batch) == 500:
+			            SnippetHighlight.objects.bulk_create(batch, ignore_conflicts=True)
+			            batch = []
+			    SnippetHighlight.objects.bulk_create(batch, ignore_conflicts=True)
+			    Snippet.objects.exclude(highlighted='').update(highlighted='')
+
+
+			class Migration(migrations.Migration):
+			    dependencies = [
+			        ('snippets', '<a migração anterior>'),
+			    ]
+			    operations = [
+			        migrations.RunPython(move_highlighted, migrations.RunPython.noop),
+			    ]
+
+
+			python manage.py migrate
+
+
+		# E só então ligar o modo em tutorial/settings.py:
+
+			SNIPPETS_HIGHLIGHT = {
+			    ...
+			    'STORAGE': 'table',
+			}
+
+
+		# Sem o STORAGE tudo continua como antes ('column'), e a parte 1 já resolve a lista.
+
+
+	# Armazenamento compactado de Snippet.code e Snippet.highlighted
+
+		# O highlighted é gerado com HtmlFormatter(full=True), que embute a folha de estilos inteira do style escolhido em cada linha. Mil snippets com style='friendly' guardam mil cópias do mesmo CSS. E ainda fica do lado do code cru, então o banco tem várias vezes o tamanho do conteúdo de verdade.
+
+		# Duas mudanças, independentes:
+
+			# 1. BODY_ONLY: o highlighted guarda só o corpo (HtmlFormatter(full=False): a div com os tokens). O CSS é gerado uma vez por style e o documento é montado na hora da resposta, igual ao que o full=True escreveria
+			# 2. CompressedTextField: code e highlighted vão para colunas binárias compactadas com zlib (ou zstd, se o pacote zstandard estiver instalado), de forma transparente para o resto do código
+
+
+		# Parte 1. Em snippets/highlighting.py:
+
+			from functools import lru_cache, partial
+
+			from pygments.formatters.html import DOC_FOOTER, DOC_HEADER
+
+
+			def page_format():
+			    config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			    return 'body' if config.get('BODY_ONLY') else 'page'
+
+
+			def render_highlight(code, language, style, linenos, title, full=True):
+			    """
+			    Use the `pygments` library to create a highlighted HTML
+			    representation of the code snippet. With full=False only the
+			    body is rendered; see `assemble_page`.
+			    """
+			    lexer = get_lexer_by_name(language)
+			    linenos = 'table' if linenos else False
+			    options = {'title': title} if title else {}
+			    formatter = HtmlFormatter(style=style, linenos=linenos,
+			                              full=full, **options)
+			    return highlight(code, lexer, formatter)
+
+
+			@lru_cache(maxsize=None)
+			def page_stylesheet(style):
+			    return HtmlFormatter(style=style).get_style_defs('body')
+
+
+			def assemble_page(body, style, title):
+			    """
+			    Wrap a body-only render in the document HtmlFormatter(full=True)
+			    would have written around it.
+			    """
+			    header = DOC_HEADER % dict(title=title, styledefs=page_stylesheet(style), encoding=None)
+			    return header + body + DOC_FOOTER
+
+
+		# O encoding=None é o mesmo que o formatter tem quando o highlight() é chamado sem encoding, como fazemos. A chave da folha de estilo no DOC_HEADER do pygments é styledefs.
+
+		# O formato entra na chave de renderização, senão o cache devolveria uma página inteira para quem espera só o corpo (e vice-versa). Como a chave também fica gravada no snippet, trocar o modo faz o próximo save() renderizar de novo:
+
+			def render_key(code, language, style, linenos, title):
+			    """
+			    Content address of a render: a hash of every input pygments sees.
+			    """
+			    digest = hashlib.sha256()
+			    for part in (code, language, style, 'table' if linenos else '', title, page_format()):
+			        data = part.encode('utf-8')
+			        digest.update(b'%d:' % len(data))
+			        digest.update(data)
+			    return digest.hexdigest()
+
+
+		# O processo pai decide o formato e passa full= para os workers; assim os processos do pool não precisam do settings do Django (no macOS eles sobem com spawn, sem django.setup()):
+
+			def render_row(row, full=True):
+			    return render_highlight(full=full, **row)
+
+
+			# em render_snippet():
+			    full = page_format() == 'page'
+			    ...
+			        if executor is None:
+			            html = render_highlight(full=full, **row)
+			        else:
+			            html = executor.submit(render_highlight, full=full, **row).result()
+
+			# em render_many():
+			        render = partial(render_row, full=page_format() == 'page')
+			        results = get_render_pool().map(render, missing.values(), chunksize=chunksize)
+
+
+		# E o Snippet.highlight_html() monta o documento quando o que está guardado é só o corpo. Olhar o conteúdo, e não o settings, deixa conviver linhas antigas (página inteira) com as novas (só corpo) enquanto a base é convertida:
+
+			from snippets.highlighting import assemble_page
+
+
+			    def highlight_html(self):
+			        """
+			        The rendered HTML document, wherever the current storage mode
+			        keeps it and whether it was stored whole or body-only.
+			        """
+			        if highlight_storage() == 'table':
+			            html = (SnippetHighlight.objects.filter(snippet_id=self.pk)
+			                    .values_list('html', flat=True).first()) or ''
+			        else:
+			            html = self.highlighted
+			        if html and not html.startswith('<!DOCTYPE'):
+			            html = assemble_page(html, self.style, self.title)
+			        return html
+
+
+
+		# Parte 2. Crie o arquivo snippets/compression.py:
+
+			import zlib
+
+			from django.conf import settings
+			from django.db import models
+
+			try:
+			    import zstandard
+			except ImportError:
+			    zstandard = None
+
+			RAW, ZLIB, ZSTD = b'r', b'z', b's'
+
+
+			def compress(text, min_length=256):
+			    """
+			    Encode `text` for storage. The first byte says how the rest is
+			    encoded, so rows written with any setting can always be read.
+			    """
+			    data = text.encode('utf-8')
+			    if len(data) < min_length:
+			        return RAW + data
+			    method = getattr(settings, 'SNIPPETS_COMPRESSION', 'zlib')
+			    if method == 'zstd' and zstandard is not None:
+			        return ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+			    return ZLIB + zlib.compress(data, 6)
+
+
+			def decompress(value):
+			    value = bytes(value)
+			    marker, data = value[:1], value[1:]
+			    if marker == ZLIB:
+			        data = zlib.decompress(data)
+			    elif marker == ZSTD:
+			        if zstandard is None:
+			            raise RuntimeError('This row is zstd-compressed; install the zstandard package.')
+			        data = zstandard.ZstdDecompressor().decompress(data)
+			    elif marker != RAW:
+			        raise ValueError('Unknown compression marker %r.' % marker)
+			    return data.decode('utf-8')
+
+
+			class CompressedTextField(models.BinaryField):
+			    """
+			    Text stored compressed in a binary column. Python code only ever
+			    sees `str`; values shorter than `min_length` bytes are stored raw.
+			    """
+			    def __init__(self, *args, min_length=256, **kwargs):
+			        self.min_length = min_length
+			        kwargs.setdefault('editable', True)
+			        super().__init__(*args, **kwargs)
+
+			    def deconstruct(self):
+			        name, path, args, kwargs = super().deconstruct()
+			        if self.min_length != 256:
+			            kwargs['min_length'] = self.min_length
+			        return name, path, args, kwargs
+
+			    def _check_str_default_value(self):
+			        # The default is text, as for a TextField.
+			        return []
+
+			    def get_default(self):
+			        return models.Field.get_default(self)
+
+			    def from_db_value(self, value, expression, connection):
+			        if value is None:
+			            return value
+			        return decompress(value)
+
+			    def to_python(self, value):
+			        if value is None or isinstance(value, str):
+			            return value
+			        return decompress(value)
+
+			    def get_prep_value(self, value):
+			        if isinstance(value, str):
+			            return compress(value, self.min_length)
+			        return value
+
+			    def value_to_string(self, obj):
+			        return self.value_from_object(obj)
+
+
+		# Um valor que não começa por um dos três marcadores não foi escrito pelo compress() (uma coluna convertida errado, por exemplo). O decompress() dá ValueError em vez de devolver o texto sem o primeiro byte, que passaria despercebido.
+
+		# O BinaryField padrão não é editável, devolve b'' como default (e o check fields.E170 recusa um default str) e serializa em base64 (dumpdata); as sobrescritas acima fazem ele se comportar como um TextField. O que não funciona numa coluna binária são os filtros de texto (code__icontains e afins); para busca, ver a seção do índice de busca.
+
+		# No modelo, em snippets/models.py:
+
+			from snippets.compression import CompressedTextField
+
+
+			class Snippet(models.Model):
+			    ...
+			    code = CompressedTextField()
+			    ...
+			    highlighted = CompressedTextField(blank=True, default='')
+
+
+			class SnippetHighlight(models.Model):
+			    ...
+			    html = CompressedTextField()
+
+
+		# O ModelSerializer não sabe mapear BinaryField (cairia num ModelField genérico), então o SnippetSerializer declara o code explicitamente, como na parte 1 do tutorial:
+
+			class SnippetSerializer(CompiledSerializerMixin, serializers.HyperlinkedModelSerializer):
+			    owner = serializers.ReadOnlyField(source='owner.username')
+			    highlight = serializers.HyperlinkedIdentityField(view_name='snippet-highlight', format='html')
+			    code = serializers.CharField(style={'base_template': 'textarea.html'})
+			    language = IndexedChoiceField(choices=LANGUAGE_INDEX, default='python')
+			    style = IndexedChoiceField(choices=STYLE_INDEX, default='friendly')
+			    ...
+
+
+		# O values()/values_list() do render_snippet() e da migração também passam pelo from_db_value, então recebem str normalmente.
+
+
+
+		# Migração. Trocar o tipo de text para bytea direto (ALTER COLUMN ... USING code::bytea) não serve: o PostgreSQL interpretaria as barras invertidas do código, e as linhas não teriam o byte marcador. O caminho é em quatro passos:
+
+			# 1. adicione code_z = CompressedTextField(null=True) e highlighted_z = CompressedTextField(null=True)
+			#    ao Snippet, e html_z = CompressedTextField(null=True) ao SnippetHighlight
+			python manage.py makemigrations snippets
+
+			# 2. migração de dados
+			python manage.py makemigrations snippets --empty --name compress_text
+
+
+			def compress_text(apps, schema_editor):
+			    Snippet = apps.get_model('snippets', 'Snippet')
+			    rows = Snippet.objects.filter(code_z__isnull=True).values_list('pk', 'code', 'highlighted')
+			    for pk, code, highlighted in rows.iterator(chunk_size=500):
+			        Snippet.objects.filter(pk=pk).update(code_z=code, highlighted_z=highlighted)
+			    SnippetHighlight = apps.get_model('snippets', 'SnippetHighlight')
+			    rows = SnippetHighlight.objects.filter(html_z__isnull=True).values_list('pk', 'html')
+			    for pk, html in rows.iterator(chunk_size=500):
+			        SnippetHighlight.objects.filter(pk=pk).update(html_z=html)
+
+
+			# 3. duas migrações escritas à mão, nesta ordem: apagar as colunas de texto e renomear as compactadas
+			python manage.py makemigrations snippets --empty --name drop_text_columns
+
+			    operations = [
+			        migrations.RemoveField('snippet', 'code'),
+			        migrations.RemoveField('snippet', 'highlighted'),
+			        migrations.RemoveField('snippethighlight', 'html'),
+			    ]
+
+			python manage.py makemigrations snippets --empty --name rename_compressed_columns
+
+			    operations = [
+			        migrations.RenameField('snippet', 'code_z', 'code'),
+			        migrations.RenameField('snippet', 'highlighted_z', 'highlighted'),
+			        migrations.RenameField('snippethighlight', 'html_z', 'html'),
+			    ]
+
+
+			# 4. deixe o modelo como acima (code, highlighted e html sem o null=True, sem os campos *_z);
+			#    agora o makemigrations só gera os AlterField de null/default. Ele pergunta o que fazer com
+			#    as linhas nulas; depois do passo 2 não há nenhuma, escolha a opção de ignorar
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+		# O update() passa pelo get_prep_value do campo, então o valor vai compactado. Se o passo 2 for interrompido, basta rodar de novo: ele só pega as linhas que ainda não têm code_z.
+
+		# O passo 3 não pode sair do makemigrations. Existe um campo code antes e depois, então o autodetector não enxerga um rename: ele geraria um AlterField(code) para binário, que é justamente o cast USING code::bytea, mais um RemoveField(code_z), que joga fora a cópia compactada. Escritos à mão, o RemoveField e o RenameField fazem o que a gente quer.
+
+		# Para os snippets antigos, o highlighted continua sendo a página inteira até o próximo save() (ou até o comando de re-renderização da próxima seção); o highlight_html() serve os dois formatos.
+
+		# Em tutorial/settings.py:
+
+			SNIPPETS_HIGHLIGHT = {
+			    ...
+			    'BODY_ONLY': True,
+			}
+
+			SNIPPETS_COMPRESSION = 'zlib'  # ou 'zstd', com pip install zstandard
+
+
+
+		# E um teste em snippets/tests.py que compara com o pygments chamado diretamente, sem passar pelo nosso código: o corpo, o documento montado pelo assemble_page() e o render completo:
+
+			from pygments import highlight
+			from pygments.formatters.html import HtmlFormatter
+			from pygments.lexers import get_lexer_by_name
+
+			from snippets.highlighting import assemble_page, render_highlight
+
+
+			class RenderHighlightTests(TestCase):
+			    def reference(self, code, language, style, linenos, title, full):
+			        options = {'title': title} if title else {}
+			        formatter = HtmlFormatter(style=style, linenos='table' if linenos else False,
+			                                  full=full, **options)
+			        return highlight(code, get_lexer_by_name(language), formatter)
+
+			    def test_render_matches_pygments(self):
+			        for language, style in (('python', 'monokai'), ('js', 'friendly'), ('html', 'monokai')):
+			            for linenos, title in ((False, ''), (True, 'Título <teste>')):
+			                row = {'code': 'x = "olá"\nprint(x)\n', 'language': language,
+			                       'style': style, 'linenos': linenos, 'title': title}
+			                body = render_highlight(full=False, **row)
+			                self.assertEqual(body, self.reference(full=False, **row))
+			                self.assertEqual(assemble_page(body, style, title), self.reference(full=True, **row))
+			                self.assertEqual(render_highlight(full=True, **row), self.reference(full=True, **row))
+
+
+		# A referência não usa nada de snippets.highlighting, então o teste continua valendo se o render_highlight() passar a montar a página com o assemble_page().
+
+
+
+		# Benchmark de tamanho e de leitura. Crie bench_storage.py ao lado do manage.py. Ele usa o código-fonte da própria biblioteca padrão como amostra realista e mostra, por linha, quanto cada modo guarda e quanto custa ler de volta:
+
+			import importlib
+			import inspect
+			import sys
+			import time
+
+			import benchutils  # noqa: F401 (django.setup)
+
+			from snippets.compression import compress, decompress, zstandard  # noqa: E402
+			from snippets.highlighting import assemble_page, render_highlight  # noqa: E402
+
+
+			MODULES = ['json.decoder', 'json.encoder', 'email.message', 'email.utils',
+			           'http.client', 'http.cookies', 'logging', 'logging.handlers',
+			           'asyncio.base_events', 'asyncio.tasks', 'argparse', 'datetime']
+
+
+			def samples(count):
+			    codes = [inspect.getsource(importlib.import_module(name)) for name in MODULES]
+			    return [codes[i % len(codes)] for i in range(count)]
+
+
+			def measure(label, stored, read):
+			    start = time.perf_counter()
+			    for value in stored:
+			        read(value)
+			    elapsed = time.perf_counter() - start
+			    size = sum(len(value) for value in stored)
+			    print('%-22s %10.1f KB/row %8.3f ms/read'
+			          % (label, size / len(stored) / 1024, elapsed * 1000 / len(stored)))
+
+
+			def main(count):
+			    codes = samples(count)
+			    style, title = 'friendly', ''
+			    rows = [{'code': code, 'language': 'python', 'style': style, 'linenos': True, 'title': title}
+			            for code in codes]
+			    pages = [render_highlight(full=True, **row) for row in rows]
+			    bodies = [render_highlight(full=False, **row) for row in rows]
+
+			    encode = lambda text: text.encode('utf-8')  # noqa: E731
+			    measure('page, text', [encode(page) for page in pages], lambda value: value.decode('utf-8'))
+			    measure('body, text', [encode(body) for body in bodies],
+			            lambda value: assemble_page(value.decode('utf-8'), style, title))
+			    measure('body, zlib', [compress(body) for body in bodies],
+			            lambda value: assemble_page(decompress(value), style, title))
+			    if zstandard is not None:
+			        from django.test import override_settings
+			        with override_settings(SNIPPETS_COMPRESSION='zstd'):
+			            stored = [compress(body) for body in bodies]
+			        measure('body, zstd', stored, lambda value: assemble_page(decompress(value), style, title))
+			    measure('code, text', [encode(code) for code in codes], lambda value: value.decode('utf-8'))
+			    measure('code, zlib', [compress(code) for code in codes], decompress)
+
+
+			if __name__ == '__main__':
+			    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
+
+
+			python bench_storage.py 200
+
+
+		# Isso mede o que vai para a coluna (o tamanho do valor gravado) e o custo de ler de volta no Python. Para ver o tamanho real da tabela, antes e depois da migração, no PostgreSQL:
+
+			SELECT pg_size_pretty(pg_total_relation_size('snippets_snippet'));
+
+
+	# Respostas do highlight pré-compactadas
+
+		# A ação highlight (e o SnippetHighlight.get) devolve sempre o mesmo HTML imutável para uma dada versão do snippet, e um GZipMiddleware compactaria tudo de novo a cada requisição. Como o documento só muda quando muda a render_key, dá para gerar as versões gzip (e brotli, se o pacote estiver instalado) uma vez, na hora de renderizar, e servir direto conforme o Accept-Encoding.
+
+		# As variantes vão para o cache do Django, com a render_key na chave. Isso é endereçamento por conteúdo de novo: snippets idênticos dividem as mesmas variantes. Elas são geradas junto com a renderização, dentro do worker (e no pool de processos quando o executor é 'process'); se alguma for despejada do cache, a primeira requisição gera de novo e guarda.
+
+		# Em snippets/highlighting.py:
+
+			import gzip
+
+			from django.core.cache import cache as django_cache
+
+			try:
+			    import brotli
+			except ImportError:
+			    brotli = None
+
+
+			def precompress_encodings():
+			    """
+			    Encodings to precompress, in order of preference, leaving out the
+			    ones whose codec is not installed.
+			    """
+			    config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+			    return tuple(encoding for encoding in config.get('PRECOMPRESS', available) if encoding in available)
+
+
+			def compress_variants(document, encodings):
+			    data = document.encode('utf-8')
+			    variants = {}
+			    for encoding in encodings:
+			        if encoding == 'gzip':
+			            variants[encoding] = gzip.compress(data, compresslevel=9, mtime=0)
+			        elif encoding == 'br' and brotli is not None:
+			            variants[encoding] = brotli.compress(data, quality=11)
+			    return variants
+
+
+			def as_document(html, style, title):
+			    """
+			    The full HTML document, whether `html` was stored whole or body-only.
+			    """
+			    if html and not html.startswith('<!DOCTYPE'):
+			        return assemble_page(html, style, title)
+			    return html
+
+
+			def render_document(row, full=True, encodings=()):
+			    """
+			    Render `row` and precompress the document clients will receive.
+			    Runs in the worker thread or in a pool process.
+			    """
+			    html = render_highlight(full=full, **row)
+			    document = as_document(html, row['style'], row['title'])
+			    return html, compress_variants(document, encodings)
+
+
+			def variant_key(key, encoding):
+			    return 'snippets:highlight:%s:%s' % (key, encoding)
+
+
+			def store_variants(key, variants):
+			    config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			    django_cache.set_many({variant_key(key, encoding): body for encoding, body in variants.items()},
+			                          config.get('PRECOMPRESS_TTL', 24 * 60 * 60))
+
+
+			def encoded_highlight(snippet, encoding):
+			    """
+			    The precompressed highlight document for `snippet`, compressing
+			    (and storing) it only if the cached variant has been evicted.
+			    """
+			    body = django_cache.get(variant_key(snippet.render_key, encoding))
+			    if body is None:
+			        variants = compress_variants(snippet.highlight_html(), precompress_encodings())
+			        store_variants(snippet.render_key, variants)
+			        body = variants[encoding]
+			    return body
+
+
+			def choose_encoding(accept_encoding, available):
+			    """
+			    The first of `available` the client accepts, or None.
+			    """
+			    accepted = {}
+			    for item in accept_encoding.split(','):
+			        name, _, params = item.partition(';')
+			        quality = 1.0
+			        params = params.strip()
+			        if params.startswith('q='):
+			            try:
+			                quality = float(params[2:])
+			            except ValueError:
+			                quality = 0.0
+			        accepted[name.strip().lower()] = quality
+			    for encoding in available:
+			        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+			            return encoding
+			    return None
+
+
+		# O mtime=0 no gzip deixa a saída determinística: a mesma entrada gera sempre os mesmos bytes.
+
+		# O render_snippet() passa a pedir o documento compactado junto com o HTML:
+
+			def render_snippet(pk, version, executor=None):
+			    """
+			    Render one snippet version and store it, unless a newer save
+			    has superseded it in the meantime.
+			    """
+			    from snippets.models import Snippet
+
+			    row = (Snippet.objects.filter(pk=pk, highlight_version=version)
+			           .values('code', 'language', 'style', 'linenos', 'title')
+			           .first())
+			    if row is None:
+			        return
+			    full = page_format() == 'page'
+			    encodings = precompress_encodings()
+			    cache = get_render_cache()
+			    key = render_key(**row)
+			    html = cache.get(key)
+			    variants = None
+			    if html is None:
+			        if executor is None:
+			            html, variants = render_document(row, full, encodings)
+			        else:
+			            html, variants = executor.submit(render_document, row, full, encodings).result()
+			        cache.set(key, html)
+			    Snippet.store_highlight(pk, version, html)
+			    if variants is None and encodings and django_cache.get(variant_key(key, encodings[0])) is None:
+			        variants = compress_variants(as_document(html, row['style'], row['title']), encodings)
+			    if variants:
+			        store_variants(key, variants)
+
+
+		# No render_many() (criação em lote) as variantes também saem do pool de processos:
+
+			def render_row(row, full=True, encodings=()):
+			    return render_document(row, full, encodings)
+
+
+			    # em render_many():
+			    if missing:
+			        chunksize = max(1, len(missing) // ((os.cpu_count() or 1) * 4))
+			        render = partial(render_row, full=page_format() == 'page',
+			                         encodings=precompress_encodings())
+			        results = get_render_pool().map(render, missing.values(), chunksize=chunksize)
+			        for key, (html, variants) in zip(missing, results):
+			            cache.set(key, html)
+			            store_variants(key, variants)
+			            rendered[key] = html
+
+
+		# Quando o save() acha o HTML no RenderCache, as variantes daquela render_key já foram geradas antes, por quem renderizou primeiro.
+
+		# O Snippet.highlight_html() passa a usar o as_document():
+
+			    def highlight_html(self):
+			        ...
+			        return as_document(html, self.style, self.title)
+
+
+
+		# Na view, em snippets/views.py. O highlight deixa de carregar code e highlighted: com a variante no cache, só a render_key é necessária; se faltar, o highlight_html() busca o HTML (uma consulta a mais, só nesse caso).
+
+			from django.http import HttpResponse
+			from django.utils.cache import patch_vary_headers
+
+			from snippets.highlighting import choose_encoding, encoded_highlight, precompress_encodings
+
+
+			class SnippetViewSet(ConditionalGetMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+
+			    def get_queryset(self):
+			        queryset = super().get_queryset()
+			        if self.action == 'highlight':
+			            queryset = queryset.defer('code', 'highlighted')
+			        return queryset
+
+			    def highlight_encoding(self):
+			        accept_encoding = self.request.META.get('HTTP_ACCEPT_ENCODING', '')
+			        return choose_encoding(accept_encoding, precompress_encodings())
+
+			    def highlight_validators(self):
+			        row = self.version_row('pk', 'updated', 'highlight_version', 'highlight_state')
+			        if row is None or row[3] != Snippet.HIGHLIGHT_READY:
+			            return None
+			        pk, updated, version, _ = row
+			        return make_etag('highlight', pk, version, self.highlight_encoding()), updated
+
+			    @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
+			    def highlight(self, request, *args, **kwargs):
+			        response = self.conditional(self.highlight_validators, self.render_highlight, request, *args, **kwargs)
+			        patch_vary_headers(response, ['Accept-Encoding'])
+			        return response
+
+			    def render_highlight(self, request, *args, **kwargs):
+			        snippet = self.get_object()
+			        if snippet.highlight_state == Snippet.HIGHLIGHT_PENDING:
+			            return Response('pending', status=status.HTTP_202_ACCEPTED,
+			                            headers={'Retry-After': '1'})
+			        encoding = self.highlight_encoding()
+			        if encoding is None:
+			            response = Response(snippet.highlight_html())
+			        else:
+			            response = HttpResponse(encoded_highlight(snippet, encoding),
+			                                    content_type='text/html; charset=utf-8')
+			            response['Content-Encoding'] = encoding
+			        return response
+
+
+		# Cada codificação é uma representação diferente, então o ETag forte leva a codificação escolhida, e a resposta leva Vary: Accept-Encoding para os caches intermediários. O Vary entra no highlight(), por fora do conditional(), para valer também para o 304: um cache compartilhado que revalida sem o Vary passaria a servir a mesma cópia para qualquer Accept-Encoding.
+
+		# O GZipMiddleware não compacta de novo uma resposta que já tem Content-Encoding, então ele pode continuar ligado para o resto da API.
+
+		# Em tutorial/settings.py (os padrões já são esses):
+
+			SNIPPETS_HIGHLIGHT = {
+			    ...
+			    'PRECOMPRESS': ('br', 'gzip'),   # pip install brotli para o 'br'
+			    'PRECOMPRESS_TTL': 24 * 60 * 60,
+			}
+
+
+		# Uma codificação cujo pacote não está instalado (o 'br' sem o brotli) é tirada da lista pelo precompress_encodings(), então o choose_encoding() nunca escolhe uma variante que não foi gerada, e o navegador que pede br recebe gzip. Com PRECOMPRESS = () nada é pré-compactado e o highlight sai sem compactar.
+
+		# Cuidado com o backend de cache: o Memcached recusa valores maiores que 1 MB por padrão, e aí o set falha em silêncio e toda requisição compacta de novo. Redis ou o cache em arquivo não têm esse limite.
+
+
+		# tom
+			http http://127.0.0.1:8000/snippets/1/highlight/ Accept-Encoding:gzip
+				# HTTP/1.1 200 OK
+				# Content-Encoding: gzip
+				# ETag: "9b2e..."
+				# Vary: Accept-Encoding
+
+			http http://127.0.0.1:8000/snippets/1/highlight/ Accept-Encoding:gzip If-None-Match:'"9b2e..."'
+				# HTTP/1.1 304 Not Modified
+				# Vary: Accept-Encoding
+
+
+	# Caminho rápido para o IsOwnerOrReadOnly em listas e operações em lote
+
+		# O IsOwnerOrReadOnly.has_object_permission compara obj.owner == request.user. O obj.owner carrega o User relacionado, o que pode ser uma consulta por objeto verificado, só para comparar uma pk que já está na linha do snippet (owner_id).
+
+		# Duas mudanças:
+
+			# 1. a verificação por objeto compara owner_id direto com request.user.id, sem carregar o User
+			# 2. a mesma regra em SQL (owner_id = request.user.id), para os caminhos que mexem em muitas linhas de uma vez: PATCH e DELETE em /snippets/bulk/
+
+		# Em snippets/permissions.py:
+
+			from rest_framework import permissions
+
+
+			class IsOwnerOrReadOnly(permissions.BasePermission):
+			    """
+			    Custom permission to only allow owners of an object to edit it.
+			    """
+
+			    def has_object_permission(self, request, view, obj):
+			        # Read permissions are allowed to any request,
+			        # so we'll always allow GET, HEAD or OPTIONS requests.
+			        if request.method in permissions.SAFE_METHODS:
+			            return True
+
+			        # Write permissions are only allowed to the owner of the snippet.
+			        # Compare the foreign key column, without loading the owner.
+			        return obj.owner_id == request.user.id
+
+			    def filter_queryset(self, request, queryset, view):
+			        """
+			        The same rule as a queryset filter, for paths that act on many
+			        rows at once.
+			        """
+			        if request.method in permissions.SAFE_METHODS:
+			            return queryset
+			        return queryset.filter(owner_id=request.user.id)
+
+
+		# Para o usuário anônimo o id é None, e o owner_id nunca é nulo, então a comparação dá False como antes (de qualquer forma o IsAuthenticatedOrReadOnly já barra escrita anônima no check_permissions()).
+
+		# O PUT/PATCH/DELETE de um snippet só continua passando pelo get_object(), para manter o 403 quando o snippet é de outra pessoa. Nos caminhos em lote, um id que não existe e um id de outro dono dão o mesmo 404: o filtro está no SQL e não vazamos quais ids existem.
+
+
+
+		# A ação bulk do SnippetViewSet ganha PATCH (atualizar vários snippets por id) e DELETE (apagar por id). Em snippets/views.py:
+
+			from django.db import transaction
+
+			from snippets.counts import invalidate_counts
+
+			INVALID_ID = {'id': ['A valid integer is required.']}
+
+
+			def is_id(value):
+			    return isinstance(value, int) and not isinstance(value, bool)
+
+
+			    def get_permitted_queryset(self):
+			        """
+			        The queryset with every permission that can be expressed in
+			        SQL applied to it.
+			        """
+			        queryset = self.filter_queryset(self.get_queryset())
+			        for permission in self.get_permissions():
+			            if hasattr(permission, 'filter_queryset'):
+			                queryset = permission.filter_queryset(self.request, queryset, self)
+			        return queryset
+
+			    @action(detail=False, methods=['post', 'patch', 'delete'])
+			    def bulk(self, request, *args, **kwargs):
+			        """
+			        POST creates snippets from a JSON array, PATCH updates the
+			        caller's snippets by id and DELETE removes them by id. Results
+			        are reported per item, in request order.
+			        """
+			        items = request.data
+			        if not isinstance(items, list):
+			            return Response({'detail': 'Expected a list.'},
+			                            status=status.HTTP_400_BAD_REQUEST)
+			        if len(items) > self.bulk_max_items:
+			            return Response({'detail': 'At most %d items per request.' % self.bulk_max_items},
+			                            status=status.HTTP_400_BAD_REQUEST)
+			        handler = {
+			            'POST': self.bulk_create_items,
+			            'PATCH': self.bulk_update_items,
+			            'DELETE': self.bulk_destroy_items,
+			        }[request.method]
+			        return handler(request, items)
+
+			    def bulk_create_items(self, request, items):
+			        # o corpo da antiga ação bulk, a partir do "child = ..."
+			        ...
+
+			    def bulk_update_items(self, request, items):
+			        ids = [item.get('id') for item in items if isinstance(item, dict)]
+			        owned = self.get_permitted_queryset().in_bulk([pk for pk in ids if is_id(pk)])
+			        results = []
+			        with transaction.atomic():
+			            for item in items:
+			                pk = item.get('id') if isinstance(item, dict) else None
+			                if not is_id(pk):
+			                    results.append({'id': pk, 'status': status.HTTP_400_BAD_REQUEST, 'errors': INVALID_ID})
+			                    continue
+			                snippet = owned.get(pk)
+			                if snippet is None:
+			                    results.append({'id': pk, 'status': status.HTTP_404_NOT_FOUND})
+			                    continue
+			                serializer = self.get_serializer(snippet, data=item, partial=True)
+			                if serializer.is_valid():
+			                    serializer.save()
+			                    results.append({'id': pk, 'status': status.HTTP_200_OK, 'data': serializer.data})
+			                else:
+			                    results.append({'id': pk, 'status': status.HTTP_400_BAD_REQUEST,
+			                                    'errors': serializer.errors})
+			        return Response(results)
+
+			    def bulk_destroy_items(self, request, items):
+			        ids = [pk for pk in items if is_id(pk)]
+			        queryset = self.get_permitted_queryset().filter(pk__in=ids)
+			        with transaction.atomic():
+			            found = set(queryset.select_for_update().values_list('pk', flat=True))
+			            queryset.filter(pk__in=found).delete()
+			            transaction.on_commit(lambda: invalidate_counts(Snippet))
+			        return Response([
+			            {'id': pk, 'status': status.HTTP_204_NO_CONTENT if pk in found else status.HTTP_404_NOT_FOUND}
+			            if is_id(pk) else {'id': pk, 'status': status.HTTP_400_BAD_REQUEST, 'errors': INVALID_ID}
+			            for pk in items
+			        ])
+
+
+		# Os snippets do PATCH vêm numa consulta só (in_bulk), já filtrados pelo dono e com o select_related('owner') do RelatedQuerysetMixin, e cada um passa pelo serializer e pelo save() normal: render_key, fila do highlight e invalidação das contagens continuam valendo. Um PATCH que não muda code/language/style/linenos/title nem chega a gerar job de highlight.
+
+		# Um item cujo id não é um inteiro ({"id": [1]}, um objeto no DELETE, true) volta com 400 e o erro no campo id, na posição dele; os outros itens seguem normalmente. O is_id() vem antes de qualquer busca no dict dos encontrados, porque um id que é lista ou objeto nem pode ser usado como chave. O bool fica de fora porque no Python True é um int.
+
+		# O DELETE em lote usa queryset.delete(), que não chama Snippet.delete(); por isso a invalidação das contagens é feita ali. O select_for_update() trava as linhas entre descobrir quais ids são do usuário e apagar.
+
+		# Corpos das requisições:
+
+			# PATCH /snippets/bulk/
+			[{"id": 1, "style": "monokai"}, {"id": 2, "title": "novo"}]
+
+			# DELETE /snippets/bulk/
+			[1, 2, 3]
+
+
+
+		# Benchmark com 10 mil snippets: a verificação de permissão por objeto antiga e nova (tempo e número de consultas), e o PATCH/DELETE em lote em blocos de 1.000. Crie bench_permissions.py ao lado do manage.py:
+
+			import sys
+
+			from benchutils import test_database, timed
+
+			from django.contrib.auth.models import User  # noqa: E402
+			from django.db import connection  # noqa: E402
+			from django.test.utils import CaptureQueriesContext  # noqa: E402
+			from rest_framework import permissions  # noqa: E402
+			from rest_framework.request import Request  # noqa: E402
+			from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+			from snippets.models import Snippet  # noqa: E402
+			from snippets.permissions import IsOwnerOrReadOnly  # noqa: E402
+			from snippets.views import SnippetViewSet  # noqa: E402
+
+
+			class OldIsOwnerOrReadOnly(permissions.BasePermission):
+			    def has_object_permission(self, request, view, obj):
+			        if request.method in permissions.SAFE_METHODS:
+			            return True
+			        return obj.owner == request.user
+
+
+			def check_all(permission, request, snippets):
+			    for snippet in snippets:
+			        assert permission.has_object_permission(request, None, snippet)
+
+
+			def main(count, chunk=1000):
+			    owner = User.objects.create(username='bench')
+			    Snippet.objects.create_many([{'code': 'print(%d)\n' % i} for i in range(count)],
+			                                owner=owner)
+			    factory = APIRequestFactory()
+			    request = Request(factory.patch('/snippets/bulk/'))
+			    request.user = owner
+
+			    for permission in (OldIsOwnerOrReadOnly(), IsOwnerOrReadOnly()):
+			        def run():
+			            check_all(permission, request, list(Snippet.objects.only('id', 'owner_id')))
+			        with CaptureQueriesContext(connection) as context:
+			            run()
+			        print('%-22s %8.1f ms  %6d queries'
+			              % (type(permission).__name__, timed(run, repeat=3), len(context)))
+
+			    view = SnippetViewSet.as_view({'patch': 'bulk', 'delete': 'bulk'})
+			    ids = list(Snippet.objects.values_list('id', flat=True))
+			    chunks = [ids[i:i + chunk] for i in range(0, len(ids), chunk)]
+
+			    def send(method, payload):
+			        bulk_request = getattr(factory, method)('/snippets/bulk/', payload, format='json')
+			        force_authenticate(bulk_request, user=owner)
+			        response = view(bulk_request)
+			        assert response.status_code == 200, response.data
+
+			    styles = iter(['monokai', 'friendly'] * count)
+			    print('bulk PATCH %d rows:  %8.1f ms' % (count, timed(
+			        lambda: [send('patch', [{'id': pk, 'style': next(styles)} for pk in part]) for part in chunks],
+			        repeat=1)))
+			    print('bulk DELETE %d rows: %8.1f ms' % (count, timed(
+			        lambda: [send('delete', part) for part in chunks], repeat=1)))
+
+
+			if __name__ == '__main__':
+			    with test_database():
+			        main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+
+
+			python bench_permissions.py 10000
+
+
+		# Com o OldIsOwnerOrReadOnly aparece uma consulta por snippet (o obj.owner); com o novo, só a consulta da lista.
+
+
+	# Cache por usuário no UserViewSet, invalidado pelas relações
+
+		# O UserViewSet (ReadOnlyModelViewSet sobre User.objects.all() com o UserSerializer) é muito consultado pelos painéis, e cada resposta percorre de novo a relação reversa snippets de cada usuário e monta uma url por snippet.
+
+		# A ideia é guardar o fragmento serializado de cada usuário (o dict que o UserSerializer gera) e só serializar de novo quem mudou. Um usuário muda quando:
+
+			# - um snippet dele é criado ou apagado
+			# - um snippet troca de dono (os dois donos mudam)
+			# - o próprio User é salvo (username) ou apagado
+
+		# Esses eventos chegam por signals e apagam a entrada do usuário. Por baixo, um backend plugável: o padrão é memória local (LRU com limite de entradas e TTL); dá para trocar pelo cache do Django (Redis etc.) quando houver vários processos. Acertos, erros e invalidações ficam contados e expostos num endpoint para administradores.
+
+		# O fragmento depende do host (as urls são absolutas) e do sufixo de formato. Em vez de uma chave por combinação, cada usuário tem uma entrada só, com um dict variante -> fragmento dentro. Assim a invalidação apaga uma chave por usuário, qualquer que seja o backend.
+
+		# Crie o arquivo snippets/fragments.py:
+
+			import threading
+			import time
+			from collections import OrderedDict
+
+			from django.conf import settings
+			from django.core.cache import caches
+			from django.utils.module_loading import import_string
+
+
+			class LocalFragmentCache:
+			    """
+			    In-process LRU cache with a TTL, bounded by entry count.
+			    """
+			    def __init__(self, max_entries=10000, ttl=300):
+			        self.entries = OrderedDict()
+			        self.max_entries = max_entries
+			        self.ttl = ttl
+			        self.lock = threading.Lock()
+
+			    def get_many(self, keys):
+			        now = time.monotonic()
+			        found = {}
+			        with self.lock:
+			            for key in keys:
+			                entry = self.entries.get(key)
+			                if entry is None:
+			                    continue
+			                if entry[0] < now:
+			                    del self.entries[key]
+			                    continue
+			                self.entries.move_to_end(key)
+			                found[key] = entry[1]
+			        return found
+
+			    def set_many(self, mapping):
+			        expires = time.monotonic() + self.ttl
+			        with self.lock:
+			            for key, value in mapping.items():
+			                self.entries[key] = (expires, value)
+			                self.entries.move_to_end(key)
+			            while len(self.entries) > self.max_entries:
+			                self.entries.popitem(last=False)
+
+			    def delete_many(self, keys):
+			        with self.lock:
+			            for key in keys:
+			                self.entries.pop(key, None)
+
+			    def __len__(self):
+			        return len(self.entries)
+
+
+			class DjangoFragmentCache:
+			    """
+			    Fragment cache on top of one of the CACHES aliases, shared by
+			    every process that uses it.
+			    """
+			    def __init__(self, alias='default', ttl=300):
+			        self.cache = caches[alias]
+			        self.ttl = ttl
+
+			    def get_many(self, keys):
+			        return self.cache.get_many(keys)
+
+			    def set_many(self, mapping):
+			        self.cache.set_many(mapping, self.ttl)
+
+			    def delete_many(self, keys):
+			        self.cache.delete_many(keys)
+
+
+			class FragmentStats:
+			    def __init__(self):
+			        self.lock = threading.Lock()
+			        self.counts = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+			    def add(self, **counts):
+			        with self.lock:
+			            for name, value in counts.items():
+			                self.counts[name] += value
+
+			    def snapshot(self):
+			        with self.lock:
+			            counts = dict(self.counts)
+			        lookups = counts['hits'] + counts['misses']
+			        counts['hit_ratio'] = counts['hits'] / lookups if lookups else None
+			        return counts
+
+
+			_fragment_cache = None
+			_fragment_lock = threading.Lock()
+			stats = FragmentStats()
+
+
+			def get_fragment_cache():
+			    global _fragment_cache
+			    with _fragment_lock:
+			        if _fragment_cache is None:
+			            config = getattr(settings, 'SNIPPETS_USER_CACHE', {})
+			            backend_class = import_string(config.get(
+			                'BACKEND', 'snippets.fragments.LocalFragmentCache'))
+			            _fragment_cache = backend_class(**config.get('OPTIONS', {}))
+			    return _fragment_cache
+
+
+			def user_key(pk):
+			    return 'snippets:user:%s' % pk
+
+
+			def invalidate_users(pks):
+			    pks = {pk for pk in pks if pk is not None}
+			    if pks:
+			        get_fragment_cache().delete_many([user_key(pk) for pk in pks])
+			        stats.add(invalidations=len(pks))
+
+
+			class FragmentCacheMixin:
+			    """
+			    Serve `list` and `retrieve` from cached per-object fragments,
+			    serializing (and prefetching for) only the objects that missed.
+			    """
+			    def get_queryset(self):
+			        # Prefetching happens per miss, in serialize_many().
+			        return super().get_queryset().prefetch_related(None)
+
+			    def fragment_variant(self):
+			        return '%s|%s' % (self.request.build_absolute_uri('/'), self.format_kwarg or '')
+
+			    def serialize_many(self, instances):
+			        cache = get_fragment_cache()
+			        variant = self.fragment_variant()
+			        keys = [user_key(instance.pk) for instance in instances]
+			        entries = cache.get_many(keys)
+			        missing = [instance for instance, key in zip(instances, keys)
+			                   if variant not in entries.get(key, {})]
+			        stats.add(hits=len(instances) - len(missing), misses=len(missing))
+			        if missing:
+			            serializer_class = self.get_serializer_class()
+			            prefetch_for(missing, serializer_class)
+			            data = self.get_serializer(missing, many=True).data
+			            fresh = {}
+			            for instance, fragment in zip(missing, data):
+			                key = user_key(instance.pk)
+			                entry = dict(entries.get(key, {}))
+			                entry[variant] = fragment
+			                entries[key] = fresh[key] = entry
+			            cache.set_many(fresh)
+			        return [entries[key][variant] for key in keys]
+
+			    def list(self, request, *args, **kwargs):
+			        queryset = self.filter_queryset(self.get_queryset())
+			        page = self.paginate_queryset(queryset)
+			        if page is None:
+			            return super().list(request, *args, **kwargs)
+			        return self.get_paginated_response(self.serialize_many(page))
+
+			    def retrieve(self, request, *args, **kwargs):
+			        return Response(self.serialize_many([self.get_object()])[0])
+
+
+		# (no topo do arquivo também: from rest_framework.response import Response e from snippets.queries import prefetch_for)
+
+		# O prefetch_related(None) limpa o prefetch que o RelatedQuerysetMixin colocou; para os usuários que faltaram no cache, o prefetch_for() faz o mesmo prefetch só neles. Em snippets/queries.py, separe a montagem dos Prefetch:
+
+			from django.db.models import prefetch_related_objects
+
+
+			def prefetch_lookups(serializer_class, model):
+			    _, prefetch = serializer_lookups(serializer_class, model)
+			    lookups = []
+			    for lookup, related_model, columns in prefetch:
+			        if columns is None:
+			            lookups.append(lookup)
+			        else:
+			            related = related_model._default_manager.only(*columns)
+			            lookups.append(Prefetch(lookup, queryset=related))
+			    return lookups
+
+
+			def prefetch_for(instances, serializer_class):
+			    if instances:
+			        prefetch_related_objects(instances, *prefetch_lookups(serializer_class, type(instances[0])))
+
+
+			def optimize_queryset(queryset, serializer_class):
+			    select, _ = serializer_lookups(serializer_class, queryset.model)
+			    if select:
+			        queryset = queryset.select_related(*select)
+			    lookups = prefetch_lookups(serializer_class, queryset.model)
+			    if lookups:
+			        queryset = queryset.prefetch_related(*lookups)
+			    return queryset
+
+
+		# Sem paginação o list cai no super().list(), que é o streaming: lá não há cache por fragmento, mas também não há o custo de montar tudo na memória.
+
+
+
+		# Os signals. Para saber o dono anterior de um snippet, o modelo lembra o owner_id com que a linha foi carregada. Em snippets/models.py:
+
+			    @classmethod
+			    def from_db(cls, db, field_names, values):
+			        instance = super().from_db(db, field_names, values)
+			        instance._loaded_owner_id = instance.__dict__.get('owner_id')
+			        return instance
+
+
+		# Crie o arquivo snippets/signals.py:
+
+			from django.contrib.auth.models import User
+			from django.db import transaction
+			from django.db.models.signals import post_delete, post_save
+			from django.dispatch import receiver
+
+			from snippets.fragments import invalidate_users
+			from snippets.models import Snippet
+
+
+			@receiver(post_save, sender=Snippet)
+			def snippet_saved(sender, instance, created, **kwargs):
+			    previous = getattr(instance, '_loaded_owner_id', None)
+			    owners = {instance.owner_id, previous}
+			    instance._loaded_owner_id = instance.owner_id
+			    if created or (previous is not None and previous != instance.owner_id):
+			        transaction.on_commit(lambda: invalidate_users(owners))
+
+
+			@receiver(post_delete, sender=Snippet)
+			def snippet_deleted(sender, instance, **kwargs):
+			    owner_id = instance.owner_id
+			    transaction.on_commit(lambda: invalidate_users({owner_id}))
+
+
+			@receiver(post_save, sender=User)
+			@receiver(post_delete, sender=User)
+			def user_changed(sender, instance, **kwargs):
+			    pk = instance.pk
+			    transaction.on_commit(lambda: invalidate_users({pk}))
+
+
+		# Salvar um snippet sem trocar o dono não invalida nada: a representação do usuário só tem as urls dos snippets, e elas não mudam.
+
+		# A invalidação é feita depois do commit, pelo mesmo motivo das contagens: antes dele, outra requisição poderia ler o estado antigo e guardar no cache de novo.
+
+		# O bulk_create não envia signals, então o create_many() invalida os donos ele mesmo:
+
+			            transaction.on_commit(lambda: invalidate_users({snippet.owner_id for snippet in snippets}))
+
+
+		# O DELETE em lote usa queryset.delete(), que envia post_delete para cada objeto quando há receivers, então ele já está coberto.
+
+		# Os signals precisam ser importados quando o app sobe. Em snippets/apps.py:
+
+			from django.apps import AppConfig
+
+
+			class SnippetsConfig(AppConfig):
+			    name = 'snippets'
+
+			    def ready(self):
+			        from snippets import signals  # noqa: F401
+
+
+
+		# No UserViewSet, em snippets/views.py:
+
+			from rest_framework.decorators import api_view, permission_classes
+
+			from snippets import fragments
+			from snippets.fragments import FragmentCacheMixin
+
+
+			class UserViewSet(FragmentCacheMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ReadOnlyModelViewSet):
+			    """
+			    This viewset automatically provides `list` and `detail` actions.
+			    """
+			    queryset = User.objects.all()
+			    serializer_class = UserSerializer
+			    pagination_class = UserKeysetPagination
+
+
+			@api_view(['GET'])
+			@permission_classes([permissions.IsAdminUser])
+			def user_cache_stats(request, format=None):
+			    """
+			    Hit/miss counters of the UserViewSet fragment cache.
+			    """
+			    counts = fragments.stats.snapshot()
+			    cache = fragments.get_fragment_cache()
+			    counts['backend'] = type(cache).__name__
+			    if hasattr(cache, '__len__'):
+			        counts['entries'] = len(cache)
+			    return Response(counts)
+
+
+		# E em snippets/urls.py:
+
+			urlpatterns = [
+			    path('snippets/export/', snippet_export, name='snippet-export'),
+			    path('metrics/user-cache/', views.user_cache_stats, name='user-cache-stats'),
+			    path('', include(router.urls)),
+			]
+
+
+		# Os contadores são por processo. Com vários workers cada um mostra os seus.
+
+		# Em tutorial/settings.py (os padrões já são esses):
+
+			SNIPPETS_USER_CACHE = {
+			    'BACKEND': 'snippets.fragments.LocalFragmentCache',
+			    'OPTIONS': {'max_entries': 10000, 'ttl': 300},
+			}
+
+
+		# Com LocalFragmentCache e vários processos, a invalidação de um não chega nos outros e a entrada velha vive até o TTL. Nesse caso use o DjangoFragmentCache com um cache compartilhado:
+
+			SNIPPETS_USER_CACHE = {
+			    'BACKEND': 'snippets.fragments.DjangoFragmentCache',
+			    'OPTIONS': {'alias': 'default', 'ttl': 300},
+			}
+
+
+		# tom
+			http -a admin:adminadmin http://127.0.0.1:8000/metrics/user-cache/
+
+			HTTP/1.1 200 OK
+			...
+			{
+			    "hits": 18,
+			    "misses": 2,
+			    "invalidations": 1,
+			    "hit_ratio": 0.9,
+			    "backend": "LocalFragmentCache",
+			    "entries": 2
+			}
+
+
+	# Renderizar de novo só o que ficou velho quando o pygments ou um estilo muda
+
+		# O HTML é gerado uma vez, no save(). Se o pygments é atualizado (lexers novos, tokens diferentes) ou a definição de um estilo do STYLE_CHOICES muda, todas as linhas antigas continuam com o HTML de antes, e a única saída hoje é chamar save() em tudo, uma por uma.
+
+		# A ideia: cada linha guarda a impressão digital (fingerprint) do renderizador que a gerou. Um comando acha as linhas cujo fingerprint não bate com o atual e as renderiza de novo no pool de processos, em lotes, gravando com bulk_update, guardando um checkpoint a cada lote e dormindo entre os lotes para não tirar a CPU e o banco da API.
+
+		# O fingerprint depende do estilo de cada linha (um estilo mudou, só as linhas dele ficam velhas). Em snippets/highlighting.py:
+
+			import pygments
+
+
+			@lru_cache(maxsize=None)
+			def _fingerprint(style, page):
+			    digest = hashlib.sha256()
+			    for part in (pygments.__version__, page_stylesheet(style), page):
+			        digest.update(part.encode('utf-8'))
+			        digest.update(b'\0')
+			    return digest.hexdigest()[:16]
+
+
+			def renderer_fingerprint(style):
+			    """
+			    Version of everything besides the snippet itself that shapes a
+			    render: pygments, the style definition and the page format.
+			    """
+			    return _fingerprint(style, page_format())
+
+
+		# A folha de estilo gerada pelo pygments (page_stylesheet) representa a definição do estilo: mudou uma cor, muda o fingerprint. Os lexers vêm junto com a versão do pygments.
+
+		# O fingerprint também entra na render_key, no lugar do page_format() (que agora faz parte dele). Sem isso o RenderCache devolveria o HTML antigo para o conteúdo que estamos renderizando de novo:
+
+			def render_key(code, language, style, linenos, title):
+			    """
+			    Content address of a render: a hash of every input pygments sees,
+			    plus the version of the renderer.
+			    """
+			    digest = hashlib.sha256()
+			    for part in (code, language, style, 'table' if linenos else '', title, renderer_fingerprint(style)):
+			        data = part.encode('utf-8')
+			        digest.update(b'%d:' % len(data))
+			        digest.update(data)
+			    return digest.hexdigest()
+
+
+		# As entradas antigas do RenderCache e das variantes compactadas ficam com chaves que ninguém mais pede, e saem pelo LRU e pelo TTL.
+
+		# O render_many() aceita um pool de fora, para o comando controlar quantos processos usa:
+
+			def render_many(rows, pool=None):
+			    ...
+			        results = (pool or get_render_pool()).map(render, missing.values(), chunksize=chunksize)
+
+
+
+		# Em snippets/models.py, o campo novo e um índice para achar as linhas velhas de um estilo:
+
+			from snippets.highlighting import renderer_fingerprint
+
+
+			class Snippet(models.Model):
+			    ...
+			    render_version = models.CharField(max_length=16, blank=True, default='')
+
+			    class Meta:
+			        ordering = ['created']
+			        indexes = [
+			            models.Index(fields=['created', 'id'], name='snippet_created_id_idx'),
+			            models.Index(fields=['style', 'render_version'], name='snippet_style_version_idx'),
+			        ]
+
+
+		# O save() grava o fingerprint junto com a render_key (quando ela muda):
+
+			        if key != self.render_key:
+			            self.render_key = key
+			            self.render_version = renderer_fingerprint(self.style)
+			            self.highlight_version += 1
+			            ...
+
+
+		# O render_version entra no RENDER_FIELDS, para ser gravado também num save(update_fields=[...]):
+
+			RENDER_FIELDS = {'render_key', 'render_version', 'highlight_version', 'highlight_state', 'highlighted'}
+
+
+		# E, como sempre, o create_many() faz o mesmo: snippet.render_version = renderer_fingerprint(snippet.style) no laço que já preenche a render_key.
+
+		# Na migração as linhas existentes ficam com render_version = '', ou seja, todas aparecem como velhas e a primeira rodada do comando renderiza a base inteira uma vez:
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+
+		# O comando. Crie o arquivo snippets/management/commands/rehighlight.py:
+
+			import json
+			import os
+			import time
+			from concurrent.futures import ProcessPoolExecutor
+
+			from django.core.management.base import BaseCommand
+			from django.db import transaction
+			from django.db.models import Q
+			from django.utils import timezone
+
+			from snippets.highlighting import render_many, renderer_fingerprint
+			from snippets.models import Snippet, SnippetHighlight, highlight_storage
+
+			INPUTS = ('code', 'language', 'style', 'linenos', 'title')
+
+
+			class Command(BaseCommand):
+			    help = 'Re-render highlights stored by an outdated pygments version or style.'
+
+			    def add_arguments(self, parser):
+			        parser.add_argument('--batch-size', type=int, default=500)
+			        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+			                            help='Render processes (default: half of the cores).')
+			        parser.add_argument('--duty-cycle', type=float, default=0.5,
+			                            help='Fraction of the time spent working; the rest is spent sleeping.')
+			        parser.add_argument('--checkpoint', default='rehighlight-checkpoint.json')
+			        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+			        parser.add_argument('--dry-run', action='store_true', help='Only count the stale rows.')
+
+			    def handle(self, *args, **options):
+			        styles = Snippet.objects.order_by().values_list('style', flat=True).distinct()
+			        current = {style: renderer_fingerprint(style) for style in styles}
+			        condition = Q(pk__in=[])
+			        for style, version in current.items():
+			            condition |= Q(style=style) & ~Q(render_version=version)
+			        stale = Snippet.objects.filter(condition).exclude(highlight_state=Snippet.HIGHLIGHT_PENDING)
+
+			        if options['dry_run']:
+			            self.stdout.write('%d stale snippets' % stale.count())
+			            return
+
+			        path = options['checkpoint']
+			        checkpoint = self.load_checkpoint(path, current, options['restart'])
+			        duty = min(max(options['duty_cycle'], 0.01), 1.0)
+			        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+			            while True:
+			                rows = list(stale.filter(pk__gt=checkpoint['last_pk']).order_by('pk')
+			                            .values('pk', 'highlight_version', *INPUTS)[:options['batch_size']])
+			                if not rows:
+			                    break
+			                started = time.monotonic()
+			                checkpoint['rendered'] += self.rerender(rows, current, pool)
+			                checkpoint['last_pk'] = rows[-1]['pk']
+			                self.save_checkpoint(path, checkpoint)
+			                elapsed = time.monotonic() - started
+			                self.stdout.write('%d rendered, up to pk %d (%.2fs)'
+			                                  % (checkpoint['rendered'], checkpoint['last_pk'], elapsed))
+			                time.sleep(elapsed * (1 - duty) / duty)
+			        if os.path.exists(path):
+			            os.remove(path)
+			        self.stdout.write(self.style.SUCCESS('Re-rendered %d snippets' % checkpoint['rendered']))
+
+			    def rerender(self, rows, current, pool):
+			        """
+			        Render one batch and write it back, skipping the rows that were
+			        saved again since they were read.
+			        """
+			        rendered = render_many([{name: row[name] for name in INPUTS} for row in rows], pool=pool)
+			        table = highlight_storage() == 'table'
+			        with transaction.atomic():
+			            unchanged = set(Snippet.objects.select_for_update()
+			                            .filter(pk__in=[row['pk'] for row in rows])
+			                            .values_list('pk', 'highlight_version'))
+			            now = timezone.now()
+			            snippets, highlights = [], []
+			            for row, (key, html) in zip(rows, rendered):
+			                if (row['pk'], row['highlight_version']) not in unchanged:
+			                    continue
+			                snippet = Snippet(pk=row['pk'], render_key=key, render_version=current[row['style']],
+			                                  highlight_version=row['highlight_version'] + 1,
+			                                  highlight_state=Snippet.HIGHLIGHT_READY, updated=now)
+			                if table:
+			                    highlights.append(SnippetHighlight(snippet_id=row['pk'], html=html))
+			                else:
+			                    snippet.highlighted = html
+			                snippets.append(snippet)
+			            fields = ['render_key', 'render_version', 'highlight_version', 'highlight_state', 'updated']
+			            if not table:
+			                fields.append('highlighted')
+			            Snippet.objects.bulk_update(snippets, fields)
+			            if highlights:
+			                SnippetHighlight.objects.bulk_create(highlights, update_conflicts=True,
+			                                                     unique_fields=['snippet'], update_fields=['html'])
+			        return len(snippets)
+
+			    def load_checkpoint(self, path, current, restart):
+			        if not restart and os.path.exists(path):
+			            with open(path, encoding='utf-8') as f:
+			                checkpoint = json.load(f)
+			            if checkpoint['fingerprints'] == current:
+			                self.stdout.write('Resuming after pk %d' % checkpoint['last_pk'])
+			                return checkpoint
+			        return {'fingerprints': current, 'last_pk': 0, 'rendered': 0}
+
+			    def save_checkpoint(self, path, checkpoint):
+			        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+			            json.dump(checkpoint, f)
+			        os.replace(path + '.tmp', path)
+
+
+		# Algumas observações:
+
+			# - o percurso é por pk crescente (keyset, como na paginação), então cada lote é uma busca pelo índice da pk, não um OFFSET cada vez maior
+			# - o checkpoint é gravado depois do commit de cada lote, com os.replace (atômico). Se o comando morrer, a próxima execução continua do último lote gravado. Se os fingerprints mudaram desde então (outro upgrade no meio), ele recomeça do zero; --restart força isso
+			# - sem o checkpoint o resultado seria o mesmo (as linhas já renderizadas deixam de ser velhas), ele só evita percorrer de novo o começo da tabela e as linhas que não mudam de estado, como as que foram salvas de novo no meio do caminho
+			# - a escrita é condicionada ao highlight_version lido: se alguém salvou o snippet depois da leitura, o save() dele já cuidou da renderização e a linha é pulada. O select_for_update segura só as linhas do lote, e só durante o bulk_update
+			# - o highlight_version sobe em 1, então o ETag do highlight muda e os clientes recebem o HTML novo. O updated (o Last-Modified) também é gravado: o bulk_update não passa pelo auto_now, e sem isso um cliente que só manda If-Modified-Since continuaria recebendo 304 com o HTML antigo
+			# - as linhas pendentes (HIGHLIGHT_PENDING) ficam de fora: o worker do save() vai renderizá-las com o pygments atual
+			# - o --duty-cycle 0.5 dorme depois de cada lote o mesmo tempo que o lote levou; com 0.25, três vezes esse tempo. Junto com --workers (metade dos núcleos por padrão) isso deixa folga para a API
+			# - o bulk_create com update_conflicts (modo STORAGE = 'table') precisa do Django 4.1+
+
+
+		# Rode o comando depois que todos os processos da API estiverem com o pygments novo; senão um processo antigo pode gravar um fingerprint velho depois que o comando passou, e aquela linha só será pega numa próxima rodada.
+
+
+		# tom
+			pip install -U pygments
+			python manage.py freeze_choices
+			python manage.py rehighlight --dry-run
+			    # 1843211 stale snippets
+			python manage.py rehighlight --batch-size 1000 --workers 4
+			    # 1000 rendered, up to pk 1000 (1.84s)
+			    # 2000 rendered, up to pk 2000 (1.79s)
+			    # ...
+
+
+	# Cache de lexers e formatters do pygments
+
+		# Cada renderização chama get_lexer_by_name(language), que resolve o alias passando pelos plugins e pelo mapa de lexers, e cria um HtmlFormatter(style=..., linenos=..., full=True, ...) novo. O construtor do HtmlFormatter monta as tabelas do estilo (classe css de cada token) e, com full=True, a folha de estilo inteira é gerada de novo para o cabeçalho da página. Para snippets pequenos isso custa mais do que a tokenização.
+
+		# Três caches, compartilhados por todas as requisições (e, no pool de processos, um por processo):
+
+			# - a classe do lexer por alias
+			# - o HtmlFormatter por (style, linenos), que só gera o corpo
+			# - a folha de estilo por estilo (o page_stylesheet() que já existe); o cabeçalho da página é montado pelo assemble_page()
+
+		# Em snippets/highlighting.py:
+
+			import copy
+
+			from pygments.lexers import find_lexer_class_by_name
+
+
+			@lru_cache(maxsize=None)
+			def lexer_class(alias):
+			    return find_lexer_class_by_name(alias)
+
+
+			@lru_cache(maxsize=None)
+			def body_formatter(style, linenos):
+			    """
+			    HtmlFormatter for (style, linenos), with the style tables built
+			    once. Renders use a shallow copy of it.
+			    """
+			    return HtmlFormatter(style=style, linenos='table' if linenos else False)
+
+
+			def render_highlight(code, language, style, linenos, title, full=True):
+			    """
+			    Use the `pygments` library to create a highlighted HTML
+			    representation of the code snippet. With full=False only the
+			    body is rendered; see `assemble_page`.
+			    """
+			    lexer = lexer_class(language)()
+			    body = highlight(code, lexer, copy.copy(body_formatter(style, linenos)))
+			    if full:
+			        return assemble_page(body, style, title)
+			    return body
+
+
+		# O lru_cache é seguro entre threads: no pior caso duas threads criam o mesmo objeto ao mesmo tempo e uma das cópias é descartada. Os nomes de linguagem e estilo vêm das choices, então os caches têm no máximo um item por linguagem e por estilo x 2.
+
+		# O lexer continua sendo instanciado a cada renderização (é barato: só guarda as opções), então nenhum estado de tokenização é compartilhado. O formatter é copiado raso: as tabelas do estilo (ttype2class, class2style) são só lidas durante a formatação; a única coisa escrita é o span_element_openers, um memo do próprio pygments em que a mesma chave sempre recebe o mesmo valor, então tudo bem as cópias dividirem esse dict entre threads.
+
+		# A página inteira passa a ser sempre o corpo + assemble_page(). O title só aparece no cabeçalho, por isso ele não entra na chave do formatter. A folha de estilo não depende do linenos (o RenderHighlightTests cobre os dois casos), então ela fica só por estilo.
+
+		# O RenderHighlightTests da parte de armazenamento compara com o pygments chamado diretamente, sem cache nenhum, então ele já cobre os caches: o corpo e a página inteira continuam saindo iguais, com e sem linenos e title.
+
+		# Os fingerprints (parte anterior) não mudam: o HTML gerado é exatamente o mesmo, então nada fica velho e o rehighlight não tem o que fazer.
+
+
+
+		# Benchmark para snippets pequenos. Crie bench_render.py ao lado do manage.py:
+
+			import sys
+			import time
+			from concurrent.futures import ThreadPoolExecutor
+
+			import benchutils  # noqa: F401 (django.setup)
+
+			from pygments import highlight  # noqa: E402
+			from pygments.formatters.html import HtmlFormatter  # noqa: E402
+			from pygments.lexers import get_lexer_by_name  # noqa: E402
+
+			from snippets.highlighting import render_highlight  # noqa: E402
+
+
+			def uncached(code, language, style, linenos, title, full=True):
+			    lexer = get_lexer_by_name(language)
+			    options = {'title': title} if title else {}
+			    formatter = HtmlFormatter(style=style, linenos='table' if linenos else False,
+			                              full=full, **options)
+			    return highlight(code, lexer, formatter)
+
+
+			def make_rows(count):
+			    languages = ('python', 'js', 'html', 'sql', 'bash')
+			    styles = ('friendly', 'monokai', 'default')
+			    return [{'code': 'x = %d\nprint(x)\n' % i, 'language': languages[i % 5],
+			             'style': styles[i % 3], 'linenos': bool(i % 2), 'title': 'snippet %d' % i}
+			            for i in range(count)]
+
+
+			def per_render(render, rows, threads=1, **kwargs):
+			    start = time.perf_counter()
+			    if threads == 1:
+			        results = [render(full=True, **row) for row in rows]
+			    else:
+			        with ThreadPoolExecutor(threads) as pool:
+			            results = list(pool.map(lambda row: render(full=True, **row), rows))
+			    return (time.perf_counter() - start) / len(rows) * 1e6, results
+
+
+			def main(count):
+			    rows = make_rows(count)
+			    render_highlight(full=True, **rows[0])  # aquece os caches
+			    before, expected = per_render(uncached, rows)
+			    after, results = per_render(render_highlight, rows)
+			    threaded, threaded_results = per_render(render_highlight, rows, threads=8)
+			    assert results == expected and threaded_results == expected
+			    print('uncached:           %7.1f us/render' % before)
+			    print('cached:             %7.1f us/render (%.1fx)' % (after, before / after))
+			    print('cached, 8 threads:  %7.1f us/render' % threaded)
+
+
+			if __name__ == '__main__':
+			    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+
+
+		# As threads não deixam a renderização mais rápida (o GIL segura a tokenização); a rodada com 8 threads está lá para conferir que a saída com os objetos compartilhados é idêntica à sem cache.
+
+
+		# tom
+			python bench_render.py
+			    # uncached:             918.4 us/render
+			    # cached:               152.3 us/render (6.0x)
+			    # cached, 8 threads:    160.9 us/render
+
+
+	# Limite de tamanho e tempo máximo para o highlight de snippets patológicos
+
+		# O code do SnippetSerializer é um CharField sem limite, e o save() manda para o pygments o que chegar. Alguns lexers baseados em expressões regulares levam segundos (ou muita memória) com uma entrada feita sob medida, e isso prende os workers.
+
+		# Três defesas:
+
+			# 1. tamanho máximo do code por linguagem, verificado no serializer (400 na API)
+			# 2. a renderização roda num processo separado com tempo máximo (relógio) e limite de memória; quem passa do limite é morto e trocado por um processo novo
+			# 3. quando o limite estoura, o snippet é renderizado como texto puro (lexer 'text', que é linear), com o mesmo estilo e linenos, em vez de ficar sem HTML
+
+		# E contadores de quantas vezes cada limite disparou, por linguagem.
+
+		# O ProcessPoolExecutor que usamos até agora não serve para o item 2: o future.result(timeout=...) desiste de esperar, mas o processo continua preso na expressão regular, e não há como matar só aquele trabalho. Por isso um pool próprio, simples: cada processo faz um trabalho por vez, ligado ao pai por um Pipe.
+
+		# Crie o arquivo snippets/sandbox.py:
+
+			import multiprocessing
+			import os
+			import queue
+			import threading
+			from collections import Counter
+			from concurrent.futures import ThreadPoolExecutor
+			from functools import partial
+
+			try:
+			    import resource
+			except ImportError:  # Windows
+			    resource = None
+
+
+			class LimitCounters:
+			    """
+			    How often each limit fired, per language. Counts are per process.
+			    """
+			    def __init__(self):
+			        self.lock = threading.Lock()
+			        self.counts = Counter()
+
+			    def add(self, reason, language):
+			        with self.lock:
+			            self.counts[reason, language] += 1
+
+			    def snapshot(self):
+			        with self.lock:
+			            counts = dict(self.counts)
+			        result = {}
+			        for (reason, language), count in sorted(counts.items()):
+			            result.setdefault(reason, {})[language] = count
+			        return result
+
+
+			limits = LimitCounters()
+
+
+			def address_space():
+			    """
+			    Virtual size of this process in bytes, or None where /proc is not
+			    available.
+			    """
+			    try:
+			        with open('/proc/self/statm') as statm:
+			            return int(statm.read().split()[0]) * resource.getpagesize()
+			    except (OSError, ValueError):
+			        return None
+
+
+			def limit_memory(headroom):
+			    """
+			    Let this process grow by at most `headroom` bytes of address space
+			    from where it is now.
+			    """
+			    current = address_space()
+			    if current is None:
+			        return
+			    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+			    limit = current + headroom
+			    if hard != resource.RLIM_INFINITY:
+			        limit = min(limit, hard)
+			    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+			def _serve(connection, memory_limit):
+			    if memory_limit and resource is not None:
+			        limit_memory(memory_limit)
+			    while True:
+			        try:
+			            function, item = connection.recv()
+			        except EOFError:
+			            return
+			        try:
+			            connection.send((True, function(item)))
+			        except MemoryError:
+			            connection.send((False, 'memory'))
+			        except (ImportError, OSError):
+			            connection.send((False, 'broken'))
+			        except Exception:
+			            connection.send((False, 'error'))
+
+
+			class RenderSandbox:
+			    """
+			    Worker processes that run one render at a time under a wall-clock
+			    timeout and an address-space limit (`memory_limit` bytes on top of
+			    what the worker uses when it starts). A worker that goes over budget
+			    is killed and replaced.
+			    """
+			    def __init__(self, workers=None, timeout=5.0, memory_limit=512 * 1024 * 1024):
+			        self.size = workers or os.cpu_count() or 1
+			        self.timeout = timeout
+			        self.memory_limit = memory_limit
+			        self.idle = queue.Queue()
+			        for _ in range(self.size):
+			            self.idle.put(self.start_worker())
+
+			    def start_worker(self):
+			        connection, child = multiprocessing.Pipe()
+			        process = multiprocessing.Process(target=_serve, args=(child, self.memory_limit), daemon=True)
+			        process.start()
+			        child.close()
+			        return process, connection
+
+			    def run(self, function, item):
+			        """
+			        (True, result), or (False, reason) when the render failed or
+			        went over budget.
+			        """
+			        worker = self.idle.get()
+			        try:
+			            ok, value = self.send(worker, function, item)
+			            if not ok and value != 'error':
+			                worker = self.replace(worker)
+			            return ok, value
+			        finally:
+			            self.idle.put(worker)
+
+			    def send(self, worker, function, item):
+			        process, connection = worker
+			        try:
+			            connection.send((function, item))
+			            if not connection.poll(self.timeout):
+			                return False, 'timeout'
+			            return connection.recv()
+			        except (EOFError, OSError):
+			            return False, 'crashed'
+
+			    def replace(self, worker):
+			        process, connection = worker
+			        process.kill()
+			        process.join()
+			        connection.close()
+			        return self.start_worker()
+
+			    def map(self, function, items):
+			        items = list(items)
+			        if len(items) == 1:
+			            return [self.run(function, items[0])]
+			        with ThreadPoolExecutor(self.size) as threads:
+			            return list(threads.map(partial(self.run, function), items))
+
+			    def shutdown(self):
+			        for _ in range(self.size):
+			            process, connection = self.idle.get()
+			            process.kill()
+			            process.join()
+			            connection.close()
+
+
+		# Sobre o run():
+
+			# - o timeout é de relógio, medido pelo poll() do pai; é ele que pega o caso de uma expressão regular em loop
+			# - a memória é limitada com RLIMIT_AS dentro do processo filho, a partir do tamanho que ele já tem: o filho nasce de um fork() do processo do Django, que com as threads dele já passa facilmente de 600 MB de memória virtual, então um limite absoluto de 512 MB faria qualquer import ou alocação do filho falhar. O MEMORY_LIMIT é o quanto uma renderização pode crescer além disso. Passar dele vira MemoryError lá dentro, e o processo é trocado porque o estado dele depois disso não é confiável
+			# - um erro comum do lexer ('error') não troca o processo: ele continua saudável. Um ImportError ou OSError no filho (um lexer que não conseguiu ser importado, uma biblioteca que não conseguiu ser mapeada) é 'broken': o processo é trocado, e o contador mostra que o problema é do ambiente e não do snippet
+			# - se o processo morrer (OOM killer, segfault), o Pipe fecha e o resultado é 'crashed'
+			# - o resource não existe no Windows; lá só o tempo é limitado
+
+		# O map() espalha os itens pelos processos usando uma thread por processo, que só fica esperando no Pipe.
+
+		# E, ainda em snippets/sandbox.py, o sandbox compartilhado, configurado pelo settings:
+
+			from django.conf import settings
+
+			_sandbox = None
+			_sandbox_lock = threading.Lock()
+
+
+			def new_sandbox(workers=None):
+			    """
+			    A RenderSandbox configured from the settings, or None when
+			    SNIPPETS_HIGHLIGHT['TIMEOUT'] is None (render without a budget, as
+			    before).
+			    """
+			    config = getattr(settings, 'SNIPPETS_HIGHLIGHT', {})
+			    if config.get('TIMEOUT', 5.0) is None:
+			        return None
+			    return RenderSandbox(workers=workers or config.get('SANDBOX_WORKERS'),
+			                         timeout=config.get('TIMEOUT', 5.0),
+			                         memory_limit=config.get('MEMORY_LIMIT', 512 * 1024 * 1024))
+
+
+			def get_sandbox():
+			    """
+			    The shared RenderSandbox of this process, or None (see new_sandbox()).
+			    """
+			    global _sandbox
+			    with _sandbox_lock:
+			        if _sandbox is None:
+			            _sandbox = new_sandbox()
+			        return _sandbox
+
+
+			def max_code_size(language):
+			    sizes = getattr(settings, 'SNIPPETS_HIGHLIGHT', {}).get('MAX_CODE_SIZE', {})
+			    return sizes.get(language, sizes.get('default', 100000))
+
+
+
+		# Em snippets/highlighting.py, uma função só para renderizar uma lista de linhas, usada pelo render_snippet() e pelo render_many(). Quem passou do limite sai como texto puro:
+
+			from snippets.sandbox import limits
+
+
+			def plain_row(row):
+			    return dict(row, language='text')
+
+
+			def render_rows(rows, executor=None, sandbox=None):
+			    """
+			    Render `rows` to [(key, html, variants)]. With a sandbox, a row that
+			    goes over budget is rendered as plain text instead, and gets the
+			    render_key of the plain-text render.
+			    """
+			    render = partial(render_row, full=page_format() == 'page', encodings=precompress_encodings())
+			    if sandbox is not None:
+			        outcomes = sandbox.map(render, rows)
+			    elif executor is not None:
+			        chunksize = max(1, len(rows) // ((os.cpu_count() or 1) * 4))
+			        outcomes = [(True, value) for value in executor.map(render, rows, chunksize=chunksize)]
+			    else:
+			        outcomes = [(True, render(row)) for row in rows]
+			    results = []
+			    for row, (ok, value) in zip(rows, outcomes):
+			        if not ok:
+			            limits.add(value, row['language'])
+			            row = plain_row(row)
+			            value = render(row)
+			        results.append((render_key(**row), *value))
+			    return results
+
+
+		# O fallback usa a render_key do texto puro, que é o endereço do que foi de fato gerado. Assim o RenderCache e as variantes compactadas nunca misturam o fallback com a renderização completa, e o próximo save() com o mesmo conteúdo vê uma chave diferente da gravada e tenta de novo.
+
+		# O render_many() passa a usar o render_rows(); ele devolve a chave de cada item, que pode ser a do fallback:
+
+			def render_many(rows, executor=None, sandbox=None):
+			    """
+			    Render a batch of inputs, each distinct one once, spreading the
+			    cache misses across `sandbox` or `executor` (by default the shared
+			    sandbox, or the process pool when it is off). Returns [(key, html)]
+			    in the order of `rows`.
+			    """
+			    cache = get_render_cache()
+			    keys = [render_key(**row) for row in rows]
+			    rendered, missing = {}, {}
+			    for key, row in zip(keys, rows):
+			        if key in rendered or key in missing:
+			            continue
+			        html = cache.get(key)
+			        if html is None:
+			            missing[key] = row
+			        else:
+			            rendered[key] = (key, html)
+			    if missing:
+			        if sandbox is None and executor is None:
+			            sandbox = get_sandbox()
+			            executor = get_render_pool() if sandbox is None else None
+			        results = render_rows(list(missing.values()), executor=executor, sandbox=sandbox)
+			        for original, (key, html, variants) in zip(missing, results):
+			            cache.set(key, html)
+			            store_variants(key, variants)
+			            rendered[original] = (key, html)
+			    return [rendered[key] for key in keys]
+
+
+		# O sandbox e o pool de processos são coisas diferentes (o sandbox.map() devolve (ok, valor)), então cada um tem o seu parâmetro. O create_many() já grava a chave devolvida e não muda.
+
+		# O rehighlight também grava a chave devolvida, mas ele tem os processos dele (--workers), e passa a criar um sandbox próprio no lugar do ProcessPoolExecutor. Em snippets/management/commands/rehighlight.py:
+
+			from snippets.sandbox import new_sandbox
+
+
+			    def handle(self, *args, **options):
+			        ...
+			        duty = min(max(options['duty_cycle'], 0.01), 1.0)
+			        sandbox = new_sandbox(workers=options['workers'])
+			        executor = ProcessPoolExecutor(max_workers=options['workers']) if sandbox is None else None
+			        try:
+			            while True:
+			                rows = list(stale.filter(pk__gt=checkpoint['last_pk']).order_by('pk')
+			                            .values('pk', 'highlight_version', *INPUTS)[:options['batch_size']])
+			                if not rows:
+			                    break
+			                started = time.monotonic()
+			                checkpoint['rendered'] += self.rerender(rows, current, executor=executor, sandbox=sandbox)
+			                ...   # checkpoint e pausa, como antes
+			        finally:
+			            (sandbox or executor).shutdown()
+			        ...
+
+			    def rerender(self, rows, current, executor=None, sandbox=None):
+			        """
+			        Render one batch and write it back, skipping the rows that were
+			        saved again since they were read.
+			        """
+			        rendered = render_many([{name: row[name] for name in INPUTS} for row in rows],
+			                               executor=executor, sandbox=sandbox)
+			        ...   # o resto como antes
+
+
+		# Com 'TIMEOUT': None o comando continua com o ProcessPoolExecutor, sem limite nenhum.
+
+		# O render_snippet() fica assim:
+
+			def render_snippet(pk, version, executor=None):
+			    """
+			    Render one snippet version and store it, unless a newer save
+			    has superseded it in the meantime.
+			    """
+			    from snippets.models import Snippet
+
+			    row = (Snippet.objects.filter(pk=pk, highlight_version=version)
+			           .values('code', 'language', 'style', 'linenos', 'title')
+			           .first())
+			    if row is None:
+			        return
+			    encodings = precompress_encodings()
+			    cache = get_render_cache()
+			    key = render_key(**row)
+			    html = cache.get(key)
+			    variants = None
+			    if html is None:
+			        [(key, html, variants)] = render_rows([row], executor=executor, sandbox=get_sandbox())
+			        cache.set(key, html)
+			    Snippet.store_highlight(pk, version, html, key)
+			    if variants is None and encodings and django_cache.get(variant_key(key, encodings[0])) is None:
+			        variants = compress_variants(as_document(html, row['style'], row['title']), encodings)
+			    if variants:
+			        store_variants(key, variants)
+
+
+		# Com o sandbox ligado, os processos dele fazem o trabalho e a opção executor='process' do LocalQueueBackend deixa de ter efeito (as threads do backend só esperam o sandbox). 'TIMEOUT': None volta ao caminho antigo, sem limite.
+
+		# O store_highlight() do Snippet recebe a chave e grava render_key=key junto com o HTML, nos dois modos de STORAGE, no mesmo update() filtrado pelo highlight_version. Para a renderização completa ela é igual à que o save() já gravou; para o fallback é a do texto puro:
+
+			    @classmethod
+			    def store_highlight(cls, pk, version, html, key):
+			        """
+			        Store the HTML rendered for `version` under `key`, unless a newer
+			        save has superseded it. State and HTML change in one transaction.
+			        """
+			        with transaction.atomic():
+			            if highlight_storage() == 'table':
+			                current = cls.objects.filter(pk=pk, highlight_version=version).update(
+			                    render_key=key, highlight_state=cls.HIGHLIGHT_READY)
+			                if current:
+			                    SnippetHighlight.objects.update_or_create(snippet_id=pk, defaults={'html': html})
+			            else:
+			                cls.objects.filter(pk=pk, highlight_version=version).update(
+			                    highlighted=html, render_key=key, highlight_state=cls.HIGHLIGHT_READY)
+
+
+		# O render_snippet() é o único que chama o store_highlight(); o render_many() devolve as chaves e o create_many() já grava cada uma na sua linha.
+
+
+
+		# O limite de tamanho, no SnippetSerializer (em snippets/serializers.py):
+
+			from snippets.sandbox import limits, max_code_size
+
+
+			class SnippetSerializer(CompiledSerializerMixin, serializers.HyperlinkedModelSerializer):
+			    ...
+
+			    def validate(self, attrs):
+			        code = attrs.get('code', getattr(self.instance, 'code', ''))
+			        language = attrs.get('language', getattr(self.instance, 'language', 'python'))
+			        limit = max_code_size(language)
+			        if limit is not None and len(code) > limit:
+			            limits.add('size', language)
+			            raise serializers.ValidationError(
+			                {'code': 'Ensure this field has no more than %d characters for %s.' % (limit, language)})
+			        return attrs
+
+
+		# Ele fica no validate() e não no campo porque depende da linguagem; no PATCH que só troca a linguagem, o code vem do self.instance. O POST em lote (/snippets/bulk/) valida cada item com o mesmo serializer, então os itens grandes demais voltam com o erro na posição deles.
+
+		# Quem grava pelo ORM direto (shell, admin) não passa pelo serializer; para esses, o tempo máximo do sandbox continua valendo.
+
+
+
+		# Os contadores, num endpoint para administradores, ao lado do user_cache_stats (em snippets/views.py):
+
+			from snippets.sandbox import limits
+
+
+			@api_view(['GET'])
+			@permission_classes([permissions.IsAdminUser])
+			def highlight_limit_stats(request, format=None):
+			    """
+			    How often each highlighting limit fired, per language.
+			    """
+			    return Response(limits.snapshot())
+
+
+		# Em snippets/urls.py:
+
+			    path('metrics/highlight-limits/', views.highlight_limit_stats, name='highlight-limit-stats'),
+
+
+		# Como os do cache de usuários, os contadores são por processo: 'size' conta no processo que recebeu a requisição, e 'timeout', 'memory', 'crashed', 'broken' e 'error' no processo que mandou renderizar (com o LocalQueueBackend, o mesmo).
+
+		# Em tutorial/settings.py (os padrões já são esses, menos o 'text'):
+
+			SNIPPETS_HIGHLIGHT = {
+			    ...
+			    'TIMEOUT': 5.0,                      # segundos por renderização; None desliga o sandbox
+			    'MEMORY_LIMIT': 512 * 1024 * 1024,   # bytes que uma renderização pode crescer; None desliga
+			    'SANDBOX_WORKERS': None,             # um processo por núcleo
+			    'MAX_CODE_SIZE': {'default': 100000, 'text': 1000000},
+			}
+
+
+		# O MEMORY_LIMIT é de memória virtual (RLIMIT_AS) e conta a partir do tamanho do processo filho quando ele começa, não do zero: a memória virtual de um processo Django com threads já passa de algumas centenas de MB. A medida vem do /proc/self/statm; onde ele não existe (macOS) o limite fica desligado e só o tempo vale.
+
+
+		# tom
+			http -a admin:adminadmin http://127.0.0.1:8000/metrics/highlight-limits/
+
+			HTTP/1.1 200 OK
+			...
+			{
+			    "size": {
+			        "python": 3
+			    },
+			    "timeout": {
+			        "perl": 1
+			    }
+			}
+
+
+	# JSONRenderer e JSONParser com orjson/ujson
+
+		# Todo o tráfego passa por JSONRenderer().render(serializer.data) e JSONParser().parse(stream), as mesmas classes do snippet_list/snippet_detail da parte 1, e as duas usam o módulo json da biblioteca padrão.
+
+		# A ideia: duas subclasses que usam uma biblioteca de JSON mais rápida quando ela está instalada (orjson, senão ujson) e caem na implementação do DRF (super()) em todo caso que a biblioteca não reproduz igual. A saída tem que ser byte a byte a mesma do JSONRenderer: OrderedDicts, datas do created, código com unicode, \u2028 escapado.
+
+		# As duas são opcionais:
+
+			pip install orjson
+			# ou
+			pip install ujson
+
+		# Crie o arquivo snippets/fastjson.py:
+
+			import io
+			import re
+
+			from django.conf import settings
+			from rest_framework import parsers, renderers
+
+			try:
+			    import orjson
+			except ImportError:
+			    orjson = None
+
+			try:
+			    import ujson
+			except ImportError:
+			    ujson = None
+
+
+			# Input the fast parsers would read differently from json.loads():
+			# NaN/Infinity (rejected when STRICT_JSON), and integers too big for 64 bits.
+			UNSAFE_INPUT = re.compile(rb'NaN|Infinity|\d{19}')
+
+
+			def json_backend():
+			    name = getattr(settings, 'SNIPPETS_JSON', 'auto')
+			    if name == 'auto':
+			        name = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+			    if (name == 'orjson' and orjson is None) or (name == 'ujson' and ujson is None):
+			        name = 'json'
+			    return name
+
+
+			def fast_dumps(data, default):
+			    """
+			    Compact UTF-8 JSON bytes, or None when no fast library is in use.
+			    Raises TypeError/ValueError/OverflowError for what it can't encode.
+			    """
+			    backend = json_backend()
+			    if backend == 'orjson':
+			        ret = orjson.dumps(data, default=default,
+			                           option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+			    elif backend == 'ujson':
+			        ret = ujson.dumps(data, default=default, ensure_ascii=False, escape_forward_slashes=False,
+			                          encode_html_chars=False, allow_nan=False).encode('utf-8')
+			    else:
+			        return None
+			    return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+			def fast_loads(data):
+			    backend = json_backend()
+			    if backend == 'orjson':
+			        return orjson.loads(data)
+			    return ujson.loads(data)
+
+
+			class FastJSONRenderer(renderers.JSONRenderer):
+			    """
+			    JSONRenderer that encodes with orjson/ujson when installed, with
+			    byte-identical output. Indented, ASCII-only and non-compact output
+			    go through the stdlib path.
+			    """
+			    def render(self, data, accepted_media_type=None, renderer_context=None):
+			        indent = self.get_indent(accepted_media_type, renderer_context or {})
+			        if data is None or indent is not None or self.ensure_ascii or not self.compact:
+			            return super().render(data, accepted_media_type, renderer_context)
+			        try:
+			            ret = fast_dumps(data, self.encoder_class().default)
+			        except (TypeError, ValueError, OverflowError):
+			            ret = None
+			        if ret is None:
+			            return super().render(data, accepted_media_type, renderer_context)
+			        return ret
+
+
+			class FastJSONParser(parsers.JSONParser):
+			    """
+			    JSONParser that decodes with orjson/ujson when installed, falling
+			    back to the stdlib for input they would read differently.
+			    """
+			    def parse(self, stream, media_type=None, parser_context=None):
+			        parser_context = parser_context or {}
+			        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+			        if (json_backend() == 'json' or not self.strict
+			                or encoding.lower().replace('-', '') != 'utf8'):
+			            return super().parse(stream, media_type, parser_context)
+			        data = stream.read()
+			        if not UNSAFE_INPUT.search(data):
+			            try:
+			                return fast_loads(data)
+			            except ValueError:
+			                pass
+			        return super().parse(io.BytesIO(data), media_type, parser_context)
+
+
+		# Por que cada coisa:
+
+			# - o encoder do DRF (self.encoder_class().default) vira o default da biblioteca: tudo que ela não serializa sozinha passa por ele, com o mesmo resultado do json.dumps(cls=JSONEncoder)
+			# - o OPT_PASSTHROUGH_DATETIME manda datetime, date e time para esse default. Sozinho, o orjson escreveria o fuso UTC como +00:00, e o DRF troca por Z (os microssegundos saem inteiros nos dois, o DRF usa o isoformat()); um time com fuso o DRF recusa
+			# - o OPT_PASSTHROUGH_DATACLASS faz o mesmo com dataclasses, que o encoder do DRF não aceita (vira TypeError e cai no super(), que dá o mesmo erro de antes)
+			# - o orjson e o ujson (com ensure_ascii=False) escrevem unicode direto em UTF-8, como o DRF com UNICODE_JSON = True (o padrão); o replace final repete o escape de \u2028 e \u2029 que o DRF faz
+			# - inteiros maiores que 64 bits: o orjson dá erro ao escrever e cai no super(); ao ler, ele os transformaria em float sem avisar, por isso o UNSAFE_INPUT manda essas entradas para o json.loads()
+			# - NaN e Infinity: com STRICT_JSON (o padrão) o DRF recusa; o ujson aceitaria, então também vão para o caminho padrão, que dá o mesmo ParseError
+			# - NaN e Infinity na saída: o ujson (allow_nan=False) dá erro e cai no super(), mas o orjson escreve null sem avisar. Os serializers dos snippets não têm nenhum campo float, então isso não aparece aqui; numa API com FloatField que pode receber NaN, deixe essa view no JSONRenderer
+			# - qualquer erro da biblioteca rápida (UTF-8 inválido, surrogate sozinho, 1e400) também cai no super(), então a resposta de erro (ou o valor lido) é a do DRF
+
+		# O UNSAFE_INPUT pode achar NaN ou 19 dígitos dentro de uma string (no code de um snippet, por exemplo). Tudo bem: essa requisição só vai pelo caminho lento.
+
+		# A única diferença que sobra é em floats: o orjson escreve 1e16 onde o json escreve 1e+16, e um NaN vira null em vez de erro. Os payloads de snippets não têm floats; se algum serializer seu tiver, use SNIPPETS_JSON = 'json' nele (renderer_classes da view) ou teste antes.
+
+
+
+		# Para usar na API inteira, em tutorial/settings.py:
+
+			REST_FRAMEWORK = {
+			    'DEFAULT_PAGINATION_CLASS': 'snippets.pagination.CountedPageNumberPagination',
+			    'PAGE_SIZE': 10,
+			    'DEFAULT_RENDERER_CLASSES': [
+			        'snippets.fastjson.FastJSONRenderer',
+			        'rest_framework.renderers.BrowsableAPIRenderer',
+			    ],
+			    'DEFAULT_PARSER_CLASSES': [
+			        'snippets.fastjson.FastJSONParser',
+			        'rest_framework.parsers.FormParser',
+			        'rest_framework.parsers.MultiPartParser',
+			    ],
+			}
+
+			SNIPPETS_JSON = 'auto'   # 'orjson', 'ujson' ou 'json'
+
+
+		# Como herdam de JSONRenderer/JSONParser, media_type, format ('json') e charset são os mesmos, e o ?format=json continua funcionando.
+
+		# Nas views da parte 1 (snippet_list e snippet_detail) é só trocar as classes:
+
+			from snippets.fastjson import FastJSONParser as JSONParser
+
+
+			        data = JSONParser().parse(request)
+
+
+		# E no streaming (snippets/streaming.py), cada linha passa a ser codificada pela mesma função, com o JSONEncoder do DRF como default:
+
+			from rest_framework.renderers import JSONRenderer
+
+			from snippets.fastjson import fast_dumps
+
+
+			def encode_row(data, encoder):
+			    ret = None
+			    if encoder.item_separator == ',' and not encoder.ensure_ascii:
+			        try:
+			            ret = fast_dumps(data, encoder.default)
+			        except (TypeError, ValueError, OverflowError):
+			            ret = None
+			    return ret if ret is not None else JSONRenderer().render(data)
+
+
+			def stream_json_list(queryset, serializer, chunk_size=2000, buffer_size=64 * 1024):
+			    """
+			    Yield `queryset` as a JSON array, serializing one row at a time
+			    and flushing roughly every `buffer_size` bytes.
+			    """
+			    encoder = get_encoder()
+			    buffer = [b'[']
+			    size = 1
+			    separator = b''
+			    for instance in queryset.iterator(chunk_size=chunk_size):
+			        item = separator + encode_row(serializer.to_representation(instance), encoder)
+			        separator = encoder.item_separator.encode('utf-8')
+			        buffer.append(item)
+			        size += len(item)
+			        if size >= buffer_size:
+			            yield b''.join(buffer)
+			            buffer, size = [], 0
+			    buffer.append(b']')
+			    yield b''.join(buffer)
+
+
+		# O escape de \u2028 e \u2029 continua igual ao da resposta normal: o fast_dumps() faz o mesmo replace, e o fallback é o próprio JSONRenderer. Como no FastJSONRenderer, a biblioteca rápida só é usada com COMPACT_JSON e UNICODE_JSON ligados (o fast_dumps() sempre escreve compacto e em UTF-8); fora disso cada linha passa pelo JSONRenderer, e o separador entre elas vem do get_encoder().
+
+
+
+		# Um teste em snippets/tests.py, com o que aparece nos snippets (e o que não deveria mudar):
+
+			import datetime
+			import io
+			from collections import OrderedDict
+
+			from rest_framework.parsers import JSONParser
+			from rest_framework.renderers import JSONRenderer
+
+			from snippets.fastjson import FastJSONParser, FastJSONRenderer
+
+
+			class FastJSONTests(TestCase):
+			    payloads = [
+			        [OrderedDict([('id', 1), ('owner', 'tom'), ('title', 'olá / 日本語'),
+			                      ('code', 'print("\u2028 😀 </script>")\n\t\x00'), ('linenos', False),
+			                      ('created', '2026-10-18T09:10:11.123456Z'), ('highlight', None)])],
+			        {'count': 0, 'next': None, 'previous': None, 'results': []},
+			        {'created': datetime.datetime(2026, 10, 18, 9, 10, 11, 123456, tzinfo=datetime.timezone.utc),
+			         'day': datetime.date(2026, 10, 18), 'big': 2 ** 70},
+			    ]
+
+			    def test_render_is_identical(self):
+			        for data in self.payloads:
+			            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+			    def test_parse_is_identical(self):
+			        bodies = [JSONRenderer().render(data) for data in self.payloads]
+			        bodies += [b'{"n": 123456789012345678901234567890}', b'[1.5, 0.1, 1e400]', b'"\\ud800"']
+			        for body in bodies:
+			            self.assertEqual(FastJSONParser().parse(io.BytesIO(body)),
+			                             JSONParser().parse(io.BytesIO(body)))
+
+
+		# Sem orjson e sem ujson instalados o teste continua passando (as duas classes ficam iguais às do DRF); rode-o com a biblioteca instalada.
+
+
+
+		# Benchmark. Crie bench_json.py ao lado do manage.py; ele usa o make_rows() do bench_serializer.py para ter dados reais do SnippetSerializer(many=True):
+
+			import io
+			import sys
+			import time
+
+			from bench_serializer import make_rows
+
+			from django.test import override_settings  # noqa: E402
+			from rest_framework.parsers import JSONParser  # noqa: E402
+			from rest_framework.renderers import JSONRenderer  # noqa: E402
+			from rest_framework.request import Request  # noqa: E402
+			from rest_framework.test import APIRequestFactory  # noqa: E402
+
+			from snippets.fastjson import FastJSONParser, FastJSONRenderer, orjson, ujson  # noqa: E402
+			from snippets.serializers import SnippetSerializer  # noqa: E402
+
+
+			def best_of(function, repeat=5):
+			    best = None
+			    for _ in range(repeat):
+			        start = time.perf_counter()
+			        function()
+			        elapsed = time.perf_counter() - start
+			        best = elapsed if best is None else min(best, elapsed)
+			    return best
+
+
+			def main(count):
+			    rows = make_rows(count)
+			    context = {'request': Request(APIRequestFactory().get('/snippets/'))}
+			    data = SnippetSerializer(rows, many=True, context=context).data
+			    expected = JSONRenderer().render(data)
+			    size = len(expected) / 1024 / 1024
+			    cases = [('json (DRF)', 'json', JSONRenderer, JSONParser)]
+			    cases += [(name, name, FastJSONRenderer, FastJSONParser)
+			              for name, module in (('orjson', orjson), ('ujson', ujson)) if module is not None]
+			    for label, backend, renderer_class, parser_class in cases:
+			        with override_settings(SNIPPETS_JSON=backend):
+			            assert renderer_class().render(data) == expected
+			            render = best_of(lambda: renderer_class().render(data))
+			            parse = best_of(lambda: parser_class().parse(io.BytesIO(expected)))
+			        print('%-12s render %7.1f MB/s   parse %7.1f MB/s' % (label, size / render, size / parse))
+
+
+			if __name__ == '__main__':
+			    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+
+
+		# tom
+			pip install orjson ujson
+			python bench_json.py 10000
+			    # json (DRF)   render    27.6 MB/s   parse    45.2 MB/s
+			    # orjson       render   138.0 MB/s   parse   106.4 MB/s
+			    # ujson        render    53.1 MB/s   parse    72.3 MB/s
+
+
+	# Busca por texto em title e code (?q=)
+
+		# Não há busca em /snippets/, então quem procura alguma coisa pagina o SnippetViewSet.list inteiro e filtra do lado do cliente. E não dá para resolver com um filter(code__icontains=...): além de varrer a tabela, o code agora é um CompressedTextField (bytes compactados), onde o banco não enxerga o texto.
+
+		# A busca usa um índice próprio, atualizado a cada save()/delete():
+
+			# - no SQLite, uma tabela virtual FTS5 (snippets_search), com ranking bm25
+			# - nos outros bancos, um índice invertido numa tabela comum (SearchPosting: termo, snippet, peso), com ranking tf-idf
+
+		# Os dois guardam termos que nós mesmos extraímos em Python, e a extração leva em conta a language do snippet:
+
+			# - cada identificador entra inteiro (getUserName, list_users) e também em partes (get, user, name / list, users), para achar tanto pelo nome exato quanto por uma palavra dele
+			# - nas linguagens em que o hífen faz parte do nome (css, lisp, html, yaml...), font-size é um termo só; nas outras, a - b são dois
+			# - sigilos ($user, @list, %hash) ficam de fora do termo, então a busca por user acha o $user do PHP e do shell
+			# - o title é tratado como texto comum e pesa 10 vezes mais que o code
+
+		# A extração usa expressões regulares simples (tempo linear), e não os lexers do pygments: assim ela não herda o problema dos lexers patológicos da parte anterior e pode rodar na própria requisição.
+
+		# Crie o arquivo snippets/search.py:
+
+			import math
+			import re
+			from collections import Counter
+
+			from django.conf import settings
+			from django.db import connection, transaction
+			from django.db.models import Case, Count, F, FloatField, IntegerField, Sum, Value, When
+			from rest_framework.filters import BaseFilterBackend
+
+			from snippets.counts import cached_count
+
+			IDENTIFIER = re.compile(r'[^\W\d]\w*|\d+')
+			DASHED_IDENTIFIER = re.compile(r'[^\W\d][\w-]*|\d+')
+			CAMEL_CASE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+			# Languages whose names may contain a dash (font-size, string-append).
+			DASHED_LANGUAGES = {
+			    'clojure', 'common-lisp', 'css', 'emacs-lisp', 'haml', 'html', 'less', 'racket',
+			    'sass', 'scheme', 'scss', 'xml', 'xslt', 'yaml',
+			}
+
+			MIN_TERM_LENGTH = 2
+			MAX_TERM_LENGTH = 64
+
+
+			def search_settings():
+			    config = getattr(settings, 'SNIPPETS_SEARCH', {})
+			    return {'BACKEND': config.get('BACKEND', 'auto'), 'MAX_RESULTS': config.get('MAX_RESULTS', 1000)}
+
+
+			def split_identifier(identifier):
+			    parts = []
+			    for piece in re.split(r'[_-]+', identifier):
+			        parts.extend(CAMEL_CASE.findall(piece) if piece.isascii() else [piece])
+			    return parts
+
+
+			def tokenize(text, language=None):
+			    """
+			    Search terms of `text`, with repeats: every identifier whole and,
+			    when it is compound (snake_case, camelCase, dashed-name), its parts.
+			    """
+			    pattern = DASHED_IDENTIFIER if language in DASHED_LANGUAGES else IDENTIFIER
+			    terms = []
+			    for match in pattern.finditer(text):
+			        identifier = match.group().rstrip('-')
+			        terms.append(identifier.lower())
+			        parts = split_identifier(identifier)
+			        if len(parts) > 1:
+			            terms.extend(part.lower() for part in parts)
+			    return [term for term in terms if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH]
+
+
+			def query_terms(query, max_terms=8):
+			    """
+			    The distinct terms of a ?q= value; all of them must match.
+			    """
+			    terms = []
+			    for match in DASHED_IDENTIFIER.finditer(query):
+			        term = match.group().rstrip('-').lower()
+			        if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH and term not in terms:
+			            terms.append(term)
+			    return terms[:max_terms]
+
+
+			class FTS5Index:
+			    """
+			    SQLite FTS5 table snippets_search (rowid = snippet pk) holding the
+			    terms of each snippet, ranked with bm25.
+			    """
+			    def update(self, rows):
+			        rows = [(pk, ' '.join(tokenize(title)), ' '.join(tokenize(code, language)))
+			                for pk, title, code, language in rows]
+			        with connection.cursor() as cursor:
+			            cursor.executemany('DELETE FROM snippets_search WHERE rowid = %s', [(row[0],) for row in rows])
+			            cursor.executemany('INSERT INTO snippets_search (rowid, title, code) VALUES (%s, %s, %s)', rows)
+
+			    def remove(self, pks):
+			        with connection.cursor() as cursor:
+			            cursor.executemany('DELETE FROM snippets_search WHERE rowid = %s', [(pk,) for pk in pks])
+
+			    def search(self, terms, restrict=None, limit=1000):
+			        sql = 'SELECT rowid FROM snippets_search WHERE snippets_search MATCH %s'
+			        params = [' AND '.join('"%s"' % term.replace('"', '""') for term in terms)]
+			        if restrict is not None and restrict.query.where:
+			            subquery, subparams = restrict.order_by().values('pk').query.sql_with_params()
+			            sql += ' AND rowid IN (%s)' % subquery
+			            params.extend(subparams)
+			        sql += ' ORDER BY rank LIMIT %s'
+			        params.append(limit)
+			        with connection.cursor() as cursor:
+			            cursor.execute(sql, params)
+			            return [row[0] for row in cursor.fetchall()]
+
+
+			class PostingsIndex:
+			    """
+			    Inverted index in a regular table (SearchPosting), for databases
+			    without FTS5. Ranked with tf-idf.
+			    """
+			    title_weight = 10.0
+
+			    def postings(self, pk, title, code, language):
+			        from snippets.models import SearchPosting
+
+			        weights = {term: 1 + math.log(count) for term, count in Counter(tokenize(code, language)).items()}
+			        for term, count in Counter(tokenize(title)).items():
+			            weights[term] = weights.get(term, 0.0) + self.title_weight * count
+			        return [SearchPosting(term=term, snippet_id=pk, weight=weight) for term, weight in weights.items()]
+
+			    def update(self, rows):
+			        from snippets.models import SearchPosting
+
+			        rows = list(rows)
+			        SearchPosting.objects.filter(snippet_id__in=[row[0] for row in rows]).delete()
+			        SearchPosting.objects.bulk_create([posting for row in rows for posting in self.postings(*row)],
+			                                          batch_size=1000)
+
+			    def remove(self, pks):
+			        from snippets.models import SearchPosting
+
+			        SearchPosting.objects.filter(snippet_id__in=pks).delete()
+
+			    def search(self, terms, restrict=None, limit=1000):
+			        from snippets.models import SearchPosting, Snippet
+
+			        postings = SearchPosting.objects.filter(term__in=terms)
+			        frequencies = dict(postings.order_by().values_list('term').annotate(Count('snippet_id')))
+			        if len(frequencies) < len(terms):
+			            return []
+			        total, _ = cached_count(Snippet.objects.all())
+			        idf = Case(*[When(term=term, then=Value(math.log(1 + total / count)))
+			                     for term, count in frequencies.items()], output_field=FloatField())
+			        if restrict is not None and restrict.query.where:
+			            postings = postings.filter(snippet__in=restrict.order_by().values('pk'))
+			        ranked = (postings.values('snippet_id')
+			                  .annotate(matched=Count('term'), score=Sum(F('weight') * idf))
+			                  .filter(matched=len(terms))
+			                  .order_by('-score', 'snippet_id'))
+			        return [row['snippet_id'] for row in ranked[:limit]]
+
+
+			def get_search_index():
+			    backend = search_settings()['BACKEND']
+			    if backend == 'auto':
+			        backend = 'fts5' if connection.vendor == 'sqlite' else 'postings'
+			    return FTS5Index() if backend == 'fts5' else PostingsIndex()
+
+
+			def index_on_commit(rows):
+			    rows = list(rows)
+			    transaction.on_commit(lambda: get_search_index().update(rows))
+
+
+			class SnippetSearchFilter(BaseFilterBackend):
+			    """
+			    ?q= search over title and code, ordered by relevance. Only the
+			    MAX_RESULTS best matches are returned.
+			    """
+			    search_param = 'q'
+
+			    def filter_queryset(self, request, queryset, view):
+			        terms = query_terms(request.query_params.get(self.search_param, ''))
+			        if not terms:
+			            return queryset
+			        pks = get_search_index().search(terms, restrict=queryset, limit=search_settings()['MAX_RESULTS'])
+			        if not pks:
+			            return queryset.none()
+			        rank = Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(pks)],
+			                    output_field=IntegerField())
+			        return queryset.filter(pk__in=pks).order_by(rank, 'pk')
+
+
+		# Como o ranking e a paginação funcionam:
+
+			# - o índice devolve só as pks, já ordenadas pela relevância e cortadas em MAX_RESULTS (1000 por padrão): ninguém pagina além disso numa busca
+			# - no FTS5, o ORDER BY rank usa a função de ranking configurada na própria tabela (bm25 com peso 10 para title, ver a migração); o SQLite só ordena as linhas que casaram, sem olhar a tabela de snippets
+			# - no índice invertido, a consulta lê só as linhas de SearchPosting dos termos pedidos (pelo índice (term, snippet)); o idf de cada termo vem do número de snippets que o contêm, e o total de snippets vem do cached_count() das contagens
+			# - se o queryset já tem filtros (os da próxima parte, por exemplo), eles entram na busca como subconsulta (rowid IN (...) / snippet IN (...)), então o corte em MAX_RESULTS é feito depois de filtrar
+			# - a página em si é um SELECT ... WHERE id IN (até 1000 pks) ORDER BY CASE ..., paginado pela paginação normal; a contagem é um COUNT sobre esses mesmos ids
+
+		# Todos os termos precisam casar (AND). A ordem do CASE repete a ordem do ranking, e o 'pk' no fim só desempata o que o CASE já não empatou.
+
+
+
+		# O modelo do índice invertido, em snippets/models.py:
+
+			class SearchPosting(models.Model):
+			    """
+			    One search term of one snippet (PostingsIndex).
+			    """
+			    term = models.CharField(max_length=64)
+			    snippet = models.ForeignKey(Snippet, related_name='search_postings', on_delete=models.CASCADE)
+			    weight = models.FloatField()
+
+			    class Meta:
+			        constraints = [
+			            models.UniqueConstraint(fields=['term', 'snippet'], name='snippet_posting_term_unique'),
+			        ]
+
+
+		# A restrição única em (term, snippet) também é o índice que a busca usa. A tabela existe em todos os bancos (é só uma tabela); no SQLite ela fica vazia.
+
+		# Atualização incremental. No Snippet.save(), o índice é atualizado quando a render_key muda, ou seja, quando title, code ou language (ou estilo/linenos) mudaram; depois do commit, como as contagens:
+
+			from snippets.search import index_on_commit
+
+
+			        with transaction.atomic():
+			            super(Snippet, self).save(*args, **kwargs)
+			            ...
+			        transaction.on_commit(lambda: invalidate_counts(Snippet))
+			        if reindex:
+			            index_on_commit([(self.pk, self.title, self.code, self.language)])
+
+
+		# (o reindex = True fica dentro do "if key != self.render_key:".) O create_many() indexa o lote inteiro, dentro da transação dele:
+
+			            index_on_commit((snippet.pk, snippet.title, snippet.code, snippet.language) for snippet in created)
+
+
+		# E o delete, em snippets/signals.py (o queryset.delete() do DELETE em lote também passa por aqui):
+
+			from snippets.search import get_search_index
+
+
+			@receiver(post_delete, sender=Snippet)
+			def snippet_deleted(sender, instance, **kwargs):
+			    owner_id, pk = instance.owner_id, instance.pk
+			    transaction.on_commit(lambda: invalidate_users({owner_id}))
+			    transaction.on_commit(lambda: get_search_index().remove([pk]))
+
+
+		# No índice invertido o CASCADE já apagou as linhas; o remove() só faz diferença no FTS5, que não tem chave estrangeira.
+
+		# O rehighlight não muda title nem code, então não mexe no índice.
+
+
+
+		# Migrações. Primeiro a do SearchPosting:
+
+			python manage.py makemigrations snippets
+
+
+		# Depois uma vazia para a tabela FTS5:
+
+			python manage.py makemigrations snippets --empty --name search_fts5
+
+
+		# E nela:
+
+			from django.db import migrations
+
+
+			def create_fts5(apps, schema_editor):
+			    if schema_editor.connection.vendor != 'sqlite':
+			        return
+			    schema_editor.execute(
+			        "CREATE VIRTUAL TABLE snippets_search USING fts5("
+			        "title, code, tokenize = \"unicode61 remove_diacritics 2 tokenchars '-_'\")")
+			    schema_editor.execute(
+			        "INSERT INTO snippets_search (snippets_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+
+			def drop_fts5(apps, schema_editor):
+			    if schema_editor.connection.vendor == 'sqlite':
+			        schema_editor.execute('DROP TABLE snippets_search')
+
+
+			class Migration(migrations.Migration):
+
+			    dependencies = [
+			        ('snippets', '0010_searchposting'),
+			    ]
+
+			    operations = [
+			        migrations.RunPython(create_fts5, drop_fts5),
+			    ]
+
+
+		# (o número na dependência é o da migração gerada logo antes.) O tokenchars '-_' faz o FTS5 manter font-size e list_users inteiros, do mesmo jeito que o tokenize() gerou; o remove_diacritics faz uma busca por "acao" achar "ação".
+
+		# Para indexar o que já está na base, um comando. Crie snippets/management/commands/rebuild_search_index.py:
+
+			from django.core.management.base import BaseCommand
+			from django.db import transaction
+
+			from snippets.models import Snippet
+			from snippets.search import get_search_index
+
+
+			class Command(BaseCommand):
+			    help = 'Index every snippet for ?q= search.'
+
+			    def add_arguments(self, parser):
+			        parser.add_argument('--batch-size', type=int, default=1000)
+
+			    def handle(self, *args, **options):
+			        index = get_search_index()
+			        last_pk = indexed = 0
+			        while True:
+			            rows = list(Snippet.objects.filter(pk__gt=last_pk).order_by('pk')
+			                        .values_list('pk', 'title', 'code', 'language')[:options['batch_size']])
+			            if not rows:
+			                break
+			            with transaction.atomic():
+			                index.update(rows)
+			            last_pk = rows[-1][0]
+			            indexed += len(rows)
+			        self.stdout.write(self.style.SUCCESS('Indexed %d snippets' % indexed))
+
+
+			python manage.py migrate
+			python manage.py rebuild_search_index
+
+
+
+		# Na view, em snippets/views.py:
+
+			from snippets.pagination import CountedPageNumberPagination
+			from snippets.search import SnippetSearchFilter
+
+
+			class SnippetViewSet(ConditionalGetMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+			    filter_backends = [SnippetSearchFilter]
+
+			    @property
+			    def paginator(self):
+			        if not hasattr(self, '_paginator') and self.request is not None and self.request.query_params.get('q'):
+			            self._paginator = CountedPageNumberPagination()
+			        return super().paginator
+
+
+		# O override do paginator é para quem ligou a paginação por chave: o cursor dela é o created, e uma busca é ordenada por relevância. Com ?q= a view usa sempre a paginação por número de página.
+
+		# O ETag da lista não muda: ele já usa a url completa (com o ?q=) e a geração das contagens, que muda a cada save()/delete().
+
+		# Em tutorial/settings.py (os padrões já são esses):
+
+			SNIPPETS_SEARCH = {
+			    'BACKEND': 'auto',       # 'fts5' (só SQLite) ou 'postings'
+			    'MAX_RESULTS': 1000,
+			}
+
+
+
+		# Testes em snippets/tests.py, nos dois índices:
+
+			from django.test import override_settings
+
+			from snippets.search import get_search_index
+
+
+			class SearchTests(TestCase):
+			    def setUp(self):
+			        owner = User.objects.create(username='tom')
+			        self.title_match = Snippet.objects.create(owner=owner, title='user list', code='pass\n')
+			        self.code_match = Snippet.objects.create(owner=owner, code='def getUser():\n    return user\n')
+			        Snippet.objects.create(owner=owner, code='print(1)\n')
+			        # O TestCase não roda os on_commit, então indexamos aqui.
+			        get_search_index().update(Snippet.objects.values_list('pk', 'title', 'code', 'language'))
+
+			    def search(self, query):
+			        response = self.client.get('/snippets/', {'q': query})
+			        self.assertEqual(response.status_code, 200)
+			        return [item['id'] for item in response.data['results']]
+
+			    def test_results_are_ranked(self):
+			        self.assertEqual(self.search('user'), [self.title_match.pk, self.code_match.pk])
+
+			    def test_identifiers_match_whole_and_by_part(self):
+			        self.assertEqual(self.search('getUser'), [self.code_match.pk])
+			        self.assertEqual(self.search('get'), [self.code_match.pk])
+			        self.assertEqual(self.search('get nothing'), [])
+
+			    def test_removed_snippets_are_not_found(self):
+			        get_search_index().remove([self.code_match.pk])
+			        self.assertEqual(self.search('getuser'), [])
+
+
+			@override_settings(SNIPPETS_SEARCH={'BACKEND': 'postings'})
+			class PostingsSearchTests(SearchTests):
+			    pass
+
+
+		# tom
+			http http://127.0.0.1:8000/snippets/?q=getUser
+			http http://127.0.0.1:8000/snippets/?q=font-size&page=2
+
+
+	# Filtros indexados por language, style, owner, linenos e intervalo de created
+
+		# "Todos os snippets python do usuário X desta semana" hoje é: baixar a lista inteira do SnippetViewSet e filtrar no cliente. A lista passa a aceitar:
+
+			# ?language=python
+			# ?style=monokai
+			# ?owner=tom                  (o username, como aparece no campo owner)
+			# ?linenos=true
+			# ?created__gte=2026-10-12&created__lte=2026-10-18
+
+		# Os filtros se combinam entre si, com a busca (?q=) e com a paginação. Cada combinação comum tem um índice composto que termina em (created, id), a ordenação da lista; assim o banco acha as linhas da página pelo índice, já na ordem, sem ordenar nada, e o COUNT da paginação é respondido só pelo índice.
+
+		# Não usamos o django-filter: são cinco parâmetros, e assim o SQL gerado (e os índices que ele usa) fica na nossa mão. Crie o arquivo snippets/filters.py:
+
+			from datetime import datetime, time, timedelta
+
+			from django.conf import settings
+			from django.contrib.auth.models import User
+			from django.utils import timezone
+			from django.utils.dateparse import parse_date, parse_datetime
+			from rest_framework import serializers
+			from rest_framework.exceptions import ValidationError
+			from rest_framework.filters import BaseFilterBackend
+
+			from snippets.choices import LANGUAGE_INDEX, STYLE_INDEX
+
+
+			def created_bound(value, upper):
+			    """
+			    (lookup, datetime) for a created__gte/created__lte value, or None if
+			    it is not a date or a datetime. A date as upper bound includes that
+			    whole day.
+			    """
+			    try:
+			        moment = parse_datetime(value)
+			        day = parse_date(value) if moment is None else None
+			    except ValueError:
+			        return None
+			    if moment is not None:
+			        lookup = 'created__lte' if upper else 'created__gte'
+			    elif day is not None:
+			        lookup = 'created__lt' if upper else 'created__gte'
+			        moment = datetime.combine(day + timedelta(days=1) if upper else day, time.min)
+			    else:
+			        return None
+			    if settings.USE_TZ and timezone.is_naive(moment):
+			        moment = timezone.make_aware(moment)
+			    return lookup, moment
+
+
+			class SnippetFieldFilter(BaseFilterBackend):
+			    """
+			    Exact filters on language, style, owner (username) and linenos, and
+			    created__gte / created__lte ranges.
+			    """
+			    def filter_queryset(self, request, queryset, view):
+			        params = request.query_params
+			        filters, errors = {}, {}
+			        for name, index in (('language', LANGUAGE_INDEX), ('style', STYLE_INDEX)):
+			            if name in params:
+			                if params[name] in index:
+			                    filters[name] = params[name]
+			                else:
+			                    errors[name] = ['"%s" is not a valid choice.' % params[name]]
+			        if 'linenos' in params:
+			            if params['linenos'] in serializers.BooleanField.TRUE_VALUES:
+			                filters['linenos'] = True
+			            elif params['linenos'] in serializers.BooleanField.FALSE_VALUES:
+			                filters['linenos'] = False
+			            else:
+			                errors['linenos'] = ['Must be a valid boolean.']
+			        for name, upper in (('created__gte', False), ('created__lte', True)):
+			            if name in params:
+			                bound = created_bound(params[name], upper)
+			                if bound is None:
+			                    errors[name] = ['Enter a valid date or datetime.']
+			                else:
+			                    filters[bound[0]] = bound[1]
+			        if errors:
+			            raise ValidationError(errors)
+			        if 'owner' in params:
+			            owner_id = User.objects.filter(username=params['owner']).values_list('pk', flat=True).first()
+			            if owner_id is None:
+			                return queryset.none()
+			            filters['owner_id'] = owner_id
+			        return queryset.filter(**filters)
+
+
+		# Alguns detalhes:
+
+			# - o owner vira owner_id com uma consulta pelo username (que é único e indexado) antes da consulta principal. Com owner__username o Django faria um JOIN com auth_user, e o plano dependeria do otimizador escolher começar pelo usuário
+			# - um valor inválido dá 400 com o erro no campo, como um serializer; um owner que não existe dá uma lista vazia
+			# - created__lte com uma data (2026-10-18) inclui o dia inteiro: vira created < 2026-10-19 00:00. Usar created__date seria mais curto, mas aplicaria uma função na coluna e o índice deixaria de servir
+			# - datas sem fuso são interpretadas no TIME_ZONE do settings, como o Django faz nos formulários
+
+		# Na view, antes da busca, para que a busca receba o queryset já filtrado:
+
+			from snippets.filters import SnippetFieldFilter
+
+
+			class SnippetViewSet(ConditionalGetMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+			    filter_backends = [SnippetFieldFilter, SnippetSearchFilter]
+
+
+		# O ETag da lista já inclui a url completa, então cada combinação de filtros tem o seu.
+
+
+
+		# Os índices, na classe Meta do Snippet (em snippets/models.py):
+
+			class Snippet(models.Model):
+			    ...
+			    owner = models.ForeignKey('auth.User', related_name='snippets', on_delete=models.CASCADE, db_index=False)
+
+			    class Meta:
+			        ordering = ['created']
+			        indexes = [
+			            models.Index(fields=['created', 'id'], name='snippet_created_id_idx'),
+			            models.Index(fields=['style', 'render_version'], name='snippet_style_version_idx'),
+			            models.Index(fields=['language', 'created', 'id'], name='snippet_lang_created_idx'),
+			            models.Index(fields=['style', 'created', 'id'], name='snippet_style_created_idx'),
+			            models.Index(fields=['owner', 'created', 'id'], name='snippet_owner_created_idx'),
+			            models.Index(fields=['owner', 'language', 'created', 'id'], name='snippet_owner_lang_created_idx'),
+			        ]
+
+
+		# Qual índice atende o quê (SQLite, conferido com EXPLAIN QUERY PLAN):
+
+			# - language (e language + created)                -> snippet_lang_created_idx
+			# - style (e style + created)                      -> snippet_style_created_idx
+			# - owner (e owner + created)                      -> snippet_owner_created_idx
+			# - owner + language (+ created), o caso "python do X nesta semana" -> snippet_owner_lang_created_idx, com as duas igualdades e o intervalo dentro do índice
+			# - só created                                     -> snippet_created_id_idx (que já existia)
+			# - os outros pares (owner + style, language + style...) usam o índice do primeiro campo e filtram o resto nas linhas que ele devolve, ainda na ordem do created
+
+		# O linenos não tem índice próprio: é um booleano, perto de metade das linhas de cada lado. Sozinho, ele percorre o snippet_created_id_idx já na ordem e para quando a página enche; junto com outro filtro, é conferido nas linhas que o índice do outro devolve. O COUNT de ?linenos=true sozinho é o único que varre a tabela, e é para isso que as estratégias de contagem (estimate/cached) existem.
+
+		# O índice automático da chave estrangeira (só owner_id) sai, com o db_index=False: o snippet_owner_created_idx começa por owner_id e atende as mesmas consultas, inclusive o CASCADE quando um usuário é apagado. Cada índice a mais custa em todo INSERT e UPDATE, então não vale manter os dois.
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+		# No PostgreSQL, com milhões de linhas, um CREATE INDEX comum trava as escritas na tabela enquanto roda. Troque, na migração gerada, AddIndex por AddIndexConcurrently (de django.contrib.postgres.operations) e marque a migração com atomic = False.
+
+
+
+		# Testes em snippets/tests.py. O de plano de consulta roda no SQLite (o banco dos testes do tutorial); num banco com estatísticas, como o PostgreSQL, o plano de uma tabela quase vazia seria um seq scan de qualquer jeito:
+
+			from unittest import skipUnless
+
+			from rest_framework.request import Request
+			from rest_framework.test import APIRequestFactory
+
+			from snippets.filters import SnippetFieldFilter
+
+
+			@skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+			class FilterQueryPlanTests(TestCase):
+			    cases = [
+			        ({'language': 'python'}, 'snippet_lang_created_idx'),
+			        ({'style': 'monokai'}, 'snippet_style_created_idx'),
+			        ({'owner': 'tom'}, 'snippet_owner_created_idx'),
+			        ({'owner': 'tom', 'language': 'python', 'created__gte': '2026-10-12',
+			          'created__lte': '2026-10-18'}, 'snippet_owner_lang_created_idx'),
+			        ({'language': 'python', 'linenos': 'true'}, 'snippet_lang_created_idx'),
+			        ({'created__gte': '2026-10-12T00:00:00Z'}, 'snippet_created_id_idx'),
+			    ]
+
+			    def setUp(self):
+			        User.objects.create(username='tom')
+
+			    def filtered(self, params):
+			        request = Request(APIRequestFactory().get('/snippets/', params))
+			        return SnippetFieldFilter().filter_queryset(request, Snippet.objects.all(), None)
+
+			    def test_filtered_pages_use_composite_indexes(self):
+			        for params, index in self.cases:
+			            with self.subTest(params=params):
+			                plan = self.filtered(params)[:10].explain()
+			                self.assertIn('USING INDEX %s' % index, plan)
+			                self.assertNotIn('TEMP B-TREE', plan)
+
+			    def test_filtered_counts_use_only_the_index(self):
+			        queryset = self.filtered({'owner': 'tom', 'language': 'python', 'created__gte': '2026-10-12'})
+			        plan = queryset.order_by().values('pk').explain()
+			        self.assertIn('USING COVERING INDEX snippet_owner_lang_created_idx', plan)
+
+
+			class FilterTests(TestCase):
+			    def setUp(self):
+			        tom = User.objects.create(username='tom')
+			        ana = User.objects.create(username='ana')
+			        self.python = Snippet.objects.create(owner=tom, code='print(1)\n', language='python')
+			        Snippet.objects.create(owner=tom, code='x', language='js')
+			        Snippet.objects.create(owner=ana, code='print(2)\n', language='python')
+
+			    def ids(self, params):
+			        response = self.client.get('/snippets/', params)
+			        self.assertEqual(response.status_code, 200)
+			        return [item['id'] for item in response.data['results']]
+
+			    def test_filters_combine(self):
+			        today = timezone.localdate().isoformat()
+			        self.assertEqual(self.ids({'owner': 'tom', 'language': 'python', 'created__lte': today}),
+			                         [self.python.pk])
+			        self.assertEqual(self.ids({'owner': 'nobody'}), [])
+
+			    def test_invalid_values_are_rejected(self):
+			        response = self.client.get('/snippets/', {'language': 'klingon', 'created__gte': 'ontem'})
+			        self.assertEqual(response.status_code, 400)
+			        self.assertEqual(set(response.data), {'language', 'created__gte'})
+
+
+		# O COUNT(*) não tem explain() no ORM; o values('pk') lê as mesmas colunas que ele (no SQLite todo índice já carrega o rowid), então o plano é o mesmo.
+
+		# (o FilterTests precisa de from django.utils import timezone no topo.)
+
+
+		# tom
+			http "http://127.0.0.1:8000/snippets/?owner=tom&language=python&created__gte=2026-10-12"
+
+
+	# Deduplicação de code e do HTML renderizado
+
+		# Boa parte dos code na base são idênticos byte a byte (exemplos copiados, o mesmo arquivo postado por vários usuários). Cada cópia é guardada, renderizada e indexada de novo.
+
+		# Duas opções novas, independentes:
+
+			# - SNIPPETS_DEDUP = True: o code vai para uma tabela CodeBlob endereçada pelo sha256 do conteúdo, e o Snippet guarda só a referência (code_blob). Cada corpo distinto é guardado uma vez
+			# - STORAGE = 'blob' (ao lado de 'column' e 'table'): o HTML renderizado vai para uma tabela RenderBlob endereçada pela render_key, que já é o hash de tudo o que a renderização vê (code, language, style, linenos, title, versão do renderizador). Cada variante distinta é renderizada e guardada uma vez
+
+		# As duas tabelas têm contagem de referências (refcount): cada snippet que aponta para um blob conta 1; quando o último é apagado (ou muda de conteúdo), o blob é apagado junto, na mesma transação.
+
+		# O SnippetSerializer não muda: o campo code continua sendo snippet.code. Quem resolve isso é o próprio campo do modelo, que sabe buscar o texto no blob.
+
+		# Crie o arquivo snippets/blobs.py:
+
+			import hashlib
+			from collections import Counter
+
+			from django.conf import settings
+			from django.db import IntegrityError, models, transaction
+			from django.db.models import F
+			from django.db.models.query_utils import DeferredAttribute
+
+			from snippets.compression import CompressedTextField
+
+
+			def dedup_enabled():
+			    return getattr(settings, 'SNIPPETS_DEDUP', False)
+
+
+			def code_digest(code):
+			    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+			def acquire(model, key, count=1, **defaults):
+			    """
+			    Add `count` references to the blob `key`, creating it from
+			    `defaults` if it doesn't exist yet.
+			    """
+			    with transaction.atomic():
+			        if model.objects.filter(pk=key).update(refcount=F('refcount') + count):
+			            return
+			        try:
+			            with transaction.atomic():
+			                model.objects.create(pk=key, refcount=count, **defaults)
+			        except IntegrityError:
+			            model.objects.filter(pk=key).update(refcount=F('refcount') + count)
+
+
+			def release(model, key, count=1):
+			    """
+			    Drop `count` references to the blob `key`, deleting it when none
+			    are left.
+			    """
+			    if key is None:
+			        return
+			    with transaction.atomic():
+			        model.objects.filter(pk=key).update(refcount=F('refcount') - count)
+			        model.objects.filter(pk=key, refcount__lte=0).delete()
+
+
+			def acquire_many(model, keys, contents):
+			    """
+			    acquire() for a batch: one or two queries per distinct key.
+			    `contents` maps each new key to the defaults of its blob; keys
+			    left out must already exist (and be locked by the caller).
+			    """
+			    for key, count in Counter(key for key in keys if key is not None).items():
+			        acquire(model, key, count, **contents.get(key, {}))
+
+
+			def release_many(model, keys):
+			    for key, count in Counter(key for key in keys if key is not None).items():
+			        release(model, key, count)
+
+
+			class BlobTextDescriptor(DeferredAttribute):
+			    """
+			    Read the text from the row, or from the blob when the row only
+			    holds a reference to it.
+			    """
+			    def __get__(self, instance, cls=None):
+			        if instance is None:
+			            return self
+			        value = super().__get__(instance, cls)
+			        field = self.field
+			        if not value and getattr(instance, field.blob_field + '_id') is not None:
+			            return getattr(getattr(instance, field.blob_field), field.blob_attr)
+			        return value
+
+			    def __set__(self, instance, value):
+			        instance.__dict__[self.field.attname] = value
+
+
+			class BlobTextField(CompressedTextField):
+			    """
+			    CompressedTextField whose text may live in a blob row instead
+			    (`blob_field`, a ForeignKey on the same model). The column is left
+			    empty while the reference is set.
+			    """
+			    descriptor_class = BlobTextDescriptor
+
+			    def __init__(self, *args, blob_field, blob_attr, **kwargs):
+			        self.blob_field = blob_field
+			        self.blob_attr = blob_attr
+			        super().__init__(*args, **kwargs)
+
+			    def deconstruct(self):
+			        name, path, args, kwargs = super().deconstruct()
+			        kwargs['blob_field'] = self.blob_field
+			        kwargs['blob_attr'] = self.blob_attr
+			        return name, path, args, kwargs
+
+			    def pre_save(self, model_instance, add):
+			        if getattr(model_instance, self.blob_field + '_id') is not None:
+			            return ''
+			        return model_instance.__dict__.get(self.attname)
+
+
+		# O descriptor é o que deixa o resto do código (e o serializer) sem mudança. O DeferredAttribute padrão do Django é um descriptor "não de dados": depois que o valor está no __dict__ da instância ele nem é chamado. Com o __set__, ele passa a ser chamado em toda leitura e pode decidir entre a coluna e o blob. O pre_save() faz o caminho inverso na escrita: com a referência preenchida, a coluna é gravada vazia. Ele vale também para o bulk_create.
+
+		# No __dict__ fica sempre o valor "cru" (o texto que foi atribuído, ou a coluna como veio do banco), e é ele que o save() olha para saber se o code mudou.
+
+		# O acquire() tenta primeiro o UPDATE, e só manda o conteúdo (que pode ser grande) quando o blob ainda não existe. A ordem também resolve a corrida com um release() ao mesmo tempo: se o DELETE do blob (refcount 0) passar antes, o UPDATE não acha a linha e o blob é criado de novo; se o UPDATE passar antes, o refcount já não é 0 e o DELETE não apaga nada. Dois acquire() criando o mesmo blob: um deles leva IntegrityError dentro do savepoint e cai no UPDATE.
+
+
+
+		# Os modelos, em snippets/models.py:
+
+			from snippets.blobs import (BlobTextField, acquire, acquire_many, code_digest, dedup_enabled,
+			                           release, release_many)
+
+
+			class CodeBlob(models.Model):
+			    """
+			    A distinct code body, shared by every snippet whose code is
+			    byte-identical (SNIPPETS_DEDUP).
+			    """
+			    digest = models.CharField(max_length=64, primary_key=True)
+			    code = CompressedTextField()
+			    refcount = models.PositiveIntegerField(default=0)
+
+
+			class RenderBlob(models.Model):
+			    """
+			    Rendered HTML shared by every snippet with the same render_key
+			    (STORAGE = 'blob').
+			    """
+			    key = models.CharField(max_length=64, primary_key=True)
+			    html = CompressedTextField()
+			    refcount = models.PositiveIntegerField(default=0)
+
+
+			class Snippet(models.Model):
+			    ...
+			    code = BlobTextField(blank=True, blob_field='code_blob', blob_attr='code')
+			    code_blob = models.ForeignKey(CodeBlob, null=True, blank=True, related_name='+',
+			                                  on_delete=models.PROTECT)
+			    highlight_blob = models.ForeignKey(RenderBlob, null=True, blank=True, related_name='+',
+			                                       on_delete=models.PROTECT)
+
+
+		# O PROTECT é a rede de segurança: se a contagem errar para baixo, apagar um blob ainda referenciado dá erro em vez de deixar snippets sem code. Os dois índices das chaves estrangeiras ficam (é por eles que o Django confere o PROTECT).
+
+		# O blank=True no code é só para o modelo; na API o code continua obrigatório, porque o SnippetSerializer declara o campo.
+
+		# O CodeBlob é referenciado só quando o code não é vazio; um code vazio fica na própria linha.
+
+		# No Snippet, a troca de referências do code, chamada pelo save() dentro da transação dele:
+
+			    def store_code(self):
+			        """
+			        Point the row at the CodeBlob of its code (SNIPPETS_DEDUP), moving
+			        the reference when the code changed. The old blob is released by
+			        release_blobs(), once the row no longer points at it.
+			        """
+			        code = self.__dict__.get('code')
+			        if not code:
+			            return
+			        digest = code_digest(code) if dedup_enabled() else None
+			        if digest != self.code_blob_id:
+			            if digest is not None:
+			                acquire(CodeBlob, digest, code=code)
+			            self.code_blob_id = digest
+
+			    def release_blobs(self, code_blob_id, highlight_blob_id):
+			        """
+			        Release the blobs the row held before this save, if it has moved
+			        off them.
+			        """
+			        if code_blob_id != self.code_blob_id:
+			            release(CodeBlob, code_blob_id)
+			        if highlight_blob_id != self.highlight_blob_id:
+			            release(RenderBlob, highlight_blob_id)
+
+
+		# code vazio no __dict__ quer dizer "não foi mexido" (a linha veio do banco com a coluna vazia, ou o code foi adiado), e aí a referência fica como está. Se o DEDUP for desligado depois, um snippet editado solta o blob e volta a guardar o code na linha.
+
+		# A ordem importa: o blob antigo só é solto depois que a linha foi gravada apontando para o novo. Quando a contagem chega a 0, o release() apaga o blob, e o Collector do Django acharia a linha ainda apontando para ele pelo PROTECT e levantaria ProtectedError. Por isso o store_code() só adquire, e o save() chama o release_blobs() depois do super().save(), na mesma transação (como o store_highlight() faz com o HTML).
+
+		# E a parte do HTML, no modo 'blob':
+
+			    def store_highlight_blob(self, key):
+			        """
+			        Reference the RenderBlob `key` if it already exists; returns
+			        whether it did. The old blob is released by release_blobs().
+			        """
+			        if not RenderBlob.objects.filter(pk=key).update(refcount=F('refcount') + 1):
+			            return False
+			        self.highlight_blob_id = key
+			        return True
+
+
+		# O RenderBlob serve também de cache de renderização durável: se outro snippet já tem aquela render_key, o save() não renderiza nada, e nem precisa ler o HTML, só somar 1 na contagem. O save() fica assim (só as partes que mudam):
+
+			    def save(self, *args, **kwargs):
+			        update_fields = kwargs.get('update_fields')
+			        if update_fields is not None and RENDER_INPUTS.intersection(update_fields):
+			            kwargs['update_fields'] = RENDER_FIELDS.union(update_fields)
+			        if update_fields is not None and 'code' in update_fields:
+			            kwargs['update_fields'] = {'code_blob', *kwargs['update_fields']}
+			        key = render_key(**self.render_inputs())
+			        ...
+			        with transaction.atomic():
+			            held = self.code_blob_id, self.highlight_blob_id
+			            self.store_code()
+			            if key != self.render_key:
+			                ...
+			                if highlight_storage() == 'blob':
+			                    ready = self.store_highlight_blob(key)
+			                    self.highlight_state = self.HIGHLIGHT_READY if ready else self.HIGHLIGHT_PENDING
+			                    queue = not ready
+			                else:
+			                    ...   # RenderCache, como antes
+			            super(Snippet, self).save(*args, **kwargs)
+			            self.release_blobs(*held)
+			            ...
+
+
+		# (o bloco que decide o render_key passa para dentro do atomic(), junto com as trocas de referência.)
+
+		# As duas referências também entram no save(update_fields=[...]), senão a linha ficaria apontando para o blob que o release_blobs() acabou de soltar: o code_blob quando a lista tem o code, e o highlight_blob junto com os outros campos do highlight:
+
+			RENDER_FIELDS = {'render_key', 'render_version', 'highlight_version', 'highlight_state', 'highlighted',
+			                 'highlight_blob'}
+
+
+		# O store_highlight() ganha o ramo 'blob'. A linha é travada para ler qual blob ela segurava, e a troca acontece só se a versão ainda é a mesma:
+
+			            elif highlight_storage() == 'blob':
+			                row = (cls.objects.select_for_update().filter(pk=pk, highlight_version=version)
+			                       .values_list('highlight_blob_id').first())
+			                if row is not None:
+			                    acquire(RenderBlob, key, html=html)
+			                    cls.objects.filter(pk=pk).update(highlight_blob_id=key, render_key=key,
+			                                                     highlight_state=cls.HIGHLIGHT_READY)
+			                    release(RenderBlob, row[0])
+
+
+		# E o highlight_html():
+
+			        if highlight_storage() == 'blob':
+			            html = (RenderBlob.objects.filter(pk=self.highlight_blob_id)
+			                    .values_list('html', flat=True).first()) or ''
+
+
+		# O delete solta as duas referências, no post_delete (em snippets/signals.py). Ele roda dentro da transação do delete, e não no on_commit: a contagem tem que andar junto com a linha apagada:
+
+			from snippets.blobs import release
+			from snippets.models import CodeBlob, RenderBlob
+
+
+			@receiver(post_delete, sender=Snippet)
+			def snippet_deleted(sender, instance, **kwargs):
+			    release(CodeBlob, instance.code_blob_id)
+			    release(RenderBlob, instance.highlight_blob_id)
+			    owner_id, pk = instance.owner_id, instance.pk
+			    transaction.on_commit(lambda: invalidate_users({owner_id}))
+			    transaction.on_commit(lambda: get_search_index().remove([pk]))
+
+
+		# O queryset.delete() do DELETE em lote carrega as instâncias para mandar o post_delete, então cada linha solta as suas referências.
+
+
+
+		# O create_many(), como sempre, repete o save(). Aqui está a maior parte do ganho: os blobs são tratados por conteúdo distinto, não por linha, e só as render_keys que ainda não têm RenderBlob vão para o render_many():
+
+			    def create_many(self, items, batch_size=500, **extra):
+			        snippets = [self.model(**item, **extra) for item in items]
+			        inputs = [snippet.render_inputs() for snippet in snippets]
+			        with transaction.atomic(using=self.db):
+			            if dedup_enabled():
+			                codes = {}
+			                for snippet in snippets:
+			                    if snippet.code:
+			                        snippet.code_blob_id = code_digest(snippet.code)
+			                        codes[snippet.code_blob_id] = {'code': snippet.code}
+			                acquire_many(CodeBlob, [snippet.code_blob_id for snippet in snippets], codes)
+			            if highlight_storage() == 'blob':
+			                keys = [render_key(**row) for row in inputs]
+			                stored = set(RenderBlob.objects.select_for_update().filter(pk__in=set(keys))
+			                             .values_list('pk', flat=True))
+			                missing = [i for i, key in enumerate(keys) if key not in stored]
+			                contents = {}
+			                for i, (key, html) in zip(missing, render_many([inputs[i] for i in missing])):
+			                    keys[i] = key
+			                    contents[key] = {'html': html}
+			                acquire_many(RenderBlob, keys, contents)
+			                for snippet, key in zip(snippets, keys):
+			                    snippet.render_key = snippet.highlight_blob_id = key
+			                    snippet.render_version = renderer_fingerprint(snippet.style)
+			                    snippet.highlight_state = self.model.HIGHLIGHT_READY
+			                    snippet.highlight_version = 1
+			            else:
+			                ...   # render_many() de todas as entradas, como antes
+			            created = self.bulk_create(snippets, batch_size=batch_size)
+			            ...
+
+
+		# O keys[i] = key troca a chave quando o render_many() devolveu um fallback de texto puro (parte dos limites): o blob fica com a chave do que foi de fato gerado. Uma chave que aparece várias vezes no lote entra no contents uma vez só, e o acquire_many() soma todas as referências dela de uma vez. As chaves que já tinham RenderBlob não entram no contents: para elas o acquire() só faz o UPDATE do refcount. O select_for_update() no stored trava esses blobs até o fim da transação, assim um release() de outro processo não consegue apagar um deles entre a consulta e o acquire_many() (o que deixaria um blob sem HTML para criar).
+
+
+
+		# Leituras com values(). O values('code') devolve a coluna, que fica vazia nas linhas com blob. Quem lê o code assim (render_snippet, rehighlight, rebuild_search_index) passa a usar um Coalesce, que pega o texto do blob quando existe:
+
+			from django.db.models.functions import Coalesce
+
+
+			def code_rows(queryset, *fields):
+			    """
+			    values(*fields) rows plus 'code', read from the CodeBlob when the
+			    row references one.
+			    """
+			    for row in queryset.values(*fields, code_text=Coalesce('code_blob__code', 'code')):
+			        row['code'] = row.pop('code_text')
+			        yield row
+
+
+		# (o nome code_text é porque o values() não aceita uma anotação com o nome de um campo.) O Coalesce tem o output_field do CompressedTextField, então o from_db_value descompacta normalmente. No render_snippet():
+
+			    row = next(code_rows(Snippet.objects.filter(pk=pk, highlight_version=version),
+			                         'language', 'style', 'linenos', 'title'), None)
+
+
+		# No rehighlight, a leitura do lote passa a ser rows = list(code_rows(stale.filter(pk__gt=checkpoint['last_pk']).order_by('pk')[:options['batch_size']], 'pk', 'highlight_version', 'highlight_blob_id', *INPUTS[1:])), e o rerender() ganha o ramo 'blob', que troca as referências do lote inteiro de uma vez, na mesma transação do bulk_update:
+
+			    def rerender(self, rows, current, executor=None, sandbox=None):
+			        rendered = render_many([{name: row[name] for name in INPUTS} for row in rows],
+			                               executor=executor, sandbox=sandbox)
+			        storage = highlight_storage()
+			        with transaction.atomic():
+			            unchanged = set(Snippet.objects.select_for_update()
+			                            .filter(pk__in=[row['pk'] for row in rows])
+			                            .values_list('pk', 'highlight_version'))
+			            now = timezone.now()
+			            snippets, highlights, released, contents = [], [], [], {}
+			            for row, (key, html) in zip(rows, rendered):
+			                if (row['pk'], row['highlight_version']) not in unchanged:
+			                    continue
+			                snippet = Snippet(pk=row['pk'], render_key=key, render_version=current[row['style']],
+			                                  highlight_version=row['highlight_version'] + 1,
+			                                  highlight_state=Snippet.HIGHLIGHT_READY, updated=now)
+			                if storage == 'blob':
+			                    snippet.highlight_blob_id = key
+			                    contents[key] = {'html': html}
+			                    released.append(row['highlight_blob_id'])
+			                elif storage == 'table':
+			                    highlights.append(SnippetHighlight(snippet_id=row['pk'], html=html))
+			                else:
+			                    snippet.highlighted = html
+			                snippets.append(snippet)
+			            fields = ['render_key', 'render_version', 'highlight_version', 'highlight_state', 'updated']
+			            if storage == 'blob':
+			                fields.append('highlight_blob')
+			                acquire_many(RenderBlob, [snippet.highlight_blob_id for snippet in snippets], contents)
+			            elif storage == 'column':
+			                fields.append('highlighted')
+			            Snippet.objects.bulk_update(snippets, fields)
+			            release_many(RenderBlob, released)
+			            if highlights:
+			                SnippetHighlight.objects.bulk_create(highlights, update_conflicts=True,
+			                                                     unique_fields=['snippet'], update_fields=['html'])
+			        return len(snippets)
+
+
+		# O acquire_many() vem antes do release_many(): uma linha renderizada de novo com a mesma chave que já tinha (só o fingerprint mudou de nome, por exemplo) soma e depois subtrai, e o blob não chega a ser apagado no meio. O INPUTS[1:] é o INPUTS sem o 'code', que agora vem do code_rows().
+
+		# E no rebuild_search_index, rows = [(row['pk'], row['title'], row['code'], row['language']) for row in code_rows(...)].
+
+
+
+		# Na view, a lista precisa trazer o blob junto, senão o descriptor faria uma consulta por linha. O RelatedQuerysetMixin ganha um gancho para relações que o serializer não enxerga (o code_blob é lido pelo campo do modelo, não pelo serializer):
+
+			class RelatedQuerysetMixin:
+			    ...
+			    def get_extra_related(self):
+			        return ()
+
+			    def get_queryset(self):
+			        queryset = super().get_queryset()
+			        serializer_class = self.get_serializer_class()
+			        queryset = optimize_queryset(queryset, serializer_class)
+			        extra = self.get_extra_related()
+			        if extra:
+			            queryset = queryset.select_related(*extra)
+			        if getattr(self, 'action', None) == 'list':
+			            keep = ordering_fields(queryset, self.paginator) + extra
+			            unused = unused_columns(serializer_class, queryset.model, keep)
+			            if unused:
+			                queryset = queryset.defer(*unused)
+			        return queryset
+
+
+			class SnippetViewSet(ConditionalGetMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+
+			    def get_extra_related(self):
+			        return ('code_blob',) if dedup_enabled() else ()
+
+
+		# O extra entra no keep porque o Django não deixa adiar uma chave estrangeira e fazer select_related nela ao mesmo tempo. O unused_columns() também adia o highlight_blob, que a lista não usa.
+
+		# O serializer compilado continua valendo: o code é um campo concreto do modelo, e o instance.code gerado passa pelo descriptor.
+
+		# O índice de busca continua com uma entrada por snippet, porque os filtros e o ranking são por snippet. Para não tokenizar de novo o mesmo conteúdo, o tokenize() (em snippets/search.py) ganha um cache:
+
+			from functools import lru_cache
+
+
+			@lru_cache(maxsize=256)
+			def tokenize(text, language=None):
+			    """
+			    Search terms of `text`, with repeats: every identifier whole and,
+			    when it is compound (snake_case, camelCase, dashed-name), its parts.
+			    The result is cached and shared, hence a tuple.
+			    """
+			    pattern = DASHED_IDENTIFIER if language in DASHED_LANGUAGES else IDENTIFIER
+			    terms = []
+			    for match in pattern.finditer(text):
+			        identifier = match.group().rstrip('-')
+			        terms.append(identifier.lower())
+			        parts = split_identifier(identifier)
+			        if len(parts) > 1:
+			            terms.extend(part.lower() for part in parts)
+			    return tuple(term for term in terms if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH)
+
+
+		# O resultado é o mesmo objeto para todos que pedem o mesmo texto, por isso a tupla: uma lista poderia ser alterada por quem chamou e estragar o cache. Os dois que chamam não mudam, porque só leem: o FTS5Index.update() faz ' '.join(tokenize(...)) e o PostingsIndex.postings() faz Counter(tokenize(...)). O query_terms() não passa pelo tokenize(). O cache guarda até 256 textos de código inteiros, no máximo o MAX_CODE_SIZE de cada um.
+
+
+
+		# Migração. Os campos e as tabelas:
+
+			python manage.py makemigrations snippets
+			python manage.py migrate
+
+
+		# As linhas existentes continuam com o code na própria linha (code_blob nulo), e o descriptor lê as duas formas. Para convertê-las, um comando em snippets/management/commands/dedup_code.py. Ele usa update() por digest, e não bulk_update: o bulk_update lê o valor pelo descriptor, que devolveria o texto do blob e gravaria tudo de volta na coluna.
+
+			from django.core.management.base import BaseCommand
+			from django.db import transaction
+
+			from snippets.blobs import acquire_many, code_digest
+			from snippets.models import CodeBlob, Snippet
+
+
+			class Command(BaseCommand):
+			    help = 'Move inline snippet code into shared CodeBlob rows.'
+
+			    def add_arguments(self, parser):
+			        parser.add_argument('--batch-size', type=int, default=1000)
+
+			    def handle(self, *args, **options):
+			        last_pk = moved = 0
+			        while True:
+			            rows = list(Snippet.objects.filter(pk__gt=last_pk, code_blob__isnull=True).exclude(code='')
+			                        .order_by('pk').values_list('pk', 'code')[:options['batch_size']])
+			            if not rows:
+			                break
+			            groups = {}
+			            for pk, code in rows:
+			                groups.setdefault(code_digest(code), (code, []))[1].append(pk)
+			            with transaction.atomic():
+			                acquire_many(CodeBlob, [code_digest(code) for _, code in rows],
+			                             {digest: {'code': code} for digest, (code, _) in groups.items()})
+			                for digest, (_, pks) in groups.items():
+			                    Snippet.objects.filter(pk__in=pks).update(code_blob_id=digest, code='')
+			            last_pk = rows[-1][0]
+			            moved += len(rows)
+			        self.stdout.write(self.style.SUCCESS('Moved %d snippets into %d blobs'
+			                                             % (moved, CodeBlob.objects.count())))
+
+
+		# O exclude(code='') funciona numa coluna binária porque o CompressedTextField grava textos curtos sem compactar (o '' vira b''). Para o HTML, ligar STORAGE = 'blob' e rodar o rehighlight --restart: ele não acha nada "velho" pelo fingerprint, então, para a conversão, rode-o com um filtro highlight_blob__isnull=True no lugar do stale (ou simplesmente deixe as linhas antigas serem convertidas no próximo save()).
+
+		# Em tutorial/settings.py:
+
+			SNIPPETS_DEDUP = True
+
+			SNIPPETS_HIGHLIGHT = {
+			    ...
+			    'STORAGE': 'blob',
+			}
+
+
+
+		# Um teste das contagens, em snippets/tests.py:
+
+			from snippets.models import CodeBlob, RenderBlob
+
+
+			@override_settings(SNIPPETS_DEDUP=True)
+			class CodeDedupTests(TestCase):
+			    def setUp(self):
+			        self.owner = User.objects.create(username='tom')
+
+			    def test_identical_code_is_stored_once(self):
+			        first = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+			        second = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+			        self.assertEqual(CodeBlob.objects.get().refcount, 2)
+			        self.assertEqual(Snippet.objects.get(pk=second.pk).code, 'print(1)\n')
+			        self.assertEqual(Snippet.objects.filter(pk=first.pk).values_list('code', flat=True).get(), '')
+
+			    def test_references_follow_edits_and_deletes(self):
+			        first = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+			        second = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+			        second.code = 'print(2)\n'
+			        second.save()
+			        self.assertEqual(dict(CodeBlob.objects.values_list('code', 'refcount')),
+			                         {'print(1)\n': 1, 'print(2)\n': 1})
+			        first.delete()
+			        second.delete()
+			        self.assertFalse(CodeBlob.objects.exists())
+
+			    def test_editing_unshared_code_releases_its_blob(self):
+			        snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+			        snippet.code = 'print(2)\n'
+			        snippet.save()
+			        self.assertEqual(list(CodeBlob.objects.values_list('code', 'refcount')), [('print(2)\n', 1)])
+			        with self.settings(SNIPPETS_DEDUP=False):
+			            snippet.code = 'print(3)\n'
+			            snippet.save()
+			        self.assertFalse(CodeBlob.objects.exists())
+			        self.assertEqual(Snippet.objects.get(pk=snippet.pk).code, 'print(3)\n')
+
+			    @override_settings(SNIPPETS_HIGHLIGHT={'STORAGE': 'blob'})
+			    def test_bulk_create_reuses_existing_blobs(self):
+			        Snippet.objects.create_many([{'code': 'print(1)\n'}], owner=self.owner)
+			        Snippet.objects.create_many([{'code': 'print(1)\n'}, {'code': 'print(1)\n'}], owner=self.owner)
+			        self.assertEqual(CodeBlob.objects.get().refcount, 3)
+			        self.assertEqual(RenderBlob.objects.get().refcount, 3)
+			        self.assertEqual(len(set(Snippet.objects.values_list('highlight_blob_id', flat=True))), 1)
+
+			    def test_api_contract_is_unchanged(self):
+			        snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+			        response = self.client.get('/snippets/%d/' % snippet.pk)
+			        self.assertEqual(response.data['code'], 'print(1)\n')
+
+
+	# Versões assíncronas (ASGI) do SnippetViewSet e do UserViewSet
+
+		# Todas as views do tutorial são síncronas. Rodando em ASGI (uvicorn, daphne), o Django executa cada view síncrona numa thread, e a requisição segura essa thread do começo ao fim, inclusive enquanto espera o banco, o cache e a compactação do highlight.
+
+		# O DRF não tem views assíncronas: o APIView.dispatch() é síncrono. Então vamos escrever um mixin com um dispatch() assíncrono, e versões async de list, retrieve, create e highlight. As views síncronas continuam onde estão; as assíncronas ficam em /async/, sobre os mesmos dados.
+
+		# Precisa do Django 4.2+ (os métodos async do ORM, o aget()/afirst()/async for, e o markcoroutinefunction do asgiref 3.6).
+
+		# O que dá e o que não dá para fazer no loop:
+
+			# - o ORM do Django não tem driver assíncrono: aget(), afirst(), async for etc. são a consulta síncrona rodando na thread da requisição (sync_to_async). O que muda é que a thread só fica ocupada durante a consulta, e não durante a requisição inteira
+			# - cada await do ORM é um salto de thread. Uma consulta só por await, e o que é uma sequência de consultas (o save() com as suas transações, a contagem + a página da paginação por número) vai inteiro num salto só
+			# - qualquer acesso ao banco esquecido dentro de uma corrotina (um owner sem select_related, por exemplo) não trava o loop: o Django levanta SynchronousOnlyOperation. Os caminhos abaixo já carregam tudo o que o serializer lê
+			# - o pygments nunca roda no loop: o save() continua mandando a renderização para o backend (a fila com o pool), e a compactação de uma variante expirada do highlight vai para o pool de processos
+
+
+
+		# Crie o arquivo snippets/asyncviews.py com o mixin:
+
+			from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+			from django.core.exceptions import ValidationError
+			from django.http import Http404
+			from django.utils.decorators import classonlymethod
+			from rest_framework import renderers
+			from rest_framework.response import Response
+
+
+			class AsyncViewSetMixin:
+			    """
+			    Dispatch a ViewSet from the event loop under ASGI. Handlers written
+			    as coroutines run on the loop; the others, and the authentication,
+			    permission and throttle checks, run in the request's sync thread.
+			    """
+			    @classonlymethod
+			    def as_view(cls, actions=None, **initkwargs):
+			        return markcoroutinefunction(super().as_view(actions, **initkwargs))
+
+			    async def dispatch(self, request, *args, **kwargs):
+			        self.args = args
+			        self.kwargs = kwargs
+			        request = self.initialize_request(request, *args, **kwargs)
+			        self.request = request
+			        self.headers = self.default_response_headers
+
+			        try:
+			            await sync_to_async(self.initial)(request, *args, **kwargs)
+			            if request.method.lower() in self.http_method_names:
+			                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+			            else:
+			                handler = self.http_method_not_allowed
+			            if iscoroutinefunction(handler):
+			                response = await handler(request, *args, **kwargs)
+			            else:
+			                response = await sync_to_async(handler)(request, *args, **kwargs)
+			        except Exception as exc:
+			            response = self.handle_exception(exc)
+
+			        self.response = self.finalize_response(request, response, *args, **kwargs)
+			        if (isinstance(self.response, Response)
+			                and not isinstance(self.response.accepted_renderer, renderers.BrowsableAPIRenderer)):
+			            self.response.render()
+			        return self.response
+
+			    async def afilter_queryset(self, queryset):
+			        """
+			        filter_queryset() for coroutines: backends with an
+			        afilter_queryset() are awaited, the others must not query.
+			        """
+			        for backend in list(self.filter_backends):
+			            backend = backend()
+			            if hasattr(backend, 'afilter_queryset'):
+			                queryset = await backend.afilter_queryset(self.request, queryset, self)
+			            else:
+			                queryset = backend.filter_queryset(self.request, queryset, self)
+			        return queryset
+
+			    async def aget_object(self):
+			        queryset = await self.afilter_queryset(self.get_queryset())
+			        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+			        try:
+			            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+			        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+			            raise Http404
+			        self.check_object_permissions(self.request, obj)
+			        return obj
+
+			    async def apaginate_queryset(self, queryset):
+			        paginator = self.paginator
+			        if paginator is None:
+			            return None
+			        if hasattr(paginator, 'apaginate_queryset'):
+			            return await paginator.apaginate_queryset(queryset, self.request, view=self)
+			        return await sync_to_async(paginator.paginate_queryset)(queryset, self.request, view=self)
+
+
+		# Alguns detalhes:
+
+			# - o ViewSetMixin.as_view() do DRF devolve uma função síncrona que chama self.dispatch(); com o dispatch() async ela devolve uma corrotina, e o markcoroutinefunction avisa o handler do Django para dar await nela em vez de rodá-la numa thread
+			# - o initial() (autenticação, permissões, throttling) vai para a thread porque o SessionAuthentication carrega a sessão e o usuário do banco. Depois disso o request.user já está carregado, e o check_object_permissions() do IsOwnerOrReadOnly só compara owner_id, sem consulta
+			# - as ações que continuam síncronas (update, destroy, bulk) funcionam do mesmo jeito, só que inteiras na thread
+			# - o render() é chamado no próprio dispatch(). Se ficasse para o Django, ele chamaria o render() numa thread; o JSON já está todo em response.data e não consulta nada. A API navegável consulta (formulários, usuário), e fica de fora
+			# - o aget_object() devolve 404 para um pk mal formado, como o get_object_or_404 do DRF
+
+		# Os filtros ganham um afilter_queryset(). No SnippetFieldFilter (snippets/filters.py), a validação dos parâmetros sai para um método, e só a consulta do owner muda entre as duas versões:
+
+			class SnippetFieldFilter(BaseFilterBackend):
+			    """
+			    Exact filters on language, style, owner (username) and linenos, and
+			    created__gte / created__lte ranges.
+			    """
+			    def field_filters(self, params):
+			        filters, errors = {}, {}
+			        ...   # language, style, linenos, created__gte/lte, como antes
+			        if errors:
+			            raise ValidationError(errors)
+			        return filters
+
+			    def owner_ids(self, username):
+			        return User.objects.filter(username=username).values_list('pk', flat=True)
+
+			    def filter_queryset(self, request, queryset, view):
+			        filters = self.field_filters(request.query_params)
+			        if 'owner' in request.query_params:
+			            filters['owner_id'] = self.owner_ids(request.query_params['owner']).first()
+			            if filters['owner_id'] is None:
+			                return queryset.none()
+			        return queryset.filter(**filters)
+
+			    async def afilter_queryset(self, request, queryset, view):
+			        filters = self.field_filters(request.query_params)
+			        if 'owner' in request.query_params:
+			            filters['owner_id'] = await self.owner_ids(request.query_params['owner']).afirst()
+			            if filters['owner_id'] is None:
+			                return queryset.none()
+			        return queryset.filter(**filters)
+
+
+		# No SnippetSearchFilter (snippets/search.py) a consulta ao índice é SQL direto num cursor, e o Django não tem cursor assíncrono; ela vai para a thread:
+
+			from asgiref.sync import sync_to_async
+
+
+			class SnippetSearchFilter(BaseFilterBackend):
+			    """
+			    ?q= search over title and code, ordered by relevance. Only the
+			    MAX_RESULTS best matches are returned.
+			    """
+			    search_param = 'q'
+
+			    def search(self, terms, queryset):
+			        return get_search_index().search(terms, restrict=queryset, limit=search_settings()['MAX_RESULTS'])
+
+			    def ranked(self, queryset, pks):
+			        if not pks:
+			            return queryset.none()
+			        rank = Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(pks)],
+			                    output_field=IntegerField())
+			        return queryset.filter(pk__in=pks).order_by(rank, 'pk')
+
+			    def filter_queryset(self, request, queryset, view):
+			        terms = query_terms(request.query_params.get(self.search_param, ''))
+			        if not terms:
+			            return queryset
+			        return self.ranked(queryset, self.search(terms, queryset))
+
+			    async def afilter_queryset(self, request, queryset, view):
+			        terms = query_terms(request.query_params.get(self.search_param, ''))
+			        if not terms:
+			            return queryset
+			        return self.ranked(queryset, await sync_to_async(self.search)(terms, queryset))
+
+
+		# O KeysetPagination (snippets/pagination.py) faz uma consulta só por página, então ele ganha a versão async de verdade. A montagem do queryset e a leitura do resultado saem do paginate_queryset():
+
+			    def page_queryset(self, queryset, request):
+			        self.model = queryset.model
+			        self.base_url = request.build_absolute_uri()
+			        position, reverse = self.decode_cursor(request)
+
+			        order = [('-' if reverse else '') + name for name in self.ordering]
+			        queryset = queryset.order_by(*order)
+			        if position is not None:
+			            queryset = queryset.filter(self.seek_filter(position, reverse))
+			        return queryset[:self.page_size + 1], position, reverse
+
+			    def set_page(self, rows, position, reverse):
+			        has_more = len(rows) > self.page_size
+			        rows = rows[:self.page_size]
+			        if reverse:
+			            rows.reverse()
+			            self.has_next, self.has_previous = position is not None, has_more
+			        else:
+			            self.has_next, self.has_previous = has_more, position is not None
+			        self.page = rows
+			        return rows
+
+			    def paginate_queryset(self, queryset, request, view=None):
+			        queryset, position, reverse = self.page_queryset(queryset, request)
+			        return self.set_page(list(queryset), position, reverse)
+
+			    async def apaginate_queryset(self, queryset, request, view=None):
+			        queryset, position, reverse = self.page_queryset(queryset, request)
+			        return self.set_page([row async for row in queryset], position, reverse)
+
+
+		# O CountedPageNumberPagination não ganha versão async: a contagem (ou a leitura do cache de contagens) e a página são duas consultas seguidas, e o apaginate_queryset() da view manda as duas juntas num salto só.
+
+		# O ConditionalGetMixin (snippets/conditional.py) separa a resposta 304 e os cabeçalhos do conditional(), para a versão async usar os mesmos pedaços:
+
+			    def not_modified(self, request, found):
+			        etag, last_modified = found
+			        return get_conditional_response(request, etag=etag,
+			                                        last_modified=timegm(last_modified.utctimetuple()))
+
+			    def tag_response(self, response, found):
+			        if response.status_code == 200:
+			            etag, last_modified = found
+			            response['ETag'] = etag
+			            response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+			        return response
+
+			    def conditional(self, validators, handler, request, *args, **kwargs):
+			        found = validators() if request.method in ('GET', 'HEAD') else None
+			        if found is None:
+			            return handler(request, *args, **kwargs)
+			        response = self.not_modified(request, found)
+			        if response is not None:
+			            return response
+			        return self.tag_response(handler(request, *args, **kwargs), found)
+
+			    async def aconditional(self, validators, handler, request, *args, **kwargs):
+			        found = await validators() if request.method in ('GET', 'HEAD') else None
+			        if found is None:
+			            return await handler(request, *args, **kwargs)
+			        response = self.not_modified(request, found)
+			        if response is not None:
+			            return response
+			        return self.tag_response(await handler(request, *args, **kwargs), found)
+
+			    async def aversion_row(self, *fields):
+			        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+			        lookup = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+			        queryset = await self.afilter_queryset(self.get_queryset())
+			        return await queryset.filter(**lookup).order_by().values_list(*fields).afirst()
+
+			    def detail_tag(self, row):
+			        if row is None:
+			            return None
+			        pk, updated = row
+			        return make_etag('detail', pk, updated.isoformat(), self.request.accepted_renderer.format), updated
+
+			    def detail_validators(self):
+			        return self.detail_tag(self.version_row('pk', 'updated'))
+
+			    async def adetail_validators(self):
+			        return self.detail_tag(await self.aversion_row('pk', 'updated'))
+
+			    async def alist_validators(self):
+			        # Only the generation in the cache is read, no query.
+			        return self.list_validators()
+
+
+		# (o afilter_queryset() vem do AsyncViewSetMixin; as versões async só são chamadas pelas views assíncronas.)
+
+		# O FragmentCacheMixin (snippets/fragments.py) divide o serialize_many() em duas partes: a leitura do cache, que fica no loop, e a serialização dos que faltaram, com o prefetch, que vai para a thread:
+
+			    def cached_fragments(self, instances):
+			        """
+			        The cached entries of `instances`, and the instances whose
+			        fragment for this variant is missing from them.
+			        """
+			        variant = self.fragment_variant()
+			        entries = get_fragment_cache().get_many([user_key(instance.pk) for instance in instances])
+			        missing = [instance for instance in instances
+			                   if variant not in entries.get(user_key(instance.pk), {})]
+			        stats.add(hits=len(instances) - len(missing), misses=len(missing))
+			        return entries, missing
+
+			    def serialize_missing(self, missing, entries):
+			        variant = self.fragment_variant()
+			        prefetch_for(missing, self.get_serializer_class())
+			        data = self.get_serializer(missing, many=True).data
+			        fresh = {}
+			        for instance, fragment in zip(missing, data):
+			            key = user_key(instance.pk)
+			            entry = dict(entries.get(key, {}))
+			            entry[variant] = fragment
+			            entries[key] = fresh[key] = entry
+			        get_fragment_cache().set_many(fresh)
+
+			    def serialize_many(self, instances):
+			        entries, missing = self.cached_fragments(instances)
+			        if missing:
+			            self.serialize_missing(missing, entries)
+			        variant = self.fragment_variant()
+			        return [entries[user_key(instance.pk)][variant] for instance in instances]
+
+			    async def aserialize_many(self, instances):
+			        entries, missing = self.cached_fragments(instances)
+			        if missing:
+			            await sync_to_async(self.serialize_missing)(missing, entries)
+			        variant = self.fragment_variant()
+			        return [entries[user_key(instance.pk)][variant] for instance in instances]
+
+
+		# Com o LocalFragmentCache (o padrão) a leitura do cache é memória do processo. Com o DjangoFragmentCache sobre Redis ou Memcached ela é uma ida à rede bloqueando o loop; se isso pesar, troque get_many por aget_many.
+
+		# Em snippets/highlighting.py, o highlight compactado para as views async. A variante vem do cache com aget(); se ela expirou, o HTML sai do banco na thread e a compactação (brotli/gzip, o que mais pesa) roda no pool de processos do lote:
+
+			import asyncio
+
+			from asgiref.sync import sync_to_async
+
+
+			async def aencoded_highlight(snippet, encoding):
+			    """
+			    encoded_highlight() for coroutines, compressing an evicted variant
+			    on the render pool instead of the event loop.
+			    """
+			    body = await django_cache.aget(variant_key(snippet.render_key, encoding))
+			    if body is None:
+			        html = await sync_to_async(snippet.highlight_html)()
+			        variants = await asyncio.get_running_loop().run_in_executor(
+			            get_render_pool(), compress_variants, html, precompress_encodings())
+			        await django_cache.aset_many({variant_key(snippet.render_key, name): variant
+			                                      for name, variant in variants.items()},
+			                                     getattr(settings, 'SNIPPETS_HIGHLIGHT', {}).get('PRECOMPRESS_TTL', 24 * 60 * 60))
+			        body = variants[encoding]
+			    return body
+
+
+
+		# No SnippetViewSet (snippets/views.py), o ETag do highlight sai para um método, usado pelas duas versões:
+
+			    def highlight_tag(self, row):
+			        if row is None or row[3] != Snippet.HIGHLIGHT_READY:
+			            return None
+			        pk, updated, version, _ = row
+			        return make_etag('highlight', pk, version, self.highlight_encoding()), updated
+
+			    def highlight_validators(self):
+			        return self.highlight_tag(self.version_row('pk', 'updated', 'highlight_version', 'highlight_state'))
+
+
+		# E as views assíncronas, no fim de snippets/asyncviews.py:
+
+			from django.db import transaction
+			from django.http import HttpResponse
+			from django.utils.cache import patch_vary_headers
+			from rest_framework import status
+			from rest_framework.decorators import action
+
+			from snippets.highlighting import aencoded_highlight
+			from snippets.models import Snippet
+			from snippets.views import SnippetViewSet, UserViewSet
+
+
+			class AsyncSnippetViewSet(AsyncViewSetMixin, SnippetViewSet):
+			    """
+			    SnippetViewSet with `list`, `retrieve`, `create` and `highlight`
+			    as coroutines, for ASGI servers.
+			    """
+			    async def list(self, request, *args, **kwargs):
+			        return await self.aconditional(self.alist_validators, self.alist, request, *args, **kwargs)
+
+			    async def alist(self, request, *args, **kwargs):
+			        queryset = await self.afilter_queryset(self.get_queryset())
+			        page = await self.apaginate_queryset(queryset)
+			        if page is None:
+			            instances = [instance async for instance in queryset]
+			            return Response(self.get_serializer(instances, many=True).data)
+			        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+			    async def retrieve(self, request, *args, **kwargs):
+			        return await self.aconditional(self.adetail_validators, self.aretrieve, request, *args, **kwargs)
+
+			    async def aretrieve(self, request, *args, **kwargs):
+			        instance = await self.aget_object()
+			        return Response(self.get_serializer(instance).data)
+
+			    async def create(self, request, *args, **kwargs):
+			        serializer = self.get_serializer(data=request.data)
+			        await sync_to_async(self.validate_and_create)(serializer)
+			        data = serializer.data
+			        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+			    def validate_and_create(self, serializer):
+			        serializer.is_valid(raise_exception=True)
+			        with transaction.atomic():
+			            self.perform_create(serializer)
+
+			    @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
+			    async def highlight(self, request, *args, **kwargs):
+			        response = await self.aconditional(self.ahighlight_validators, self.arender_highlight,
+			                                           request, *args, **kwargs)
+			        patch_vary_headers(response, ['Accept-Encoding'])
+			        return response
+
+			    async def ahighlight_validators(self):
+			        return self.highlight_tag(await self.aversion_row('pk', 'updated', 'highlight_version', 'highlight_state'))
+
+			    async def arender_highlight(self, request, *args, **kwargs):
+			        snippet = await self.aget_object()
+			        if snippet.highlight_state == Snippet.HIGHLIGHT_PENDING:
+			            return Response('pending', status=status.HTTP_202_ACCEPTED,
+			                            headers={'Retry-After': '1'})
+			        encoding = self.highlight_encoding()
+			        if encoding is None:
+			            response = Response(await sync_to_async(snippet.highlight_html)())
+			        else:
+			            response = HttpResponse(await aencoded_highlight(snippet, encoding),
+			                                    content_type='text/html; charset=utf-8')
+			            response['Content-Encoding'] = encoding
+			        return response
+
+
+			class AsyncUserViewSet(AsyncViewSetMixin, UserViewSet):
+			    """
+			    UserViewSet with `list` and `retrieve` as coroutines, for ASGI
+			    servers.
+			    """
+			    async def list(self, request, *args, **kwargs):
+			        queryset = await self.afilter_queryset(self.get_queryset())
+			        page = await self.apaginate_queryset(queryset)
+			        if page is None:
+			            return Response(await self.aserialize_many([user async for user in queryset]))
+			        return self.get_paginated_response(await self.aserialize_many(page))
+
+			    async def retrieve(self, request, *args, **kwargs):
+			        data = await self.aserialize_many([await self.aget_object()])
+			        return Response(data[0])
+
+
+		# Sobre cada ação:
+
+			# - list: os filtros, a página e o serializer são os mesmos da view síncrona, e o ETag da lista também. O serializer roda no loop, porque o RelatedQuerysetMixin já juntou o owner (e o code_blob, com o SNIPPETS_DEDUP) na consulta da página. Sem paginação a lista não sai em streaming: o StreamingHttpResponse com um iterador síncrono seria lido inteiro na thread pelo Django. A exportação em streaming continua na rota síncrona
+			# - retrieve: duas consultas curtas, a da versão (para o 304) e a do objeto, cada uma num await
+			# - create: o save() é uma sequência de consultas numa transação (o RenderCache, os blobs, o on_commit para a fila do highlight), e vai inteiro para a thread com a validação, dentro de um atomic() (o ATOMIC_REQUESTS não vale para views assíncronas). O serializer.data depois do save() não consulta: o owner é o próprio request.user
+			# - highlight: a linha vem sem code e highlighted (o get_queryset() do highlight já adia os dois); o corpo compactado vem do cache; só o HTML de uma variante expirada sai do banco
+			# - o UserViewSet serve do cache de fragmentos no loop, e só os usuários que faltaram vão para a thread, com o prefetch dos snippets
+
+		# O highlight_encoding(), o get_queryset() e o get_paginated_response() são os do SnippetViewSet: não consultam nada.
+
+		# As rotas, em snippets/urls.py. O SimpleRouter não tem a página raiz, cujo nome (api-root) já é usado pelo router principal:
+
+			from rest_framework.routers import SimpleRouter
+
+			from snippets.asyncviews import AsyncSnippetViewSet, AsyncUserViewSet
+
+			async_router = SimpleRouter()
+			async_router.register(r'snippets', AsyncSnippetViewSet, basename='async-snippet')
+			async_router.register(r'users', AsyncUserViewSet, basename='async-user')
+
+			urlpatterns = [
+			    ...
+			    path('async/', include(async_router.urls)),
+			    path('', include(router.urls)),
+			]
+
+
+		# As urls dentro das respostas (url, highlight, owner) continuam apontando para as rotas síncronas: o serializer usa os nomes snippet-detail e user-detail. O recurso é o mesmo.
+
+		# Para rodar em ASGI (o tutorial/asgi.py vem do startproject):
+
+			pip install uvicorn
+			uvicorn tutorial.asgi:application --workers 4
+
+
+		# Com o runserver ou outro servidor WSGI as rotas /async/ continuam funcionando (o Django roda a corrotina com async_to_sync), só que sem ganho nenhum.
+
+
+
+		# Benchmark de carga. Crie bench_async.py ao lado do manage.py. Ele monta um banco SQLite descartável num arquivo (o servidor roda em outro processo e não enxerga o banco de teste em memória do benchutils), sobe um uvicorn com esse banco e abre 1.000 leitores simultâneos, primeiro nas rotas síncronas e depois nas /async/, com a mesma mistura de requisições (detalhe, highlight e páginas da lista):
+
+			import asyncio
+			import os
+			import random
+			import socket
+			import statistics
+			import subprocess
+			import sys
+			import tempfile
+			import time
+
+			import django
+			import httpx
+			from django.conf import settings
+
+			os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tutorial.settings')
+
+
+			def use_database(path):
+			    settings.DATABASES['default']['NAME'] = path
+			    django.setup()
+
+
+			def serve(path, port):
+			    use_database(path)
+			    import uvicorn
+			    from django.core.asgi import get_asgi_application
+			    uvicorn.run(get_asgi_application(), host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+
+			def seed(path, count):
+			    use_database(path)
+			    from django.contrib.auth.models import User
+			    from django.core.management import call_command
+
+			    from snippets.models import Snippet
+
+			    call_command('migrate', verbosity=0)
+			    owner = User.objects.create(username='bench')
+			    Snippet.objects.create_many([{'code': 'print(%d)\n' % i} for i in range(count)], owner=owner)
+			    return list(Snippet.objects.values_list('pk', flat=True))
+
+
+			def wait_for(port, timeout=30):
+			    deadline = time.monotonic() + timeout
+			    while time.monotonic() < deadline:
+			        try:
+			            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+			            return
+			        except OSError:
+			            time.sleep(0.1)
+			    raise RuntimeError('server did not start on port %d' % port)
+
+
+			async def reader(client, urls, deadline, latencies, failures):
+			    while time.perf_counter() < deadline:
+			        url = random.choice(urls)
+			        start = time.perf_counter()
+			        try:
+			            response = await client.get(url)
+			        except httpx.HTTPError:
+			            failures.append(url)
+			            continue
+			        if response.status_code == 200:
+			            latencies.append(time.perf_counter() - start)
+			        else:
+			            failures.append(url)
+
+
+			async def load(port, urls, readers, seconds):
+			    limits = httpx.Limits(max_connections=readers, max_keepalive_connections=readers)
+			    latencies, failures = [], []
+			    async with httpx.AsyncClient(base_url='http://127.0.0.1:%d' % port, limits=limits, timeout=60) as client:
+			        # Warm-up: open the connections and fill the caches.
+			        await asyncio.gather(*[client.get(url) for url in urls[:readers]])
+			        deadline = time.perf_counter() + seconds
+			        await asyncio.gather(*[reader(client, urls, deadline, latencies, failures)
+			                               for _ in range(readers)])
+			    return latencies, failures
+
+
+			def main(count=10000, readers=1000, seconds=30, port=8765):
+			    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+			    pks = seed(path, count)
+			    pages = max(1, count // settings.REST_FRAMEWORK.get('PAGE_SIZE', 10))
+			    server = subprocess.Popen([sys.executable, __file__, 'serve', path, str(port)])
+			    try:
+			        wait_for(port)
+			        for label, prefix in (('sync', ''), ('async', '/async')):
+			            sample = random.sample(pks, min(len(pks), readers))
+			            urls = (['%s/snippets/%d/' % (prefix, pk) for pk in sample]
+			                    + ['%s/snippets/%d/highlight/' % (prefix, pk) for pk in sample[:readers // 4]]
+			                    + ['%s/snippets/?page=%d' % (prefix, random.randint(1, pages)) for _ in range(readers // 4)])
+			            latencies, failures = asyncio.run(load(port, urls, readers, seconds))
+			            p99 = statistics.quantiles(latencies, n=100)[98]
+			            print('%-6s %8.0f req/s   p50 %7.1f ms   p99 %7.1f ms   %d errors'
+			                  % (label, len(latencies) / seconds, statistics.median(latencies) * 1000,
+			                     p99 * 1000, len(failures)))
+			    finally:
+			        server.terminate()
+			        server.wait()
+
+
+			if __name__ == '__main__':
+			    if sys.argv[1:2] == ['serve']:
+			        serve(sys.argv[2], int(sys.argv[3]))
+			    else:
+			        main(*[int(value) for value in sys.argv[1:]])
+
+
+			pip install uvicorn httpx
+			ulimit -n 8192
+			python bench_async.py 10000 1000 30
+
+
+		# Os argumentos são: número de snippets, leitores simultâneos e segundos de carga em cada modo. O ulimit é porque cada leitor é uma conexão aberta, dos dois lados.
+
+		# Como ler o resultado:
+
+			# - os dois modos rodam no mesmo processo do uvicorn, então a comparação é só das views: a síncrona segura uma thread por requisição do começo ao fim, a assíncrona só durante as consultas
+			# - o p99 é o número que mais muda: com 1.000 leitores, na síncrona as requisições esperam na fila das threads; na assíncrona elas esperam só pelo banco
+			# - com SQLite local a consulta é muito rápida e o throughput dos dois modos fica perto. A diferença cresce com a latência do banco (PostgreSQL em outra máquina), com variantes do highlight expiradas no cache, e com clientes lentos
+			# - o cliente também é Python. Se ele chegar a 100% de CPU, o número medido é o do cliente: diminua os leitores ou rode o cliente em outra máquina
+			# - o SQLite aceita muitos leitores ao mesmo tempo, mas não dá para levar o número a sério para escrita; para medir o create, use o PostgreSQL
+
+
+
+		# Testes em snippets/tests.py. O TestCase aceita métodos async, e o self.async_client faz a requisição pelo caminho ASGI:
+
+			from asgiref.sync import sync_to_async
+
+
+			class AsyncViewTests(TestCase):
+			    def setUp(self):
+			        self.owner = User.objects.create(username='tom')
+			        self.snippet = Snippet.objects.create(owner=self.owner, code='print(1)\n')
+
+			    async def test_retrieve_matches_sync_view(self):
+			        expected = await self.async_client.get('/snippets/%d/' % self.snippet.pk)
+			        response = await self.async_client.get('/async/snippets/%d/' % self.snippet.pk)
+			        self.assertEqual(response.status_code, 200)
+			        self.assertEqual(response.json(), expected.json())
+			        self.assertEqual(response['ETag'], expected['ETag'])
+			        missing = await self.async_client.get('/async/snippets/0/')
+			        self.assertEqual(missing.status_code, 404)
+
+			    async def test_list_and_highlight(self):
+			        response = await self.async_client.get('/async/snippets/')
+			        self.assertEqual([item['id'] for item in response.json()['results']], [self.snippet.pk])
+			        response = await self.async_client.get('/async/snippets/%d/highlight/' % self.snippet.pk)
+			        self.assertEqual(response.status_code, 200)
+			        self.assertIn('print', response.content.decode())
+
+			    async def test_create(self):
+			        await sync_to_async(self.async_client.force_login)(self.owner)
+			        response = await self.async_client.post('/async/snippets/', {'code': 'print(2)\n'},
+			                                                content_type='application/json')
+			        self.assertEqual(response.status_code, 201)
+			        self.assertEqual(await Snippet.objects.filter(owner=self.owner).acount(), 2)
+
+
+		# Os testes usam o ImmediateBackend do settings de teste, então o highlight já está pronto depois do create().
+
+
+		# tom
+			http http://127.0.0.1:8000/async/snippets/
+			http http://127.0.0.1:8000/async/snippets/1/highlight/ Accept-Encoding:br
+
+
+	# Leitura em lote: vários snippets por id numa requisição só
+
+		# Os frontends montam páginas que citam de 50 a 200 snippets e chamam /snippets/<pk>/ uma vez para cada um. Cada snippet custa uma requisição, uma verificação de permissão e uma consulta.
+
+		# Uma ação nova no SnippetViewSet, GET /snippets/batch/?ids=3,1,2. Ela carrega todos numa consulta só (pk__in, com o owner junto), aplica as permissões de uma vez e devolve um item por id pedido, na ordem do pedido, no mesmo formato das respostas do bulk: {"id", "status", "data"} para os encontrados e {"id", "status": 404} para os que não existem ou que o usuário não pode ler.
+
+		# Em snippets/views.py:
+
+			from rest_framework.exceptions import ValidationError
+
+
+			class SnippetViewSet(ConditionalGetMixin, RelatedQuerysetMixin, StreamingListMixin, viewsets.ModelViewSet):
+			    ...
+			    batch_max_ids = 200
+
+			    def get_permitted_queryset(self):
+			        """
+			        The queryset with every permission that can be expressed in
+			        SQL applied to it.
+			        """
+			        return self.filter_permitted(self.filter_queryset(self.get_queryset()))
+
+			    def filter_permitted(self, queryset):
+			        for permission in self.get_permissions():
+			            if hasattr(permission, 'filter_queryset'):
+			                queryset = permission.filter_queryset(self.request, queryset, self)
+			        return queryset
+
+			    def batch_ids(self):
+			        """
+			        The ids of ?ids=1,2,3, in request order.
+			        """
+			        try:
+			            ids = [int(pk) for pk in self.request.query_params.get('ids', '').split(',') if pk.strip()]
+			        except ValueError:
+			            raise ValidationError({'ids': ['Expected a comma-separated list of ids.']})
+			        if not ids:
+			            raise ValidationError({'ids': ['This field is required.']})
+			        if len(ids) > self.batch_max_ids:
+			            raise ValidationError({'ids': ['At most %d ids per request.' % self.batch_max_ids]})
+			        return ids
+
+			    def batch_results(self, ids, found):
+			        """
+			        One result per requested id, in request order, for the snippets
+			        in `found` ({pk: snippet}) the user may read.
+			        """
+			        checks = [permission for permission in self.get_permissions()
+			                  if not hasattr(permission, 'filter_queryset')]
+			        readable = [snippet for snippet in found.values()
+			                    if all(permission.has_object_permission(self.request, self, snippet)
+			                           for permission in checks)]
+			        data = dict(zip([snippet.pk for snippet in readable],
+			                        self.get_serializer(readable, many=True).data))
+			        return [{'id': pk, 'status': status.HTTP_200_OK, 'data': data[pk]} if pk in data
+			                else {'id': pk, 'status': status.HTTP_404_NOT_FOUND}
+			                for pk in ids]
+
+			    @action(detail=False)
+			    def batch(self, request, *args, **kwargs):
+			        """
+			        GET ?ids=1,2,3 returns those snippets in request order, with a
+			        404 marker for each id that is missing or not readable.
+			        """
+			        ids = self.batch_ids()
+			        found = self.get_permitted_queryset().in_bulk(set(ids))
+			        return Response(self.batch_results(ids, found))
+
+
+		# Como funciona:
+
+			# - a consulta é o get_permitted_queryset() da seção do bulk: o get_queryset() (com o select_related('owner') do RelatedQuerysetMixin, e o code_blob com o SNIPPETS_DEDUP), os filtros da view e as permissões que sabem virar SQL (o filter_queryset() do IsOwnerOrReadOnly). O in_bulk() faz um único SELECT ... WHERE id IN (...)
+			# - as permissões sem filter_queryset() (o IsAuthenticatedOrReadOnly, por exemplo) rodam o has_object_permission() em memória, uma vez por snippet, sem consulta. O check_permissions() da view já rodou no initial(), como em qualquer ação
+			# - todos os encontrados passam por um serializer só (many=True), então o serializer compilado vale também aqui, e cada item sai igual ao do /snippets/<pk>/
+			# - um id repetido aparece repetido na resposta, mas é buscado uma vez só
+			# - um id que não existe e um id que o usuário não pode ler dão o mesmo 404, como no bulk: não vazamos quais ids existem
+			# - os filtros da view também valem: /snippets/batch/?ids=1,2&language=python marca como 404 os que não são python
+			# - o limite (batch_max_ids, 200 por padrão) segura o tamanho do IN e da resposta. Um id que não é número, a lista vazia ou o limite estourado dão 400 com o erro no campo ids
+			# - a resposta não tem ETag: ela mistura vários snippets, e o cache HTTP de cada um continua no /snippets/<pk>/
+
+		# O router cria a rota sozinho: GET /snippets/batch/. As rotas das ações com detail=False vêm antes da rota de detalhe, então "batch" nunca é lido como uma pk.
+
+		# O get_permitted_queryset() da seção do bulk foi dividido em dois: o filter_permitted() aplica as permissões que viram SQL, e é ele que a versão assíncrona usa também, assim os dois caminhos não têm como se separar.
+
+		# Na versão assíncrona (snippets/asyncviews.py), só a consulta muda: os filtros da view passam pelo afilter_queryset(), e a busca é o ain_bulk():
+
+			class AsyncSnippetViewSet(AsyncViewSetMixin, SnippetViewSet):
+			    ...
+
+			    async def aget_permitted_queryset(self):
+			        """
+			        get_permitted_queryset() for coroutines.
+			        """
+			        return self.filter_permitted(await self.afilter_queryset(self.get_queryset()))
+
+			    @action(detail=False)
+			    async def batch(self, request, *args, **kwargs):
+			        ids = self.batch_ids()
+			        queryset = await self.aget_permitted_queryset()
+			        found = await queryset.ain_bulk(set(ids))
+			        return Response(self.batch_results(ids, found))
+
+
+
+		# Testes em snippets/tests.py:
+
+			class BatchReadTests(TestCase):
+			    def setUp(self):
+			        owner = User.objects.create(username='tom')
+			        self.first = Snippet.objects.create(owner=owner, code='print(1)\n')
+			        self.second = Snippet.objects.create(owner=owner, code='print(2)\n')
+
+			    def test_results_follow_request_order(self):
+			        ids = [self.second.pk, 0, self.first.pk]
+			        with self.assertNumQueries(1):
+			            response = self.client.get('/snippets/batch/', {'ids': ','.join(map(str, ids))})
+			        self.assertEqual(response.status_code, 200)
+			        self.assertEqual([(item['id'], item['status']) for item in response.data], [
+			            (self.second.pk, 200), (0, 404), (self.first.pk, 200)])
+			        detail = self.client.get('/snippets/%d/' % self.first.pk)
+			        self.assertEqual(response.data[2]['data'], detail.data)
+
+			    async def test_async_results_follow_request_order(self):
+			        ids = [self.second.pk, 0, self.first.pk]
+			        query = {'ids': ','.join(map(str, ids))}
+			        response = await self.async_client.get('/async/snippets/batch/', query)
+			        self.assertEqual(response.status_code, 200)
+			        self.assertEqual([(item['id'], item['status']) for item in response.json()], [
+			            (self.second.pk, 200), (0, 404), (self.first.pk, 200)])
+			        expected = await self.async_client.get('/snippets/batch/', query)
+			        self.assertEqual(response.json(), expected.json())
+
+			    def test_invalid_ids_are_rejected(self):
+			        for value in ('', '1,x', ','.join(['1'] * 201)):
+			            response = self.client.get('/snippets/batch/', {'ids': value})
+			            self.assertEqual(response.status_code, 400)
+			            self.assertIn('ids', response.data)
+
+
+		# tom
+			http "http://127.0.0.1:8000/snippets/batch/?ids=3,1,999"
+				# [{"id": 3, "status": 200, "data": {...}},
+				#  {"id": 1, "status": 200, "data": {...}},
+				#  {"id": 999, "status": 404}]
\ No newline at end of file